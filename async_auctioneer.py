@@ -0,0 +1,387 @@
+#!/usr/bin/python
+
+''' An asyncio implementation of the auction server.
+
+    AsyncAuctioneer speaks the same protocol and keeps the same
+    auction semantics as the Auctioneer (both are built on top of
+    Server_Base.parse_messages), but uses asyncio streams with one
+    task per connection. Sends to the peers and to the bidders are
+    buffered by their StreamWriters, so that neither sync() nor a
+    slow bidder ever block the whole server.
+'''
+
+import asyncio, signal, socket, sys, time
+from socket import error as SocketError
+
+from base import Server_Base, log
+
+# imports from own code
+import serializer as serial
+import messages, errors, transfer
+
+class AsyncAuctioneer(Server_Base):
+
+    ''' The asyncio-based counterpart of the Auctioneer class.
+        It is constructed with the same parameters.
+    '''
+
+    # size of a single read() from a connection
+    BUFF_SIZE = 2048
+
+    def __init__(self, *args, **kwargs):
+
+        super().__init__(*args, **kwargs)
+
+        # incoming (other_servers) and outgoing (other_writers)
+        # links with the other auctioneers
+        self.other_servers = set()
+        self.other_writers = []
+
+    def sync(self, msg):
+
+        ''' queues a message for the other servers. The messages
+            queued during a loop iteration are sent together by a
+            single flush_sync() callback. '''
+
+        if not self.outbox:
+            self.loop.call_soon(self.flush_sync)
+
+        super().sync(msg)
+
+    def flush_sync(self):
+
+        ''' writes the queued sync messages to every other server,
+            without waiting for them to be written on the sockets '''
+
+        self.watchdog.enter('sync')
+
+        # the peers only hear about events that are on disk
+        self.commit_log()
+
+        data = self.sync_batch()
+
+        if data:
+            for writer in self.other_writers:
+                writer.write(data)
+
+            self.metrics.incr('bytes_out', len(data) * len(self.other_writers))
+
+        self.watchdog.leave()
+
+    def peer_backlog(self):
+
+        ''' bytes buffered by the writers of the links to the other
+            servers. During a state transfer, by the writer it stands
+            in for. '''
+
+        return [getattr(writer, 'link', writer).transport
+                                               .get_write_buffer_size()
+                for writer in self.other_writers]
+
+    def respond(self, writer, response_list):
+
+        ''' queues a list of messages for a connection '''
+
+        if response_list:
+            codec = self.codec(writer)
+            data = b''.join(i.send(codec) for i in response_list)
+            writer.write(data)
+
+            self.metrics.incr('bytes_out', len(data))
+
+    def broadcast(self):
+
+        ''' queues all the pending messages for every bidder '''
+
+        (pending, self.pending) = (self.pending, [])
+
+        if not pending: return
+
+        # encode once per codec in use, and share the
+        # buffers among all the writers
+        (sendbuffs, sizes) = ({}, {})
+        (recipients, sent) = (0, 0)
+
+        for session in self.sessions.clients():
+            codec = session.codec
+            if codec not in sendbuffs:
+                sendbuffs[codec] = [i.send(codec) for i in pending]
+                sizes[codec] = sum(len(i) for i in sendbuffs[codec])
+            session.output.writelines(sendbuffs[codec])
+            sent += sizes[codec]
+            recipients += 1
+
+            # disconnect a bidder that has not read its messages
+            # for too long: its task then closes the session
+            transport = session.output.transport
+            if transport.get_write_buffer_size() > self.MAX_BUFFERED:
+                log('disconnecting a stuck bidder: {0} bytes queued'.format(
+                        transport.get_write_buffer_size()))
+                self.metrics.incr('sessions.overflowed')
+                transport.abort()
+
+        self.metrics.observe('broadcast_fanout', recipients)
+        self.metrics.incr('bytes_out', sent)
+
+    def call_at(self, when, callback, *args):
+
+        ''' lot timers run on the asyncio loop, whose clock is
+            time.monotonic() as well '''
+
+        return self.loop.call_at(when, self.on_timer, callback, args)
+
+    def on_timer(self, callback, args):
+
+        ''' runs a lot timer and delivers the messages it queued '''
+
+        start = time.perf_counter()
+        self.watchdog.enter('iteration')
+
+        callback(*args)
+        self.commit_log()
+        self.broadcast()
+
+        self.watchdog.clear()
+        self.metrics.timing('iteration_ms', time.perf_counter() - start)
+
+    async def handle_connection(self, reader, writer):
+
+        ''' task serving a single connection. By convention the
+            first accepted connections are the other auctioneers. '''
+
+        if len(self.other_servers) < len(self.peers):
+            self.other_servers.add(writer)
+            if len(self.other_servers) == len(self.peers):
+                self.peers_connected.set()
+
+        # wait until the links with the peers are set up
+        await self.ready.wait()
+
+        peer = writer in self.other_servers
+
+        # a rejoining server takes bidders once it has caught up
+        if not peer:
+            await self.serving.wait()
+
+        if not peer and self.sessions.full():
+
+            # admission control: tell the bidder why, then hang up
+            log('rejecting {0}: too many connections'.format(
+                    writer.get_extra_info('peername')))
+            writer.write(messages.ErrorMsg(
+                    username=None, error=errors.max_connections).send())
+            writer.close()
+            return
+
+        session = self.sessions.open(writer, writer,
+                                     serial.FrameDecoder(), peer=peer)
+        decoder = session.decoder
+
+        if not peer:
+
+            log('new connection from {0}'.format(
+                    writer.get_extra_info('peername')))
+
+            # greet the bidder, possibly starting the auction
+            response = self.greet()
+            self.commit_log()
+            self.respond(writer, response)
+            self.broadcast()
+
+        try:
+            while True:
+
+                data = await reader.read(self.BUFF_SIZE)
+
+                # readable connections always have data
+                if not data: break
+
+                start = time.perf_counter()
+                self.watchdog.enter('iteration')
+
+                self.sessions.touch(session)
+                self.metrics.incr('bytes_in', len(data))
+
+                # keep incomplete frames for the next read
+                decoder.feed(data)
+
+                # the messages of a read form a group: they are
+                # logged with one commit before anything is sent
+                response = self.handle_frames(decoder, writer)
+                self.commit_log()
+                self.respond(writer, response)
+                self.broadcast()
+
+                # there are no loop iterations to time here: the
+                # handling of each read or timer is timed instead
+                self.watchdog.clear()
+                self.metrics.timing('iteration_ms',
+                                    time.perf_counter() - start)
+
+                # apply backpressure to this connection only
+                await writer.drain()
+
+        except ConnectionError:
+            pass
+
+        finally:
+            # whatever ends the task, the session is closed
+            log('closing {0}'.format(writer.get_extra_info('peername')))
+
+            self.close_connection(writer)
+
+    def close_connection(self, writer):
+
+        ''' forgets the session of a connection, along with its
+            registration, and closes it. The task serving the
+            connection then sees the end of stream. '''
+
+        self.forget_session(writer)
+        writer.close()
+
+    def reconnect_peer(self, address, wants_state):
+
+        ''' links again to a restarted server, in a task of its own '''
+
+        self.loop.create_task(self.relink_peer(address, wants_state))
+
+    async def relink_peer(self, address, wants_state):
+
+        try:
+            index = self.peers.index(address)
+        except ValueError:
+            log('unknown server {0}:{1}'.format(*address))
+            return
+
+        # drop the previous link, along with anything queued on it
+        self.other_writers[index].close()
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        await self.connect_peer(sock, address)
+        (_, writer) = await asyncio.open_connection(sock=sock)
+
+        (self.others[index], self.other_writers[index]) = (sock, writer)
+
+        if wants_state:
+            self.other_writers[index] = transfer.StateTransfer(
+                    self, writer, writer.transport.get_write_buffer_size)
+            self.other_writers[index].start()
+
+    async def handle_admin(self, reader, writer):
+
+        ''' answers a request on the admin socket, then hangs up '''
+
+        try:
+            request = await reader.read(512)
+
+            # a request with non-ASCII bytes gets the usage reply
+            if request:
+                writer.write(self.admin_reply(
+                        str(request, 'ascii', 'replace')))
+                await writer.drain()
+
+        except ConnectionError:
+            pass
+
+        finally:
+            writer.close()
+
+    def caught_up(self):
+
+        ''' starts serving bidders after a rejoin '''
+
+        self.serving.set()
+
+    async def connect_peer(self, sock, address, attempts=30):
+
+        ''' connects to another server, retrying while it
+            is not listening yet '''
+
+        sock.setblocking(0)
+
+        for attempt in range(attempts):
+            try:
+                return await self.loop.sock_connect(sock, address)
+            except ConnectionRefusedError:
+                if attempt == attempts - 1: raise
+                await asyncio.sleep(0.2)
+
+    async def main(self):
+
+        ''' sets up the listening socket and the peer links,
+            then serves connections forever '''
+
+        loop = self.loop = asyncio.get_running_loop()
+
+        loop.add_signal_handler(signal.SIGINT, self.sigint_handler,
+                                signal.SIGINT, None)
+
+        for signum in (signal.SIGUSR1, signal.SIGUSR2):
+            loop.add_signal_handler(signum, self.profile_handler,
+                                    signum, None)
+
+        self.peers_connected = asyncio.Event()
+        self.ready = asyncio.Event()
+        self.serving = asyncio.Event()
+
+        # try to bind to socket, exit if failure
+        try:
+            self.server.bind((self.host, self.port))
+        except SocketError:
+            print('Error binding to {0}:{1}'.format(self.host, self.port))
+            self.server.close()
+            exit(1)
+
+        server = await asyncio.start_server(self.handle_connection,
+                                            sock=self.server,
+                                            backlog=self.max_connections)
+
+        if self.admin:
+            await asyncio.start_unix_server(self.handle_admin,
+                                            sock=self.admin)
+
+        # sleep for a second to ensure other servers have been bound
+        await asyncio.sleep(1)
+
+        for (index, (other, peer)) in enumerate(zip(self.others,
+                                                    self.peers)):
+            await self.connect_peer(other, peer)
+            (_, writer) = await asyncio.open_connection(sock=other)
+            self.other_writers.append(writer)
+
+            # a restarted server asks the other servers to link to
+            # it again, and the first one for the state of the auction
+            if self.joining:
+                writer.write(self.join_msg(index).send(self.peer_codec))
+
+        await self.peers_connected.wait()
+        self.ready.set()
+
+        if not self.joining:
+            self.serving.set()
+
+        # timers of the restored lots, the idle bidders
+        # and the snapshots
+        self.start_timers()
+
+        async with server:
+            await server.serve_forever()
+
+    def serve(self):
+
+        ''' main server loop '''
+
+        asyncio.run(self.main())
+
+
+if __name__ == '__main__':
+
+    # ./async_auctioneer.py port other_port [other_port ...]
+    port, other_ports = 50000, [50005]
+    if len(sys.argv) >= 3:
+        port = int(sys.argv[1])
+        other_ports = [int(i) for i in sys.argv[2:]]
+
+    server = AsyncAuctioneer(port=port,
+                             peers=[('localhost', i) for i in other_ports])
+    server.serve()
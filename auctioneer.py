@@ -1,15 +1,15 @@
 #!/usr/bin/python
 
-import socket, sys, select, signal, time
+import socket, sys, select, time
 import random
 from socket import error as SocketError
 
 
-from base import Server_Base
+from base import Server_Base, log
 
 # imports from own code
 import serializer as serial
-import messages, errors
+import messages, errors, eventloop, transfer
 
 M = 2
 # L is the timeout in seconds for bidding actions
@@ -36,49 +36,147 @@ def item_new(about, price):
         'timeouts': 0
     }
 
+def connect_peer(sock, address, attempts=30):
+
+    ''' connects to another server, retrying while it
+        is not listening yet '''
+
+    for attempt in range(attempts):
+        try:
+            return sock.connect(address)
+        except ConnectionRefusedError:
+            if attempt == attempts - 1: raise
+            time.sleep(0.2)
+
 class Auctioneer(Server_Base):
 
     ''' The Auctioneer class emulates an auctioning web server.
         It listens, by default, on port 50000 of localhost and
         for 27 connections maximum (25 clients + other server +
-        sync server).
+        sync server). More servers can share the auction, see the
+        peers parameter of Server_Base.
 
     '''
 
-    def lookup_registrar(self, conn):
+    # size of a single recv() from a connection
+    BUFF_SIZE = 2048
 
-        ''' lookup a specific connection in the registrar table 
-            and return its corresponding username '''
+    def handle_responses(self, response_list, elem):
 
-        for (k, v) in self.registrar_table.items():
-            if conn == v: return k
+        ''' this function holds the messages in response_list
+            for a specific connection until the end of the loop
+            iteration, when the events they answer have been
+            logged (see flush_responses()).
+        '''
 
-        # if none found, return None (should be unreachable)
-        return None
+        if response_list:
+            self.responses.append((elem, response_list))
 
-    def handle_responses(self, response_list, elem):
+    def flush_responses(self):
 
-        ''' this function sends all the messages in 
-            response_list to a specifiec connection
-            by using select until the connection is
-            writable.
+        ''' queues the responses of this loop iteration on the
+            output queues of their connections. It never blocks:
+            a slow connection only delays its own messages.
         '''
 
-        if not response_list: return
+        (responses, self.responses) = (self.responses, [])
 
-        # send every message that is in response list
-        # to the provided element
+        for (elem, response_list) in responses:
 
-        # create a byte buffer with all messages to be sent
-        sendbuff = b''.join(i.send() for i in response_list)
+            # the connection may have been closed meanwhile
+            session = self.sessions.get(elem)
+            if session is None: continue
 
-        while True:
-            # retry until message is sent
-            [_, wx, _] = select.select([], [elem], [])
+            # encode the messages in the codec negotiated by the
+            # connection, they are sent with a single sendmsg()
+            buffers = [i.send(session.codec) for i in response_list]
+            session.output.writev(buffers)
+
+            self.metrics.incr('bytes_out', sum(len(i) for i in buffers))
+
+    def broadcast(self, pending):
+
+        ''' queues the pending messages on the output queue of
+            every bidder. Each message is encoded exactly once per
+            codec in use, and the resulting buffers are shared by
+            all the queues, so the cost of a broadcast grows with
+            the bytes sent rather than with the encoding work.
+        '''
+
+        if not pending: return
+
+        (sendbuffs, sizes) = ({}, {})
+        (recipients, sent) = (0, 0)
+
+        for session in self.sessions.clients():
+
+            codec = session.codec
+            if codec not in sendbuffs:
+                sendbuffs[codec] = [i.send(codec) for i in pending]
+                sizes[codec] = sum(len(i) for i in sendbuffs[codec])
+
+            session.output.writev(sendbuffs[codec])
+            sent += sizes[codec]
+            recipients += 1
+
+        self.metrics.observe('broadcast_fanout', recipients)
+        self.metrics.incr('bytes_out', sent)
+
+    def call_at(self, when, callback, *args):
+
+        ''' lot timers run on the event loop '''
+
+        return self.loop.call_at(when, callback, *args)
+
+    def flush_sync(self):
+
+        ''' queues the sync messages of this loop iteration on the
+            links to the other servers, as a single write each '''
+
+        self.watchdog.enter('sync')
+
+        data = self.sync_batch()
 
-            if elem in wx:
-                elem.sendall(sendbuff)
-                break
+        if data:
+            for link in self.peer_links:
+                link.write(data)
+
+            self.metrics.incr('bytes_out', len(data) * len(self.peer_links))
+
+        self.watchdog.leave()
+
+    def peer_backlog(self):
+
+        ''' bytes queued on the links to the other servers. During a
+            state transfer, those queued on the link it stands in for '''
+
+        return [getattr(link, 'link', link).buffered
+                for link in getattr(self, 'peer_links', ())]
+
+    def pause_reading(self, conn):
+
+        ''' high watermark callback: stop reading requests from
+            a bidder that does not read its responses '''
+
+        self.loop.remove_reader(conn.sock)
+
+    def resume_reading(self, conn):
+
+        ''' low watermark callback '''
+
+        self.loop.add_reader(conn.sock, self.read_connection)
+
+    def overflow(self, conn):
+
+        ''' overflow callback: a bidder that has not read its
+            messages for too long is disconnected, once the
+            current broadcast is over '''
+
+        log('disconnecting a stuck bidder: over {0} bytes queued'.format(
+                self.MAX_BUFFERED))
+        self.metrics.incr('sessions.overflowed')
+
+        self.loop.call_at(self.loop.time(), self.close_connection, conn.sock)
 
     def bootstrap(self):
 
@@ -96,18 +194,26 @@ class Auctioneer(Server_Base):
         # listen to max_connections
         self.server.listen(self.max_connections)
 
-        read_conns = [self.server]
-        write_conns = []
-        ex_conns = []
-
-        # sleep for a second to ensure other server has been bound
+        # sleep for a second to ensure other servers have been bound
         time.sleep(1)
-        self.other.connect((self.host, self.other_port))
 
-        while True:
+        for (other, peer) in zip(self.others, self.peers):
+            connect_peer(other, peer)
+
+        # a restarted server asks the other servers to link to it
+        # again, and the first one for the state of the auction
+        if self.joining:
+            for (index, other) in enumerate(self.others):
+                other.sendall(self.join_msg(index).send(self.peer_codec))
+
+        # incoming links of the other servers, by convention
+        # the first connections accepted
+        self.other_servers = []
+
+        while len(self.other_servers) < len(self.peers):
             
             # poll ready sockets
-            [rx, _, _] = select.select(read_conns, write_conns, ex_conns)
+            [rx, _, _] = select.select([self.server], [], [])
 
             if self.server in rx:
 
@@ -118,114 +224,238 @@ class Auctioneer(Server_Base):
 
                 # set connection to non-blocking
                 conn.setblocking(0)
-                self.other_server = conn
+                self.other_servers.append(conn)
+
+
+
+    def accept_connection(self, server):
+
+        ''' reader callback of the listening socket:
+            accepts an incoming bidder connection '''
+
+        connection, client_address = server.accept()
+        print(
+            'new connection from {0}'.format(client_address)
+        )
+        # set connection to non-blocking to enable polls
+        connection.setblocking(0)
 
-                # stop retrying
-                break
+        # admission control: tell the bidder why, then hang up
+        if self.sessions.full():
+            log('rejecting {0}: too many connections'.format(client_address))
+            try:
+                connection.send(messages.ErrorMsg(
+                        username=None, error=errors.max_connections).send())
+            except OSError:
+                pass
+            connection.close()
+            return
 
+        # watch incoming connection for input
+        self.loop.add_reader(connection, self.read_connection)
+        self.sessions.open(connection,
+                           eventloop.Connection(self.loop, connection,
+                                                self.pause_reading,
+                                                self.resume_reading,
+                                                max_buffered=self.MAX_BUFFERED,
+                                                on_overflow=self.overflow),
+                           serial.FrameDecoder())
 
-        # initialize registrar table and item auctioned
-        self.registrars = {}
-        self.curr_item_id = 1
+        # greet the bidder, possibly starting the auction
+        self.handle_responses(self.greet(), connection)
 
-        # start alarms when it becomes True
-        self.auctioning = False
+    def read_connection(self, elem):
 
+        ''' reader callback of bidder and peer connections '''
+
+        session = self.sessions.get(elem)
+
+        try:
+            count = session.decoder.recv(elem, self.BUFF_SIZE)
+        except OSError: # reset by peer: same as end of stream
+            count = 0
+
+        # readable sockets always have data
+        if count:
+            self.sessions.touch(session)
+            self.metrics.incr('bytes_in', count)
+
+            # handle complete messages, respond to the sender
+            self.handle_responses(self.handle_frames(session.decoder, elem),
+                                  elem)
+        else:
+            self.close_connection(elem)
+
+    def close_connection(self, elem):
+
+        ''' stops serving a connection and forgets its session,
+            along with its registration, if any '''
+
+        # a connection may be closed twice, e.g. when a stuck
+        # bidder hangs up before it is disconnected
+        if self.sessions.get(elem) is None: return
+
+        print('closing{0}\n'.format(elem))
+
+        self.loop.remove(elem)
+        self.forget_session(elem)
+        elem.close()
+
+    def reconnect_peer(self, address, wants_state):
+
+        ''' links again to a restarted server. The previous link is
+            dropped, along with anything still queued on it. '''
+
+        try:
+            index = self.peers.index(address)
+        except ValueError:
+            log('unknown server {0}:{1}'.format(*address))
+            return
+
+        self.loop.remove(self.others[index])
+        self.others[index].close()
+
+        # the restarted server is listening already
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        connect_peer(sock, address)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setblocking(0)
+
+        conn = eventloop.Connection(self.loop, sock)
+        (self.others[index], self.peer_links[index]) = (sock, conn)
+
+        if wants_state:
+            self.peer_links[index] = transfer.StateTransfer(
+                    self, conn, lambda: conn.buffered)
+            self.peer_links[index].start()
+
+    def accept_admin(self, admin):
+
+        ''' reader callback of the admin socket '''
+
+        conn, _ = admin.accept()
+        conn.setblocking(0)
+        self.loop.add_reader(conn, self.admin_request)
+
+    def admin_request(self, sock):
+
+        ''' answers a request on the admin socket, then hangs up.
+            The reply is queued like any other output, so the loop
+            never waits on the admin client: it is closed once its
+            reply is sent, or after a second if it does not read it. '''
+
+        self.loop.remove(sock)
+
+        try:
+            request = sock.recv(512)
+        except OSError:
+            request = None
+
+        if not request:
+            sock.close()
+            return
+
+        # a request with non-ASCII bytes gets the usage reply
+        conn = eventloop.Connection(self.loop, sock)
+        conn.write(self.admin_reply(str(request, 'ascii', 'replace')))
+
+        if conn.outbound and not conn.closed:
+            self.loop.add_writer(sock, lambda _: self.admin_flush(conn))
+            self.loop.call_later(1.0, self.admin_close, conn)
+        else:
+            sock.close()
+
+    def admin_flush(self, conn):
+
+        ''' writer callback of an admin reply '''
+
+        conn.handle_write(conn.sock)
+
+        if not conn.outbound or conn.closed:
+            self.admin_close(conn)
+
+    def admin_close(self, conn):
+
+        # the reply may have been sent already
+        if conn.sock.fileno() < 0: return
+
+        self.loop.remove(conn.sock)
+        conn.sock.close()
+
+    def caught_up(self):
+
+        ''' starts accepting bidders after a rejoin '''
+
+        self.loop.add_reader(self.server, self.accept_connection)
 
     def serve(self):
 
         ''' main server loop '''
 
-        BUFF_SIZE = 2048
-    
-        # connect with other server, set variables etc.        
+        # connect with other server, set variables etc.
         self.bootstrap()
 
+        # the event loop only wakes up when a socket is readable
+        # or a lot timer is due, so an idle server sleeps
+        self.loop = eventloop.EventLoop()
+        self.loop.watchdog = self.watchdog
+
+        # a rejoining server takes bidders once it has caught up
+        if not self.joining:
+            self.loop.add_reader(self.server, self.accept_connection)
+
+        if self.admin:
+            self.loop.add_reader(self.admin, self.accept_admin)
+
+        # sessions of the incoming links of the other servers. The
+        # bidder sessions are the recipients of pending messages.
+        for conn in self.other_servers:
+            self.loop.add_reader(conn, self.read_connection)
+            self.sessions.open(conn, eventloop.Connection(self.loop, conn),
+                               serial.FrameDecoder(), peer=True)
+
+        # output queues of the outgoing links to the other servers
+        self.peer_links = []
 
-        # fd list for select system calls
-        read_conns = [self.server, self.other_server]
-        write_conns = [self.other_server]
-        ex_conns = []
+        # responses of the current loop iteration, by connection
+        self.responses = []
+
+        for other in self.others:
+            # writes are already batched, do not delay them further
+            other.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            other.setblocking(0)
+            self.peer_links.append(eventloop.Connection(self.loop, other))
+
+        # timers of the restored lots, the idle bidders
+        # and the snapshots
+        self.start_timers()
 
         # initialize server loop
         while True:
 
-            self.pending = []
-            # wait until someone is ready
-            [rx, wx, ex] = select.select(read_conns,
-                                         write_conns,
-                                         ex_conns)
-
-            # initialize response list 
-            # one field for each incoming socket
-            response_list = {}
-            for elem in rx:
-
-                # input is server => incomming connections
-                if elem == self.server:
-                    connection, client_address = elem.accept()
-                    print(
-                        'new connection from {0}'.format(client_address)
-                    )
-                    # set connection to non-blocking to enable polls
-                    connection.setblocking(0)
-                    
-                    # add incoming connection to read_list
-                    read_conns.append(connection)
-                    write_conns.append(connection)
-
-                    # if this was first connection, start alarm() sequence
-                    if not self.auctioning:
-                        print('{0} - Started'.format(self.port))
-                        self.sync(messages.StartAuctionMsg())
-                        self.accepting = True
-                        self.auctioning = True                
-                        response_list[connection] = self.start_msg()
-                        signal.alarm(self.L)
-
-                    # if auctioning but still on interest phase,
-                    # send 'start_bid' msg
-                    else:
-                        
-                        if self.items: 
-                            if self.items[self.curr_item_id]['timeouts'] == 0:
-                                response_list[connection] = self.start_msg()
-
-                else:                    
-                    # unpacking is needed for the bytes
-                    data = serial.unpack_msg(elem.recv(BUFF_SIZE))
-                    print(self.port, data)
-                    # readable sockets always have data
-                    if data: 
-                        # parse incoming messages, create response list
-                        response_list[elem] = self.parse_messages(data, elem)
-                    else:
-                        print('closing{0}\n'.format(elem))
-
-                        # delete entry from registrar table, if found
-                        usrname = self.lookup_registrar(elem)
-                        if usrname:
-                            del self.registrar_table[usrname]
-
-
-                        read_conns.remove(elem)
-                        write_conns.remove(elem)
-
-            for elem in wx: 
-       
-                # if connection is in the response_list, send all
-                # the messages designated for it
-                if elem in response_list:
-                    self.handle_responses(response_list[elem], elem)
-
-                # if the connection is not the other server 
-                # send all the pending messages as well
-
-            for elem in write_conns:
-                if elem != self.other_server:
-                    self.handle_responses(self.pending, elem)
+            # wait until someone is ready or a lot times out
+            start = time.perf_counter()
+            self.loop.run_once()
+
+            # make the events of this iteration durable before
+            # anyone hears about them
+            self.commit_log()
+
+            # answer the requests of this iteration
+            self.flush_responses()
+
+            # one batch per iteration to the other servers
+            self.flush_sync()
+
+            # detach the pending list before broadcasting
+            (pending, self.pending) = (self.pending, [])
 
+            # send all the pending messages to the bidders
+            self.broadcast(pending)
 
+            # time spent on the events, not waiting for them
+            self.metrics.timing('iteration_ms', time.perf_counter() - start
+                                             - self.loop.polled)
 
         
 if __name__ == '__main__':
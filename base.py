@@ -1,13 +1,15 @@
 
-import socket, select, sys, signal, time
+import socket, sys, signal, time, os
 import random
 from socket import error as SocketError
 
 # imports from own code
 import serializer as serial
-import messages, errors
+import messages, errors, sessions, itemstore, wal, snapshot, metrics
+import dispatch
+import profiling
 
-# timeout and alarm constants
+# number of timeouts before a lot is awarded
 M = 2
 
 # set to True if a RuntimeError was raised
@@ -26,161 +28,293 @@ def log(string_arg):
         # should not attempt to write again
         dirty_log = True
 
-def item_new(about, price):
+def price_key(price, version, holder):
 
-    ''' helper function for handy item representation '''
+    ''' the order of price updates: the highest price wins, and
+        concurrent bids of the same price are ordered by version
+        (and bidder), the same way on every server '''
+
+    return (price, version, holder or '')
+
+def lot_new(deadline):
+
+    ''' helper function for the state of an open lot '''
 
     return {
-        'about': about,
-        'price': price,
-        'holder': None,
-        'interested': [],
-        'timeouts': 0
+        'interest_phase': True,
+        'deadline': deadline,
+        'timer': None
     }
 
 class Server_Base(object):
 
     ''' Base class for the Auctioneer class '''
 
-    def sigalrm_handler(self, signum, frame):
+    # bytes queued for a bidder that does not read them, before
+    # it is disconnected: the broadcasts would pile up otherwise
+    MAX_BUFFERED = 4 * 1024 * 1024
 
-        ''' handle L second timeouts for possible price reductions
-            and item discards 
+    def call_at(self, when, callback, *args):
+
+        ''' schedules callback(*args) at the time.monotonic() time
+            when and returns a handle with a cancel() method. It is
+            implemented by the server engines, with the timers of
+            their event loop.
         '''
-        L = self.L
 
-        # log("{0} seconds passed, update timeout - {1}".format(L, self.port))
+        raise NotImplementedError
 
-        # get item that is currently processed
-        # server.current_item is just an id that 
-        # points to server.items dict
+    def schedule_lot(self, item_id):
 
-        # retrieve item if it exists
-        try:
-            curr_item = self.items[self.curr_item_id]
-        except KeyError:
+        ''' sets the timer of an open lot for the end of its window.
+            While rejoining, lots keep still until the state of the
+            auction has been received (see finish_join()). '''
 
-            if not self.items:
+        if self.joining: return
 
-                # notify my auctioneers to finish auction
-                # reset alarms, do not renew
-                self.pending.append(messages.CompleteMsg())
-                signal.alarm(0)
+        lot = self.lots[item_id]
+        lot['timer'] = self.call_at(lot['deadline'], self.lot_expired, item_id)
 
-            else:
-                signal.alarm(L)
-            
+    def renew_lot(self, item_id):
+
+        ''' restarts the L second window of an open lot. This is
+            O(1): only the deadline moves, the timer of the lot is
+            moved when it fires (see lot_expired()). '''
+
+        self.lots[item_id]['deadline'] = time.monotonic() + self.L
+
+    def lot_expired(self, item_id):
+
+        ''' timer callback of an open lot. Handles L second timeouts
+            for possible price reductions and item discards. '''
+
+        lot = self.lots.get(item_id)
+        if lot is None: return
+
+        # the window was renewed by a bid meanwhile
+        if lot['deadline'] > time.monotonic():
+            self.schedule_lot(item_id)
             return
 
-        if not self.accepting:
-            
-            # do nothing, renew alarm
+        self.lot_timeout(item_id)
 
-            signal.alarm(L)
-            return 
+        # the lot is still open for another window
+        if item_id in self.lots:
+            self.schedule_lot(item_id)
 
-        if curr_item['interested'] == []:
-            # no price has been offered, nobody interested
-            
-            # send a StopBidMsg to the other server
-            # to notify about the discarding
-            self.sync(messages.StopBidMsg(item_id=self.curr_item_id,
-                                          winner=curr_item['holder'],
-                                          price=curr_item['price'])
-            )
+    def lot_timeout(self, item_id):
 
-            self.accepting = False
+        ''' handles the end of the L second window of an open lot '''
 
-        else:
-            
-            # update timeouts
-            self.items[self.curr_item_id]['timeouts'] += 1
-            self.interest_phase = False
+        curr_item = self.items[item_id]
+        lot = self.lots[item_id]
 
-            # >= 1 offers, price must be lowered or item awarded
+        # start the next window of the lot
+        self.renew_lot(item_id)
 
-            # nobody has initially bid on the item - reduce price!
-            if curr_item['holder'] == None and curr_item['timeouts'] > 1:
-                self.items[self.curr_item_id]['price'] *= 0.9
- 
-                # send this message to inform every client
-                self.pending.append(messages.SyncPriceMsg(
-                                        item_id=self.curr_item_id,
-                                        username=curr_item['holder'],
-                                        price=(curr_item['price'] * 0.9)))          
+        if curr_item['interested'] == []:
+            # no price has been offered, nobody interested
+            self.stop_lot(item_id, curr_item['holder'], curr_item['price'])
+            return
 
-            if curr_item['timeouts'] > M:        
+        # update timeouts
+        curr_item['timeouts'] += 1
+        lot['interest_phase'] = False
 
-                # inform other server 
-                self.sync(messages.StopBidMsg(
-                                item_id = self.curr_item_id,
-                                winner = curr_item['holder'],
-                                price = curr_item['price']))
+        # >= 1 offers, price must be lowered or item awarded
 
-                self.accepting = False 
+        # nobody has initially bid on the item - reduce price!
+        if curr_item['holder'] == None and curr_item['timeouts'] > 1:
+            curr_item['price'] *= 0.9
+            self.record('price', item_id=item_id, price=curr_item['price'],
+                        holder=None, version=curr_item['version'])
 
+            # send this message to inform every client
+            self.pending.append(messages.SyncPriceMsg(
+                                    item_id=item_id,
+                                    username=curr_item['holder'],
+                                    price=curr_item['price'],
+                                    version=curr_item['version']))
+
+        if curr_item['timeouts'] > M:
+            self.stop_lot(item_id, curr_item['holder'], curr_item['price'])
 
-        # renew alarm
-        signal.alarm(L)
-        
     def sigint_handler(self, signum, frame):
 
         ''' handles abrupt shutdowns from 
             keyboard interrupt events
         '''
 
-        # disable alarms to prevent reentrant calls
-        signal.alarm(0)
-
         log('Closing socket...')
 
         self.server.close()
         sys.exit(1)
 
+    def profile_handler(self, signum, frame):
+
+        ''' SIGUSR1 starts a profile window, SIGUSR2 takes a heap
+            snapshot (see profiling.py). Both run on the loop, as
+            a timer due right away. '''
+
+        if signum == signal.SIGUSR1:
+            self.call_at(time.monotonic(), self.profiler.start_profile,
+                         profiling.PROFILE_SECONDS)
+        else:
+            self.call_at(time.monotonic(), self.profiler.snapshot_heap)
+
+    def admin_reply(self, request):
+
+        ''' the response to a request on the admin socket: the
+            reply of a profiling command, or the metrics '''
+
+        words = request.split()
+
+        if words and words[0] in profiling.COMMANDS:
+            return bytes(self.profiler.command(words) + '\n', 'ascii')
+
+        return self.metrics.reply(request)
+
 
     def __init__(self, host='localhost', 
                        port=50000, 
                        max_connections=27,
                        other_port = 50005,  
-                       itemfile="items.txt"):
-
-        ''' Initialized an Auctioneer with the parameters given '''
+                       itemfile="items.txt",
+                       peer_codec=serial.JSON,
+                       lots=1,
+                       peers=None,
+                       idle_timeout=None,
+                       wal_path=None,
+                       snapshot_path=None,
+                       snapshot_interval=30.0,
+                       rejoin=None,
+                       admin_path=None,
+                       profile_dir='.',
+                       stall_threshold=None):
+
+        ''' Initialized an Auctioneer with the parameters given.
+            peers is the list of (host, port) addresses of the
+            other servers of the auction; by default the single
+            server listening on other_port. At most max_connections
+            bidders may be connected at once, and bidders silent for
+            idle_timeout seconds are disconnected (never if None).
+            With wal_path, the auction events are logged to that
+            file (see wal.py). With snapshot_path as well, the state
+            of the auction is saved every snapshot_interval seconds,
+            and a restarted server resumes from its latest snapshot
+            and the events logged since. With rejoin, the server
+            catches up with its peers, which are in the middle of
+            the auction, before serving any bidder (see transfer.py).
+            By default, it does so if it has peers and resumes from
+            a snapshot or a log; rejoin=False resumes all the servers
+            of an auction from their own state, when they restart
+            together.
+            With admin_path, the server answers requests for its
+            metrics on a UNIX socket at that path (see metrics.py).
+            Profiles, heap snapshots and the stacks of the iterations
+            running for more than stall_threshold seconds are written
+            to profile_dir (see profiling.py).
+        '''
 
         # register signal handlers 
-        signal.signal(signal.SIGALRM, self.sigalrm_handler)
         signal.signal(signal.SIGINT, self.sigint_handler)
+        signal.signal(signal.SIGUSR1, self.profile_handler)
+        signal.signal(signal.SIGUSR2, self.profile_handler)
 
         # initialize connection-related data
         (self.host, self.port)  = (host, port)
         self.max_connections    = max_connections
-        self.other_port         = other_port
 
-        with open(itemfile, 'r') as fd:
+        # membership: every other server of the auction
+        if peers is None:
+            peers = [(host, other_port)]
+        self.peers              = [tuple(peer) for peer in peers]
 
-            # delay
-            self.L = int(fd.readline().strip())
+        # codec of the messages sent to the other servers
+        self.peer_codec         = peer_codec
 
-            mkitem = lambda x: item_new(' '.join(x[1:]), int(x[0]))
+        # number of lots auctioned at once
+        self.max_lots           = lots
+
+        # open lots, i.e. items that bids are currently
+        # placed on, by item id. Lots are opened in order of id,
+        # so the dict is kept sorted by id as well.
+        self.lots = {}
+
+        # lot timers start when it becomes True
+        self.auctioning = False
+
+        # am i accepting?
+        self.accepting = False
 
-            # read items from itemfile
-            self.items = {
-                (i + 1): mkitem(j.strip().split()) 
-                for (i, j) in enumerate(fd)
-            }
+        # a restarted server resumes from its latest snapshot and
+        # the events logged since, otherwise the auction starts
+        # from the item file
+        (self.snapshot_path, self.snapshot_interval) = (snapshot_path,
+                                                        snapshot_interval)
 
-        self.interest_phase = False
-        # current_item_id is the item that bids 
-        # are currently placed on (denoted by id)
-        self.curr_item_id = None
+        recovered = bool(snapshot_path and self.load_snapshot(snapshot_path))
+        if not recovered:
+            self.load_items(itemfile)
 
-        # table of registrars. Each recognized connection is put on this table.
-        self.registrar_table = {}
+        if wal_path and os.path.exists(wal_path):
+            recovered = recovered or os.path.getsize(wal_path) > 0
+            self.replay_log(wal_path)
+
+        # True until the state of the auction has been received
+        # from a peer, when rejoining. A server restarted alone
+        # must rejoin: its peers are in the middle of the auction
+        # and never link to it again otherwise.
+        if rejoin is None:
+            rejoin = recovered and bool(self.peers)
+            if rejoin:
+                log('{0} - Restarted with peers, rejoining'.format(port))
+
+        self.joining = rejoin
+
+        # sessions of all the connections, by socket and by username.
+        # Each recognized connection is registered on this table.
+        self.sessions = sessions.SessionTable(limit=max_connections)
+        self.idle_timeout = idle_timeout
 
         # list of pending messages
         self.pending = []
 
-        # am i accepting?
-        self.accepting = False
+        # handlers of the received messages, by header (see
+        # dispatch.py), and the winning bids of the batch handled
+        self.handlers = dispatch.handler_table(self)
+        self.winners = None
+
+        # messages for the other servers, see sync()
+        self.outbox = []
+
+        # log of the auction events, if enabled
+        self.wal = wal.WriteAheadLog(wal_path) if wal_path else None
+
+        # counters and histograms of the hot paths, and the values
+        # read when the metrics are asked for
+        self.metrics = metrics.Metrics()
+        self.metrics.gauge('bidders', lambda: self.sessions.bidders)
+        self.metrics.gauge('lots_open', lambda: len(self.lots))
+        self.metrics.gauge('items_left', lambda: len(self.items))
+        self.metrics.gauge('peer_backlog', lambda: {
+                '{0}:{1}'.format(*peer): size
+                for (peer, size) in zip(self.peers, self.peer_backlog())})
+
+        # time.perf_counter() of the oldest message in the outbox
+        self.outbox_since = None
+
+        # local socket answering requests for the metrics, if enabled
+        self.admin = self.open_admin(admin_path) if admin_path else None
+
+        # opt-in profiling. The engines mark the tasks of the
+        # watchdog, which only captures stalls once it is started.
+        self.profiler = profiling.Profiler(self, profile_dir,
+                                           'auct_{0}'.format(port))
+        self.watchdog = self.profiler.watchdog
+
+        if stall_threshold:
+            self.watchdog.start(stall_threshold)
 
         # try initializing the socket
         try:
@@ -189,324 +323,992 @@ class Server_Base(object):
             log('Error initalizing socket')
             exit(1)
 
-        # try initializing other socket
+        # a restarted server binds again right away, even while the
+        # connections of its previous run are in TIME_WAIT
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+        # try initializing the gossip sockets, one per peer
         try:
-            self.other = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.others = [socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                           for _ in self.peers]
         except SocketError:
             log('Error initializing gossip socket')
             exit(1)
 
-    def update_price(self, item_id, new_price, holder):
+    def open_admin(self, path):
+
+        ''' binds the admin socket, replacing the socket file
+            of a previous run. The engines serve it. '''
+
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+        admin = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        admin.bind(path)
+        admin.listen(4)
+
+        return admin
+
+    def peer_backlog(self):
+
+        ''' the number of bytes queued on the link to each peer,
+            implemented by the server engines '''
+
+        raise NotImplementedError
+
+    def load_items(self, itemfile):
+
+        ''' reads the delay L and the catalog of the auction '''
+
+        with open(itemfile, 'r') as fd:
+
+            # delay, in seconds (fractions allowed)
+            self.L = float(fd.readline().strip())
+
+            # read items from itemfile, ids are assigned in order
+            self.items = itemstore.ItemStore()
+
+            for line in fd:
+                fields = line.split()
+                if fields:
+                    self.items.add(' '.join(fields[1:]), int(fields[0]))
+
+    def load_snapshot(self, path):
+
+        ''' restores the auction from a snapshot. Returns False if
+            no snapshot has been taken yet. '''
+
+        saved = snapshot.load(path)
+        if saved is None: return False
+
+        (state, self.items) = saved
+        self.L = state['L']
+        self.auctioning = self.accepting = state['auctioning']
+
+        # lot deadlines are saved on the wall clock, the windows
+        # that ended while the server was down expire right away
+        (now, wall) = (time.monotonic(), time.time())
+
+        for (item_id, interest_phase, deadline) in state['lots']:
+            self.lots[item_id] = lot_new(now + max(0, deadline - wall))
+            self.lots[item_id]['interest_phase'] = interest_phase
+
+        log('{0} - Restored snapshot with {1} items left'.format(
+                self.port, len(self.items)))
+
+        return True
+
+    def save_snapshot(self):
+
+        ''' timer callback: saves the state of the auction, then
+            empties the log, as the snapshot covers all of it '''
+
+        # everything logged so far goes in the snapshot
+        self.commit_log()
+
+        (now, wall) = (time.monotonic(), time.time())
+
+        state = {
+            'L': self.L,
+            'auctioning': self.auctioning,
+            'lots': [(item_id, lot['interest_phase'],
+                      wall + lot['deadline'] - now)
+                     for (item_id, lot) in self.lots.items()]
+        }
+
+        snapshot.save(self.snapshot_path, state, self.items)
+
+        # replaying an old log over a newer snapshot yields the same
+        # state (see replay_log()), so a crash before the log is
+        # emptied is harmless
+        if self.wal:
+            self.wal.truncate()
+
+        self.start_snapshots()
+
+    def replay_log(self, path):
+
+        ''' applies the events logged after the latest snapshot,
+            in order. Records already covered by the snapshot are
+            harmless: the last record of every item restores the
+            state the snapshot holds. Registrations are not restored,
+            as bidders have to connect again anyway. '''
+
+        count = 0
+
+        for record in wal.read_log(path):
+
+            kind = record['header']
+            item_id = record.get('item_id')
+            count += 1
+
+            if kind == 'start':
+
+                self.auctioning = self.accepting = True
+
+                # lots are opened in order of id
+                self.items.cursor = max(self.items.cursor, item_id)
+                if item_id in self.items and item_id not in self.lots:
+                    self.lots[item_id] = lot_new(time.monotonic() + self.L)
+
+            elif kind == 'stop':
+
+                self.items.discard(item_id)
+                self.lots.pop(item_id, None)
+
+            elif kind == 'price' and item_id in self.items:
+
+                item = self.items[item_id]
+                item['price'] = record['price']
+                item['holder'] = record['holder']
+                item['version'] = record['version']
+
+                # bids are only placed after the interest phase, and
+                # prices only drop after the second timeout
+                item['timeouts'] = 0 if record['holder'] else 2
+                if item_id in self.lots:
+                    self.lots[item_id]['interest_phase'] = False
+                    self.renew_lot(item_id)
+
+            elif kind == 'interest' and item_id in self.items:
+
+                interested = self.items[item_id]['interested']
+                if record['username'] not in interested:
+                    interested.append(record['username'])
+
+        log('{0} - Replayed {1} logged events'.format(self.port, count))
+
+        return count
+
+    def update_price(self, item_id, new_price, holder, version=0):
 
         ''' utility function to update a price based on a 
-            received SyncPriceMsg
+            received SyncPriceMsg. Updates are merged by price_key(),
+            so applying the same update twice, or an older one, is
+            a no-op. Returns True if the update was applied.
         '''
 
-        # if new bid was higher indeed, update price
-        if self.items[item_id]['price'] < new_price:
-            self.items[item_id]['price'] = new_price
-            self.items[item_id]['holder'] = holder
-            signal.alarm(L)
+        item = self.items[item_id]
+
+        # stale or duplicate update, drop it
+        if (price_key(new_price, version, holder) <=
+                price_key(item['price'], item['version'], item['holder'])):
+            return False
+
+        item['price'] = new_price
+        item['holder'] = holder
+        item['version'] = version
+
+        # update timeouts
+        item['timeouts'] = 0
+
+        self.record('price', item_id=item_id, price=new_price,
+                    holder=holder, version=version)
+
+        if item_id in self.lots:
+            self.renew_lot(item_id)
+
+        return True
                                            
     def close(self):
         self.server.close()
-        self.other.close()
+        for other in self.others:
+            other.close()
+        if self.wal:
+            self.wal.close()
+
+    def record(self, kind, **fields):
+
+        ''' logs an auction event, if logging is enabled. Events
+            are written by commit_log(). '''
+
+        if self.wal:
+            self.wal.append(kind, **fields)
+
+    def commit_log(self):
+
+        ''' group commit: writes the events logged during a loop
+            iteration with a single sync. The engines call it before
+            any message about these events leaves the server. '''
+
+        if self.wal:
+            self.wal.commit()
 
-    def start_msg(self):
+    def start_msg(self, item_id):
 
-        ''' Creates a StartBidMsg based on the auction's current state '''
+        ''' Creates a StartBidMsg for an open lot '''
 
         return messages.StartBidMsg(
-                    item_id = self.curr_item_id,
-                    price = self.items[self.curr_item_id]['price'],
-                    description = self.items[self.curr_item_id]['about'])
+                    item_id = item_id,
+                    price = self.items[item_id]['price'],
+                    description = self.items[item_id]['about'])
 
-        
-    def sync(self, msg):
+    def start_auction(self):
+
+        ''' starts auctioning: opens the first lots '''
+
+        self.accepting = True
+        self.auctioning = True
+        self.open_lots()
+
+    def open_lots(self):
 
-        ''' generic function to prioritize and send
-            a message to the other server
+        ''' opens lots for the next items of the catalog (in order
+            of item id) until max_lots lots are open at once. Both
+            servers make the same choice, as they share the catalog.
         '''
 
-        repeat_flag = True
-        wr_list = [self.other]
+        free = self.max_lots - len(self.lots)
+        if free <= 0: return
 
-        while repeat_flag:
+        deadline = time.monotonic() + self.L
 
-            [_, wx, _] = select.select([], wr_list, [])
+        for item_id in self.items.take(free):
+            self.record('start', item_id=item_id)
+            self.lots[item_id] = lot_new(deadline)
+            self.schedule_lot(item_id)
+            self.pending.append(self.start_msg(item_id))
+
+    def stop_lot(self, item_id, winner, price, notify=True):
+
+        ''' closes a lot, awarding its item to the winner (if any).
+            The other servers are informed, unless the stop came from
+            one of them, and the next lot is opened.
+        '''
+
+        # the lot may get closed twice, e.g. by its timer and
+        # by a stop_bid of another server
+        if not self.items.discard(item_id):
+            return
+
+        lot = self.lots.pop(item_id, None)
+        if lot and lot['timer']:
+            lot['timer'].cancel()
+        log('Deleted item %d' % item_id)
+
+        self.record('stop', item_id=item_id, winner=winner, price=price)
+
+        stopmsg = messages.StopBidMsg(item_id = item_id,
+                                      winner = winner,
+                                      price = price)
+
+        # send a StopBidMsg to the other servers
+        # to notify about the discarding
+        if notify:
+            self.sync(stopmsg)
+
+        # add a stop bid message to pending messages
+        # in order to be delivered to all my clients
+        self.pending.append(stopmsg)
+
+        if self.items:
+            self.open_lots()
+        else:
+            # inform my clients that auction is finished
+            self.pending.append(messages.CompleteMsg())
+
+    def default_lot(self):
+
+        ''' the lot that messages without an item id refer to,
+            i.e. the oldest open lot, which is the first one '''
+
+        return next(iter(self.lots), None)
+
+    def lookup_registrar(self, conn):
+
+        ''' lookup a specific connection in the session table 
+            and return its corresponding username '''
+
+        session = self.sessions.get(conn)
+
+        # if none found, return None
+        return session.username if session else None
+
+    def codec(self, conn):
+
+        ''' the wire codec negotiated by a connection '''
+
+        session = self.sessions.get(conn)
+        return session.codec if session else serial.JSON
+
+    def close_connection(self, conn):
+
+        ''' closes a connection and forgets its session. It is
+            implemented by the server engines. '''
+
+        raise NotImplementedError
+
+    def reconnect_peer(self, address, transfer):
+
+        ''' replaces the link to the restarted server at address.
+            With transfer, the state of the auction is streamed over
+            the new link first (see transfer.StateTransfer). It is
+            implemented by the server engines. '''
+
+        raise NotImplementedError
+
+    def caught_up(self):
+
+        ''' called once a rejoining server has the state of the
+            auction, to start serving bidders. It is implemented by
+            the server engines. '''
+
+        raise NotImplementedError
+
+    def join_msg(self, index):
+
+        ''' the JoinMsg of a rejoining server for its index-th peer.
+            The first peer streams the state of the auction. '''
+
+        return messages.JoinMsg(host=self.host, port=self.port,
+                                transfer=index == 0)
+
+    def state_chunk(self, first, count):
+
+        ''' a StateChunkMsg with the items first to first + count - 1
+            that are still in the auction '''
+
+        last = min(first + count, self.items.last_id() + 1) - 1
+        items = []
+
+        for item_id in range(first, last + 1):
+            if item_id in self.items:
+                item = self.items[item_id]
+                items.append((item_id, item['price'], item['holder'],
+                              item['version'], self.items.interest(item_id)))
+
+        return messages.StateChunkMsg(first=first, last=last, items=items)
+
+    def state_end(self):
+
+        ''' the StateEndMsg with the open lots, ending a transfer '''
+
+        now = time.monotonic()
+        lots = []
+
+        for (item_id, lot) in self.lots.items():
+            item = self.items[item_id]
+            lots.append((item_id, lot['interest_phase'],
+                         max(0, lot['deadline'] - now), item['timeouts'],
+                         item['price'], item['holder'], item['version'],
+                         item['interested']))
+
+        return messages.StateEndMsg(auctioning=self.auctioning,
+                                    cursor=self.items.cursor, lots=lots)
+
+    def merge_item(self, item_id, price, holder, version, interested):
+
+        ''' merges the state of an item received from the donor. Bids
+            are merged by price_key(), as other peers may have sent a
+            newer one already, but the price reductions of the donor
+            (which keep the version) are taken as they are. '''
+
+        item = self.items[item_id]
+
+        if (version, holder) == (item['version'], item['holder']):
+            if price != item['price']:
+                item['price'] = price
+                self.record('price', item_id=item_id, price=price,
+                            holder=holder, version=version)
+        else:
+            self.update_price(item_id, price, holder, version)
+
+        for username in interested:
+            if username not in item['interested']:
+                item['interested'].append(username)
+                self.record('interest', item_id=item_id, username=username)
+
+    def merge_chunk(self, msg):
+
+        ''' applies a StateChunkMsg. The items of the chunk that the
+            donor no longer auctions have been awarded meanwhile. '''
+
+        alive = {record[0]: record for record in msg['items']}
+
+        # only the ids of my own items are looked at
+        first = max(msg['first'], 1)
+        last = min(msg['last'], self.items.last_id())
+
+        for item_id in range(first, last + 1):
+
+            if item_id not in self.items: continue
+
+            record = alive.get(item_id)
+
+            if record is None:
+                item = self.items[item_id]
+                self.record('stop', item_id=item_id,
+                            winner=item['holder'], price=item['price'])
+                self.items.discard(item_id)
+                self.lots.pop(item_id, None)
+            else:
+                self.merge_item(*record)
+
+    def finish_join(self, msg):
+
+        ''' applies the StateEndMsg of a transfer: the open lots of
+            the donor replace mine, and their timers start with the
+            window they have left at the donor '''
+
+        now = time.monotonic()
+        lots = {}
+
+        self.items.cursor = max(self.items.cursor, msg['cursor'])
+
+        for (item_id, interest_phase, left, timeouts,
+             price, holder, version, interested) in msg['lots']:
+
+            if item_id not in self.items: continue
+
+            self.merge_item(item_id, price, holder, version, interested)
+            self.items[item_id]['timeouts'] = timeouts
+
+            if item_id not in self.lots:
+                self.record('start', item_id=item_id)
+
+            lots[item_id] = lot_new(now + left)
+            lots[item_id]['interest_phase'] = interest_phase
+
+        self.lots = lots
+        self.auctioning = self.accepting = msg['auctioning']
+        self.joining = False
+
+        for item_id in self.lots:
+            self.schedule_lot(item_id)
+
+        log('{0} - Caught up: {1} items left, {2} open lots'.format(
+                self.port, len(self.items), len(self.lots)))
+
+        self.caught_up()
+
+    def forget_session(self, conn):
+
+        ''' drops the session of a closed connection, along with
+            its registration '''
+
+        username = self.lookup_registrar(conn)
+        if username is not None:
+            self.record('unregister', username=username)
+
+        self.sessions.close(conn)
+
+    def start_timers(self):
+
+        ''' starts the timers of the server, once its loop is
+            running: those of the lots restored on restart, the
+            idle bidder reaper and the snapshots '''
+
+        for item_id in self.lots:
+            if self.lots[item_id]['timer'] is None:
+                self.schedule_lot(item_id)
+
+        self.start_reaper()
+        self.start_snapshots()
+
+    def start_snapshots(self):
+
+        ''' schedules the next snapshot, if enabled '''
+
+        if self.snapshot_path:
+            self.call_at(time.monotonic() + self.snapshot_interval,
+                         self.save_snapshot)
+
+    def start_reaper(self):
+
+        ''' starts disconnecting idle bidders, if enabled '''
+
+        if self.idle_timeout:
+            self.call_at(time.monotonic() + self.idle_timeout / 2,
+                         self.reap_idle)
+
+    def reap_idle(self):
+
+        ''' timer callback: disconnects the bidders that have been
+            silent for more than idle_timeout seconds '''
+
+        for session in self.sessions.idle(self.idle_timeout):
+            log('closing idle connection of {0}'.format(session.username))
+            self.close_connection(session.conn)
+
+        self.start_reaper()
+
+    def greet(self):
+
+        ''' returns the list of messages for a newly connected
+            bidder. The first connection starts the auction. '''
+
+        response = []
+
+        # if this was first connection, start the lot timers.
+        # The first lots are then announced to every bidder.
+        if not self.auctioning:
+            log('{0} - Started'.format(self.port))
+            self.sync(messages.StartAuctionMsg())
+            self.start_auction()
+
+        # if auctioning, send a 'start_bid' msg for
+        # every lot that is still on its interest phase.
+        # The lots opened during this iteration are announced
+        # by the pending broadcast, which reaches the new bidder
+        # too: they are left out, to start each lot only once.
+        else:
+            announced = {msg['item_id'] for msg in self.pending
+                         if isinstance(msg, messages.StartBidMsg)}
+
+            for item_id in sorted(self.lots):
+                if (self.items[item_id]['timeouts'] == 0 and
+                        item_id not in announced):
+                    response.append(self.start_msg(item_id))
+
+        return response
+
+    def sync(self, msg):
+
+        ''' queues a message for the other servers. Servers form a
+            full mesh: a message is sent to every peer and never
+            relayed further. The engines send the queued messages
+            once per loop iteration (see sync_batch()), so sync()
+            never blocks.
+        '''
+
+        if not self.outbox:
+            self.outbox_since = time.perf_counter()
+
+        self.outbox.append(msg)
 
-            for elem in wx:
-                # if other server is ready, send message 
-                # and set repeat flag as false
-                if elem == self.other:
-                    elem.sendall(msg.send())
-                    repeat_flag = False
-        
         # debug log
         # log('Sent: {0}'.format(msg))
 
+    def sync_batch(self):
+
+        ''' detaches the queued sync messages, encoded in order as
+            a single buffer for every peer (b'' if there are none) '''
+
+        if not self.outbox: return b''
+
+        (outbox, self.outbox) = (self.outbox, [])
+
+        # how long the oldest message waited for the peers
+        self.metrics.timing('sync_lag_ms',
+                            time.perf_counter() - self.outbox_since)
+
+        return b''.join(msg.send(self.peer_codec) for msg in outbox)
+
     
     def parse_messages(self, data, connection):
 
         ''' parses received messages from a connection
             and returns a list of appropriate responses '''
 
-        L = self.L
-        # response: list of messages clear for delivery
-        response = []
-
         # use the '|' delimiter to split buffer 
         # into separate messages. Remove trailing emptiness
         msg_list = [serial.decode_msg(i) for i in data.strip('|').split('|')]
 
+        return self.handle_messages(msg_list, connection)
+
+    def handle_frames(self, decoder, connection):
+
+        ''' handles the complete frames a connection sent, as
+            decoded by its FrameDecoder. The frames that are not
+            valid messages are skipped by the decoder and answered
+            with a malformed_msg error each. '''
+
+        msg_list = decoder.messages()
+        response = self.handle_messages(msg_list, connection)
+
+        if decoder.skipped:
+            self.metrics.incr('frames_malformed', decoder.skipped)
+            response.extend(messages.ErrorMsg(error=errors.malformed_msg)
+                            for _ in range(decoder.skipped))
+
+        return response
+
+    def batch_winners(self, batch):
+
+        ''' the winning bid of a batch of (handler, message) pairs
+            for each item: the highest offer, the first one on ties '''
+
+        winners = {}
+
+        for (_, msg) in batch:
+            if msg['header'] == 'bid':
+                best = winners.get(msg['item_id'])
+                if best is None or msg['price'] > best['price']:
+                    winners[msg['item_id']] = msg
+
+        return winners
+
+    def handle_messages(self, msg_list, connection):
+
+        ''' handles a list of decoded messages received from
+            a connection and returns a list of appropriate
+            responses '''
+
+        # response: list of messages clear for delivery
+        response = []
+
         # message log
         # log('{0}: {1}'.format(self.port, msg_list))
 
-        # advance buffer!
-        data = data[sum(len(i) + 1 for i in msg_list):] 
+        # look up the handler of every message and check its fields
+        # first, so that malformed messages never reach the auction
+        # state, nor the winners of the batch
+        batch = []
 
         for msg_dec in msg_list:
 
-            # NOTE: Case 1 -> CONNECT
+            header = dispatch.header(msg_dec)
+            entry = self.handlers.get(header)
+
+            # unknown message types are ignored
+            if entry is None:
+                self.metrics.incr('messages_in.unknown')
+                continue
+
+            (handler, check) = entry
+            self.metrics.incr('messages_in.' + header)
+
+            field = check(msg_dec)
+
+            if field is not None:
+
+                response.append(messages.ErrorMsg(
+                                message=header,
+                                field=field,
+                                error=errors.malformed_msg))
+                self.metrics.incr('messages_malformed.' + header)
+
+                continue
+
+            batch.append((handler, msg_dec))
+
+        # the bids of the batch that are applied, one per item
+        self.winners = self.batch_winners(batch) if len(batch) > 1 else None
+
+        for (handler, msg_dec) in batch:
+
+            # a handler may end the batch with the final response
+            final = handler(msg_dec, connection, response)
+            if final is not None:
+                return final
+
+        # return list of messages for response
+        return response
+
+    # NOTE: the handlers below get each message along with its
+    #       connection and the response so far, to which they
+    #       append their replies
+
+    @dispatch.handles('connect')
+    def on_connect(self, msg_dec, connection, response):
+
+        session = (self.sessions.get(connection) or
+                   self.sessions.open(connection))
+
+        # if username already present, we must reject.
+        # Otherwise, register normally
+        if not self.sessions.register(session, msg_dec['username']):
+
+            # response is a rejection message, and
+            # no other responses should be made
+            return [messages.ErrorMsg(username=msg_dec['username'],
+                                      error=errors.reject_register)]
+
+        self.record('register', username=msg_dec['username'])
+
+        # opt in to another codec for the messages sent
+        # to this bidder (frames of either codec are
+        # always accepted)
+        codec = msg_dec.get('codec', serial.JSON)
+        if codec in (serial.JSON, serial.BINARY):
+            session.codec = codec
 
-            if msg_dec['header'] == 'connect':
-                # if username already present, we must reject.
-                if msg_dec['username'] in self.registrar_table:
+        response.append(messages.AckConnectMsg())
 
-                    # response is a rejection message
-                    response = messages.ErrorMsg(
-                                            username=msg_dec['username'],
-                                            error=errors.reject_register)
-                    
-                    # no other responses should be made
-                    return [response]
+        # if no items left, auction is complete 
+        if not self.items: 
+            response.append(messages.CompleteMsg())
+            return response
 
-                # otherwise, register normally
-                self.registrar_table[msg_dec['username']] = connection
+    @dispatch.handles('bid')
+    def on_bid(self, msg_dec, connection, response):
 
-                response.append(messages.AckConnectMsg())
+        # extract bid info
+        item_id     = msg_dec['item_id']
+        offer       = msg_dec['price']
+        username    = msg_dec['username']
 
-                # if no items left, auction is complete 
-                if not self.items: 
-                    response.append(messages.CompleteMsg())
-                    return response
+        if item_id not in self.items:
 
-            # NOTE: Case 2 -> BID
+            # invalid item id for bid message
+            response.append(messages.ErrorMsg(
+                            item_id = item_id,
+                            username = username,
+                            error = errors.invalid_item_id)
+            )
+            self.metrics.rejected(errors.invalid_item_id)
+
+            return
 
-            if msg_dec['header'] == 'bid':
+        lot = self.lots.get(item_id)
 
-                # extract bid info
-                item_id     = msg_dec['item_id']
-                offer       = msg_dec['price']
-                username    = msg_dec['username']
+        if not self.accepting or lot is None:
+            
+            # notify client we are not accepting bids
+            # (auction not started or lot not open yet)
+            response.append(messages.ErrorMsg(
+                    username=username,
+                    error=errors.not_accepting))
+            self.metrics.rejected(errors.not_accepting)
+
+            return
 
-                if item_id in self.items:
-
-
-                    if not self.accepting:
-                        
-                        # notify client we are not accepting bids
-                        response.append(messages.ErrorMsg(
-                                username=username,
-                                error=errors.not_accepting))
+        if lot['interest_phase']:
 
-                        continue
+            # we are still in the interest phase
+            # and client should wait for next phase
+            response.append(messages.ErrorMsg(
+                    username=username,
+                    error=errors.interest_phase))
+            self.metrics.rejected(errors.interest_phase)
+
+            return
+
+        # a bid outbid by another one of the same batch
+        # is never applied: it would only be superseded
+        # by the winner, with a sync and a broadcast each
+        winners = self.winners
+        best = winners.get(item_id, msg_dec) if winners else msg_dec
+        price = self.items[item_id]['price']
+
+        # the offer must beat the price (a positive test,
+        # which no NaN passes)
+        if best is not msg_dec or not offer > price:
+
+            # tell the bidder the price to beat
+            response.append(messages.ErrorMsg(
+                    item_id=item_id,
+                    username=username,
+                    price=max(price, best['price']),
+                    error=errors.low_price_bid))
+            self.metrics.rejected(errors.low_price_bid)
+
+            return
 
-                    if self.interest_phase:
+        # new high bid msg should always 
+        # come after a successful response
+        # from a SyncPriceMsg
 
-                        # we are still in the interest phase
-                        # and client should wait for next phase
-                        response.append(messages.ErrorMsg(
-                                username=username,
-                                error=errors.interest_phase))
+        # the bid comes after the current price:
+        # stamp it with the next version
+        version = self.items[item_id]['version'] + 1
 
-                        continue
-
-                    if offer > self.items[item_id]['price']:
-
-                        # new high bid msg should always 
-                        # come after a successful response
-                        # from a SyncPriceMsg
-
-                        # update price and holder fields
-                        self.items[item_id]['price'] = offer
-                        self.items[item_id]['holder'] = username
-
-                        # reset timeouts!
-                        self.items[item_id]['timeouts'] = 0
-                        log('Reset timeout')
-
-                        # debug log
-                        log('New holder: {0}'.format(username))
-
-                        # renew timeout value
-                        signal.alarm(self.L)
-
-                        # sync with other server on priority
-                        self.sync(messages.SyncPriceMsg(
-                                        item_id = item_id,
-                                        username = username,
-                                        price = offer)
-                        )
-                    
-                        # create new high bid response for clients
-                        self.pending.append(messages.NewHighBidMsg(
-                                        item_id = item_id,
-                                        bidder = msg_dec['username'],
-                                        price = offer)
-                        )
-
-                else:
-                    # invalid item id for bid message
-                    response.append(messages.ErrorMsg(
-                                    item_id = item_id,
-                                    username = msg_dec['username'],
-                                    error = errors.invalid_item_id)
-                    )
-
-            # NOTE: Case 3 -> SYNCPRICE
-
-            if msg_dec['header'] == 'sync_price':
-
-                # get info
-                price    = msg_dec['price']
-                item_id  = msg_dec['item_id']
-                username = msg_dec['username']
-
-                # update info if necessary
-                if self.items[item_id]['price'] < price:
-
-                    # update item info
-                    self.items[item_id]['price'] = price
-                    self.items[item_id]['holder'] = username
-
-                    # update timeouts
-                    self.items[item_id]['timeouts'] = 0
-
-                    # add to pending messages to inform clients
-                    self.pending.append(messages.NewHighBidMsg(
-                                        item_id = item_id,
-                                        price = price,
-                                        bidder = username)
-                    )
-                    
-                    # debug log
-                    log('New holder: {0}'.format(self.items[item_id]['holder']))
-
-                    # renew timeout for item
-                    signal.alarm(self.L)
-
-                # other server sent a false message
-                # we need to sync again!
-                else:                    
-                    # send syncprice to other server
-                    self.sync(messages.SyncPriceMsg(
-                                        item_id = item_id,
-                                        price = price,
-                                        username = username)
-                    )
-
-            # NOTE: Case 4 -> STOPBID
-
-            if msg_dec['header'] == 'stop_bid':
-
-                winprice = self.items[self.curr_item_id]['price']
-                winholder = self.items[self.curr_item_id]['holder']
-
-                if msg_dec['price'] > winprice:
-                    winholder = msg_dec['winner']
-                    winprice = msg_dec['price']
-
-                # add a stop bid message to pending messages
-                # in order to be delivered to all my clients
-                stopmsg = messages.StopBidMsg(
-                                    item_id = msg_dec['item_id'],
-                                    winner = winholder,
-                                    price = winprice
-                )       
-                
-                
-                if msg_dec['item_id'] in self.items:
-                    
-                    # only add if message is not already there
-                    # from sigalrm trigger
-                    self.pending.append(stopmsg)
-
-                    # if in my items, I must delete it
-                    # as the other guy got triggered by alarm
-                    try:
-                        del self.items[msg_dec['item_id']]
-                        log('Deleted item %d' % msg_dec['item_id'])
-                    except KeyError:
-                        pass
-
-                    if self.items:  
-                        # if nonempty, update item counter
-                        try:
-                            self.curr_item_id = min(self.items)
-                            self.pending.append(self.start_msg())
-                            self.accepting = True
-                            self.interest_phase = True
-                        except KeyError:
-                            pass
-
-                if not self.items:
-                    # inform my clients that auction is finished
-                    self.pending.append(messages.CompleteMsg())
-
-            # NOTE: Case 5 -> INTERESTED
-                
-            if msg_dec['header'] == 'i_am_interested':
-
-                if self.interest_phase:
-
-                    # add user to interested people
-                    self.items[self.curr_item_id]['interested'].append(
-                                        msg_dec['username'])
-
-                    log('User %s is interested for item %d' % 
-                                (msg_dec['username'], self.curr_item_id))
-
-                    # sync with other server
-                    self.sync(messages.SyncInterestMsg(
-                                    username=msg_dec['username']))
-
-                    # respond to bidder with acknowledgement message
-                    response.append(messages.AckInterestMsg())
-
-
-
-            # NOTE: Case 6 -> STARTAUCTION
-
-            if msg_dec['header'] == 'start_auction':
-
-                # start the alarm sequence here
-                self.auctioning = True
-                self.accepting = True
-                signal.alarm(self.L)
-
-            if msg_dec['header'] == 'sync_interest':
-
-                # update interest info for item
-                self.items[self.curr_item_id]['interested'].append(
-                            msg_dec['username'])
+        # update price, holder and version fields,
+        # reset timeouts and renew the lot window
+        self.update_price(item_id, offer, username, version)
+        log('Reset timeout')
+
+        # debug log
+        log('New holder: {0}'.format(username))
+
+        # sync with other servers on priority
+        self.sync(messages.SyncPriceMsg(
+                        item_id = item_id,
+                        username = username,
+                        price = offer,
+                        version = version)
+        )
     
-            if msg_dec['header'] == 'quit':
+        # create new high bid response for clients
+        self.pending.append(messages.NewHighBidMsg(
+                        item_id = item_id,
+                        bidder = username,
+                        price = offer,
+                        version = version)
+        )
+        self.metrics.incr('bids.accepted')
+
+    @dispatch.handles('sync_price')
+    def on_sync_price(self, msg_dec, connection, response):
+
+        # get info
+        price    = msg_dec['price']
+        item_id  = msg_dec['item_id']
+        username = msg_dec['username']
+        version  = msg_dec.get('version', 0)
+
+        # the lot may have been closed meanwhile
+        if item_id not in self.items:
+            return
+
+        # update info if necessary
+        if self.update_price(item_id, price, username, version):
+
+            # add to pending messages to inform clients
+            self.pending.append(messages.NewHighBidMsg(
+                                item_id = item_id,
+                                price = price,
+                                bidder = username,
+                                version = version)
+            )
+            
+            # debug log
+            log('New holder: {0}'.format(self.items[item_id]['holder']))
 
-                # retrieve disconnected client's identity
-                # and remove from registrar table
+        # otherwise the other server sent a stale or duplicate
+        # price: it is dropped, without replying. The server
+        # that accepted the newer price has already sent it
+        # to every peer, so nothing needs to be synced again.
 
-                if msg_dec['username'] in self.registrar_table:
-                    del self.registrar_table[msg_dec['username']]
-                    log('Removed user %s' % msg_dec['username'])
+    @dispatch.handles('stop_bid')
+    def on_stop_bid(self, msg_dec, connection, response):
 
-                # NOTE: connections that close abruptly
-                #       do not send this message. They are handled
-                #       in the serve() loop instead.
-                #       No need to remove from select.select's lists,
-                #       as it is handled there too.
-        
-        # return list of messages for response
-        return response
+        item_id = msg_dec['item_id']
+
+        # another server closed the lot on its timer first.
+        # If I have already closed the lot based on my own
+        # timer, the message can be ignored.
+        if item_id in self.items:
+
+            winprice = self.items[item_id]['price']
+            winholder = self.items[item_id]['holder']
+
+            if msg_dec['price'] > winprice:
+                winholder = msg_dec['winner']
+                winprice = msg_dec['price']
+
+            # close the lot as well, no need to reply
+            self.stop_lot(item_id, winholder, winprice, notify=False)
+
+    @dispatch.handles('i_am_interested')
+    def on_interested(self, msg_dec, connection, response):
+
+        # bidders may omit the lot they are interested in
+        item_id = msg_dec.get('item_id', self.default_lot())
+        lot = self.lots.get(item_id)
+
+        if lot and lot['interest_phase']:
+
+            # a repeated interest is acknowledged again,
+            # but counted (and synced) only once
+            if msg_dec['username'] in self.items[item_id]['interested']:
+                response.append(messages.AckInterestMsg(item_id=item_id))
+                return
+
+            # add user to interested people
+            self.items[item_id]['interested'].append(msg_dec['username'])
+            self.record('interest', item_id=item_id,
+                        username=msg_dec['username'])
+
+            log('User %s is interested for item %d' % 
+                        (msg_dec['username'], item_id))
+
+            # sync with other servers
+            self.sync(messages.SyncInterestMsg(
+                            username=msg_dec['username'],
+                            item_id=item_id))
+
+            # respond to bidder with acknowledgement message
+            response.append(messages.AckInterestMsg(item_id=item_id))
+
+    @dispatch.handles('start_auction')
+    def on_start_auction(self, msg_dec, connection, response):
+
+        # start the lot timers here, unless one of
+        # my bidders has already started the auction
+        if not self.auctioning:
+            self.start_auction()
+
+    @dispatch.handles('sync_interest')
+    def on_sync_interest(self, msg_dec, connection, response):
+
+        item_id = msg_dec.get('item_id', self.default_lot())
+
+        # update interest info for item. A rejoining server
+        # may get the same interest from the state transfer.
+        if (item_id in self.items and msg_dec['username'] not in
+                self.items[item_id]['interested']):
+            self.items[item_id]['interested'].append(msg_dec['username'])
+            self.record('interest', item_id=item_id,
+                        username=msg_dec['username'])
+
+    @dispatch.handles('join')
+    def on_join(self, msg_dec, connection, response):
+
+        # the connection is the link of a restarted server,
+        # not a bidder. Link to it again, and stream the
+        # state of the auction if asked to. Only the servers
+        # of the auction may rejoin it.
+        address = (msg_dec['host'], msg_dec['port'])
+
+        if address not in self.peers:
+            log('join from unknown server {0}:{1}'.format(*address))
+            response.append(messages.ErrorMsg(message='join',
+                                              error=errors.not_a_peer))
+            return
+
+        session = self.sessions.get(connection)
+        if session:
+            self.sessions.make_peer(session)
+
+        log('{0}:{1} rejoins the auction'.format(
+                msg_dec['host'], msg_dec['port']))
+
+        self.reconnect_peer((msg_dec['host'], msg_dec['port']),
+                            msg_dec['transfer'])
+
+    def from_donor(self, header, connection, response):
+
+        ''' tells whether a message of a state transfer may be
+            applied: it must come from a peer, while I rejoin '''
+
+        session = self.sessions.get(connection)
+
+        if session is None or not session.peer:
+            response.append(messages.ErrorMsg(message=header,
+                                              error=errors.not_a_peer))
+            return False
+
+        # a late transfer, once I have caught up, is ignored
+        if not self.joining:
+            log('{0} - Ignored {1} after the transfer'.format(
+                    self.port, header))
+            return False
+
+        return True
+
+    @dispatch.handles('state_chunk')
+    def on_state_chunk(self, msg_dec, connection, response):
+
+        if not self.from_donor('state_chunk', connection, response):
+            return
+
+        self.merge_chunk(msg_dec)
+
+    @dispatch.handles('state_end')
+    def on_state_end(self, msg_dec, connection, response):
+
+        if not self.from_donor('state_end', connection, response):
+            return
+
+        self.finish_join(msg_dec)
+
+    @dispatch.handles('quit')
+    def on_quit(self, msg_dec, connection, response):
+
+        # retrieve disconnected client's identity
+        # and remove from the session table
+
+        session = self.sessions.lookup(msg_dec['username'])
+        if session:
+            self.sessions.unregister(session)
+            self.record('unregister', username=msg_dec['username'])
+            log('Removed user %s' % msg_dec['username'])
+
+        # NOTE: connections that close abruptly
+        #       do not send this message. Their session
+        #       is closed by the engine instead.
 
 
@@ -0,0 +1,1480 @@
+#!/usr/bin/python
+
+''' Benchmarks for the hot paths of the auction system.
+
+    Usage: ./benchmark.py [--json FILE] [--baseline FILE] [name ...]
+
+    Without arguments every registered benchmark is run. A name may
+    also be a suite of benchmarks (see SUITES). --json writes the
+    results in machine-readable form and --baseline compares them with
+    the results saved by an earlier --json run: the exit status is 1
+    if any of them got slower by more than --tolerance.
+'''
+
+import sys, os, time, socket, select, resource, tracemalloc, json
+import argparse, timeit
+import tempfile, multiprocessing, random, contextlib, heapq
+
+import eventloop, messages, timers, sessions, itemstore, loadgen, errors
+from base import Server_Base
+import serializer as serial
+
+# registry of benchmarks, in order of definition
+BENCHMARKS = {}
+
+# every result reported so far, for --json and --baseline
+RESULTS = []
+
+def benchmark(func):
+
+    ''' decorator that registers a benchmark under its name '''
+
+    BENCHMARKS[func.__name__] = func
+    return func
+
+def report(name, **results):
+
+    ''' prints a single result line and keeps the result '''
+
+    RESULTS.append(dict(results, benchmark=name))
+
+    fields = ' '.join('{0}={1}'.format(k, v) for (k, v) in results.items())
+    print('{0:<28} {1}'.format(name, fields))
+
+def raise_fd_limit():
+
+    ''' raises the soft limit of open files up to the hard one '''
+
+    (soft, hard) = resource.getrlimit(resource.RLIMIT_NOFILE)
+    try:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        return hard
+    except (ValueError, OSError):
+        return soft
+
+def idle_sockets(n):
+
+    ''' creates n idle, always-writable sockets. Datagram sockets
+        are used so that a connection costs a single descriptor '''
+
+    conns = []
+    for _ in range(n):
+        conn = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        conn.bind(('127.0.0.1', 0))
+        conn.setblocking(0)
+        conns.append(conn)
+
+    return conns
+
+class SelectLoop(object):
+
+    ''' the polling pattern of the former Auctioneer.serve():
+        every connection is in both the read and the write list '''
+
+    def __init__(self, conns, on_read):
+        self.conns = conns
+        self.on_read = on_read
+
+        # raises ValueError for descriptors beyond FD_SETSIZE
+        select.select(conns, [], [], 0)
+
+    def run_once(self, timeout=None):
+
+        # never blocks, as every socket is always writable
+        [rx, wx, _] = select.select(self.conns, self.conns, [], timeout)
+        for conn in rx:
+            self.on_read(conn)
+        return len(rx) + len(wx)
+
+def make_loop(engine, conns, on_read):
+
+    if engine == 'select':
+        return SelectLoop(conns, on_read)
+
+    loop = eventloop.EventLoop()
+    for conn in conns:
+        loop.add_reader(conn, on_read)
+
+    return loop
+
+@benchmark
+def eventloop_scaling(sizes=(10, 1000, 10000), idle_secs=1.0, events=2000):
+
+    ''' idle CPU usage and per-event cost of the select() based loop
+        and of the selectors based EventLoop, for a growing number
+        of connections '''
+
+    limit = raise_fd_limit()
+
+    for n in sizes:
+
+        if n + 64 > limit:
+            report('eventloop_scaling', conns=n, skipped='fd limit %d' % limit)
+            continue
+
+        conns = idle_sockets(n)
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        target = conns[n // 2].getsockname()
+
+        received = [0]
+        def on_read(conn):
+            conn.recv(64)
+            received[0] += 1
+
+        for engine in ('select', 'selectors'):
+
+            try:
+                loop = make_loop(engine, conns, on_read)
+            except ValueError: # descriptors beyond FD_SETSIZE
+                report('eventloop_scaling', engine=engine, conns=n,
+                       skipped='FD_SETSIZE')
+                continue
+
+            # idle: nothing is ever sent, measure CPU burnt
+            (cpu, wall) = (time.process_time(), time.monotonic())
+            while time.monotonic() - wall < idle_secs:
+                loop.run_once(timeout=idle_secs)
+            idle_cpu = (time.process_time() - cpu) / (time.monotonic() - wall)
+
+            # per event: one datagram at a time, wait for its delivery
+            received[0] = 0
+            start = time.perf_counter()
+            for _ in range(events):
+                sender.sendto(b'x', target)
+                goal = received[0] + 1
+                while received[0] < goal:
+                    loop.run_once()
+            per_event = (time.perf_counter() - start) / events
+
+            report('eventloop_scaling', engine=engine, conns=n,
+                   idle_cpu='%.1f%%' % (100 * idle_cpu),
+                   per_event_us='%.1f' % (1e6 * per_event))
+
+            if engine == 'selectors':
+                loop.close()
+
+        sender.close()
+        for conn in conns:
+            conn.close()
+
+class ChunkSource(object):
+
+    ''' replays a list of received chunks through recv()
+        and recv_into(), like a socket would '''
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.index = 0
+
+    def recv(self, size):
+        chunk = self.chunks[self.index]
+        self.index += 1
+        return chunk
+
+    def recv_into(self, buff):
+        chunk = self.recv(len(buff))
+        buff[:len(chunk)] = chunk
+        return len(chunk)
+
+def bid_stream(count):
+
+    ''' a realistic mix of client and peer frames, as bytes '''
+
+    mix = [
+        messages.BidMsg(item_id=1, price=100, username='johndoe'),
+        messages.SyncPriceMsg(item_id=1, price=120, username='janedoe'),
+        messages.InterestedMsg(username='johndoe'),
+        messages.BidMsg(item_id=1, price=150, username='janedoe'),
+    ]
+
+    return b''.join(mix[i % len(mix)].send() for i in range(count))
+
+@benchmark
+def framing_throughput(count=200000, chunk=2048):
+
+    ''' messages/sec decoded by the former unpack_msg() + split() path
+        and by the incremental FrameDecoder. The split path is fed
+        chunks cut at frame boundaries, as it cannot handle frames
+        split across reads; FrameDecoder gets raw 2KB chunks. '''
+
+    stream = bid_stream(count)
+
+    # frame-aligned chunks of at most ~chunk bytes
+    aligned = []
+    start = 0
+    while start < len(stream):
+        end = stream.rfind(b'|', start, start + chunk) + 1
+        aligned.append(stream[start:end])
+        start = end
+
+    raw = [stream[i:i + chunk] for i in range(0, len(stream), chunk)]
+
+    # former path: recv(), decode to str, split, json.loads()
+    source = ChunkSource(aligned)
+    decoded = 0
+    start = time.perf_counter()
+    for _ in aligned:
+        data = serial.unpack_msg(source.recv(chunk))
+        decoded += len([serial.decode_msg(i)
+                        for i in data.strip('|').split('|')])
+    split_rate = decoded / (time.perf_counter() - start)
+
+    # incremental path: recv_into() a reusable buffer
+    source = ChunkSource(raw)
+    decoder = serial.FrameDecoder()
+    decoded = 0
+    start = time.perf_counter()
+    for _ in raw:
+        decoder.recv(source, chunk)
+        decoded += len(decoder.messages())
+    decoder_rate = decoded / (time.perf_counter() - start)
+
+    report('framing_throughput', path='split', msgs_per_sec=int(split_rate))
+    report('framing_throughput', path='FrameDecoder',
+           msgs_per_sec=int(decoder_rate),
+           speedup='%.2fx' % (decoder_rate / split_rate))
+
+def encoder(codec):
+
+    ''' encodes a message from its fields, bypassing the
+        bytes cached by Message.send() '''
+
+    if codec == serial.BINARY:
+        return lambda msg: serial.encode_binary(msg.msg_type, msg.msg)
+
+    return lambda msg: bytes(serial.encode_msg(msg.msg_type, msg.msg),
+                             'ascii')
+
+@benchmark
+def codec_comparison(count=100000):
+
+    ''' frame size, encode and decode rate of the JSON and the
+        binary codec for the high-frequency messages '''
+
+    mix = [
+        messages.BidMsg(item_id=17, price=1200, username='johndoe'),
+        messages.NewHighBidMsg(item_id=17, price=1200, bidder='johndoe'),
+        messages.SyncPriceMsg(item_id=17, price=1080.0, username='johndoe'),
+        messages.StartBidMsg(item_id=18, price=150,
+                             description='A small pirate hat'),
+    ]
+
+    for codec in (serial.JSON, serial.BINARY):
+
+        size = sum(len(i.send(codec)) for i in mix) / len(mix)
+
+        # encode from the message fields (Message caches its bytes)
+        encode = encoder(codec)
+
+        start = time.perf_counter()
+        for i in range(count):
+            encode(mix[i % len(mix)])
+        encode_rate = count / (time.perf_counter() - start)
+
+        stream = b''.join(mix[i % len(mix)].send(codec) for i in range(count))
+        decoder = serial.FrameDecoder()
+        start = time.perf_counter()
+        decoder.feed(stream)
+        decoded = len(decoder.messages())
+        decode_rate = decoded / (time.perf_counter() - start)
+
+        # a state chunk of a rejoin, with interest lists, is
+        # well over 64KB: it must make a single frame all the same
+        chunk = messages.StateChunkMsg(first=1, last=512, items=[
+                    [i, 100 + i, 'johndoe', i,
+                     ['bidder%d' % j for j in range(20)]]
+                    for i in range(1, 513)])
+        decoder = serial.FrameDecoder()
+        decoder.feed(chunk.send(codec))
+        (decoded,) = decoder.messages()
+        assert decoded['items'] == chunk['items']
+
+        report('codec_comparison', codec=codec,
+               avg_frame_bytes='%.1f' % size,
+               encode_per_sec=int(encode_rate),
+               decode_per_sec=int(decode_rate),
+               chunk_frame_bytes=len(chunk.send(codec)))
+
+def drain(conns):
+
+    ''' reads whatever is available on non-blocking sockets '''
+
+    for conn in conns:
+        try:
+            while conn.recv(65536):
+                pass
+        except BlockingIOError:
+            pass
+
+@benchmark
+def broadcast_fanout(sizes=(10, 100, 500), rounds=200):
+
+    ''' cost of broadcasting a NewHighBid + SyncPrice pair to N
+        bidders: encoding and sending per bidder (former path) vs
+        encoding once and sharing the buffers through sendmsg() '''
+
+    raise_fd_limit()
+
+    for n in sizes:
+
+        pairs = [socket.socketpair() for _ in range(n)]
+        for pair in pairs:
+            for conn in pair: conn.setblocking(0)
+
+        loop = eventloop.EventLoop()
+        queues = [eventloop.Connection(loop, a) for (a, _) in pairs]
+        receivers = [b for (_, b) in pairs]
+
+        for codec in (serial.JSON, serial.BINARY):
+
+            timings = {}
+            encode = encoder(codec)
+
+            for path in ('per_client', 'encode_once'):
+
+                elapsed = 0.0
+                for r in range(rounds):
+
+                    pending = [
+                        messages.NewHighBidMsg(item_id=3, price=100 + r,
+                                               bidder='johndoe'),
+                        messages.SyncPriceMsg(item_id=3, price=100 + r,
+                                              username='johndoe'),
+                    ]
+
+                    start = time.perf_counter()
+
+                    if path == 'per_client':
+                        for queue in queues:
+                            queue.write(b''.join(encode(i)
+                                                 for i in pending))
+                    else:
+                        sendbuff = [i.send(codec) for i in pending]
+                        for queue in queues:
+                            queue.writev(sendbuff)
+
+                    elapsed += time.perf_counter() - start
+                    drain(receivers)
+
+                timings[path] = elapsed / rounds
+
+            report('broadcast_fanout', codec=codec, bidders=n,
+                   per_client_us='%.1f' % (1e6 * timings['per_client']),
+                   encode_once_us='%.1f' % (1e6 * timings['encode_once']))
+
+        loop.close()
+        for pair in pairs:
+            for conn in pair: conn.close()
+
+class EagerMessage(object):
+
+    ''' the former message model: encodes to JSON on construction,
+        re-encodes to bytes on every send(), and to a binary frame on
+        every send() with that codec '''
+
+    def __init__(self, msg_type, msg_details):
+        self.msg_type = msg_type
+        self.msg = msg_details
+        self.msg_data = serial.encode_msg(msg_type, msg_details)
+
+    def send(self, codec=serial.JSON):
+        if codec == serial.BINARY:
+            return serial.encode_binary(self.msg_type, self.msg)
+        return bytes(self.msg_data, 'ascii')
+
+    def details(self):
+        return json.loads(self.msg_data)
+
+@benchmark
+def message_model(count=100000, sends=3, repeat=5):
+
+    ''' objects/sec for constructing a message and sending it a few
+        times, and bytes allocated per (retained) message, for the
+        former eager model and the lazy, slotted one. The sends go to
+        JSON bidders (json), or to bidders of both codecs (mixed), as
+        a broadcast does, for a NewHighBidMsg (packed in binary
+        frames) and a StopBidMsg (wrapped JSON in binary frames).
+        Rates are the best of repeat runs. '''
+
+    # the eager and the lazy construction of each message
+    samples = {
+        'new_high_bid': (
+            lambda i: EagerMessage('new_high_bid', dict(
+                item_id=3, price=i, bidder='johndoe', version=i)),
+            lambda i: messages.NewHighBidMsg(
+                item_id=3, price=i, bidder='johndoe', version=i)),
+        'stop_bid': (
+            lambda i: EagerMessage('stop_bid', dict(
+                item_id=3, winner='johndoe', price=i)),
+            lambda i: messages.StopBidMsg(
+                item_id=3, winner='johndoe', price=i)),
+    }
+
+    codecs = {
+        'json':  [serial.JSON] * sends,
+        'mixed': [(serial.JSON, serial.BINARY)[k % 2] for k in range(sends)],
+    }
+
+    for (header, (eager, lazy)) in samples.items():
+        for (sent, order) in codecs.items():
+            for (name, make) in (('eager', eager), ('lazy', lazy)):
+
+                best = float('inf')
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    for i in range(count // repeat):
+                        msg = make(i)
+                        for codec in order:
+                            msg.send(codec)
+                    best = min(best, time.perf_counter() - start)
+
+                report('message_model', msg=header, sends=sent, model=name,
+                       msgs_per_sec=int(count // repeat / best))
+
+    for (name, make) in zip(('eager', 'lazy'), samples['new_high_bid']):
+
+        # allocations of messages that are kept, e.g. in pending
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        kept = [make(i) for i in range(10000)]
+        for msg in kept:
+            msg.send()
+        allocated = (tracemalloc.get_traced_memory()[0] - before) / len(kept)
+        tracemalloc.stop()
+        del kept
+
+        report('message_model', model=name, bytes_per_msg=int(allocated))
+
+    # decoding incoming frames straight into typed messages
+    stream = bid_stream(count)
+    for (name, factory) in (('dict', None), ('typed', messages.from_frame)):
+        decoder = serial.FrameDecoder(factory=factory)
+        start = time.perf_counter()
+        decoder.feed(stream)
+        decoded = len(decoder.messages())
+        report('message_model', decode=name,
+               msgs_per_sec=int(decoded / (time.perf_counter() - start)))
+
+@benchmark
+def timer_resets(lots=(1, 100, 10000), resets=200000):
+
+    ''' cost of restarting the window of a lot on every high bid:
+        cancelling its timer and scheduling a new one, against moving
+        the deadline of the lot and its timer only once it fires '''
+
+    for size in lots:
+
+        # reschedule: cancel() + call_at() on every bid
+        heap = timers.Timers()
+        handles = [heap.call_later(1, None) for _ in range(size)]
+        start = time.perf_counter()
+        for i in range(resets):
+            lot = i % size
+            handles[lot].cancel()
+            handles[lot] = heap.call_later(1, None)
+        rate = resets / (time.perf_counter() - start)
+        report('timer_resets', lots=size, reset='cancel',
+               resets_per_sec=int(rate), heap_entries=len(heap.heap))
+
+        # renew: the deadline moves, the timer stays
+        heap = timers.Timers()
+        deadlines = [heap.clock() + 1 for _ in range(size)]
+        for lot in range(size):
+            heap.call_at(deadlines[lot], None)
+        start = time.perf_counter()
+        for i in range(resets):
+            deadlines[i % size] = heap.clock() + 1
+        rate = resets / (time.perf_counter() - start)
+        report('timer_resets', lots=size, reset='deadline',
+               resets_per_sec=int(rate), heap_entries=len(heap.heap))
+
+def tcp_pair():
+
+    ''' a connected pair of non-blocking TCP sockets on localhost '''
+
+    listener = socket.socket()
+    listener.bind(('localhost', 0))
+    listener.listen(1)
+
+    client = socket.create_connection(listener.getsockname())
+    (server, _) = listener.accept()
+    listener.close()
+
+    for conn in (client, server):
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn.setblocking(0)
+
+    return (client, server)
+
+@benchmark
+def sync_batching(storms=(1, 10, 100), peers=4, iterations=500):
+
+    ''' peer traffic of a bid storm: one SyncPrice per accepted bid,
+        for a growing number of bids per loop iteration. The former
+        sync() waited for every peer and sent each message on its
+        own; now the messages of an iteration go in one write. '''
+
+    # peer links are TCP connections: unlike a socketpair, their
+    # writability does not depend on the number of small sends
+    pairs = [tcp_pair() for _ in range(peers)]
+
+    loop = eventloop.EventLoop()
+    links = [eventloop.Connection(loop, a) for (a, _) in pairs]
+    senders = [a for (a, _) in pairs]
+    receivers = [b for (_, b) in pairs]
+
+    for bids in storms:
+
+        timings = {}
+
+        for path in ('per_message', 'batched'):
+
+            (elapsed, sends) = (0.0, 0)
+            for r in range(iterations):
+
+                syncs = [messages.SyncPriceMsg(item_id=3, price=100 + i,
+                                               username='johndoe')
+                         for i in range(bids)]
+
+                start = time.perf_counter()
+
+                if path == 'per_message':
+                    for msg in syncs:
+                        data = msg.send()
+                        for other in senders:
+                            select.select([], [other], [])
+                            other.sendall(data)
+                            sends += 1
+                else:
+                    data = b''.join(msg.send() for msg in syncs)
+                    for link in links:
+                        link.write(data)
+                        sends += 1
+
+                elapsed += time.perf_counter() - start
+                drain(receivers)
+
+            timings[path] = (elapsed / iterations, sends / iterations)
+
+        report('sync_batching', bids_per_iter=bids, peers=peers,
+               per_message_us='%.1f' % (1e6 * timings['per_message'][0]),
+               per_message_sends=int(timings['per_message'][1]),
+               batched_us='%.1f' % (1e6 * timings['batched'][0]),
+               batched_sends=int(timings['batched'][1]))
+
+    loop.close()
+    for pair in pairs:
+        for conn in pair: conn.close()
+
+@benchmark
+def session_bookkeeping(sizes=(100, 1000, 10000), churn=2000):
+
+    ''' cost of a disconnect followed by a reconnect with N bidders
+        registered: the former registrar table (scanned for the
+        username of a connection) and clients list, against the
+        SessionTable indexes '''
+
+    for n in sizes:
+
+        # former: username -> connection, and a list of connections
+        conns = [object() for _ in range(n)]
+        rng = random.Random(n)
+        picks = [rng.randrange(n) for _ in range(churn)]
+        registrar_table = {'user%d' % i: conn for (i, conn) in enumerate(conns)}
+        clients = list(conns)
+
+        start = time.perf_counter()
+        for i in picks:
+            conn = conns[i]
+            usrname = next((k for (k, v) in registrar_table.items()
+                            if v == conn), None)
+            del registrar_table[usrname]
+            clients.remove(conn)
+            registrar_table[usrname] = conn
+            clients.append(conn)
+        scan = (time.perf_counter() - start) / churn
+
+        table = sessions.SessionTable()
+        for (i, conn) in enumerate(conns):
+            table.register(table.open(conn), 'user%d' % i)
+
+        start = time.perf_counter()
+        for i in picks:
+            conn = conns[i]
+            usrname = table.close(conn).username
+            table.register(table.open(conn), usrname)
+            table.touch(table.get(conn))
+        indexed = (time.perf_counter() - start) / churn
+
+        report('session_bookkeeping', sessions=n,
+               scan_us='%.2f' % (1e6 * scan),
+               indexed_us='%.2f' % (1e6 * indexed))
+
+def former_item(about, price):
+
+    ''' an item as a dictionary, as the servers used to keep them '''
+
+    return {'about': about, 'price': price, 'holder': None,
+            'interested': [], 'timeouts': 0, 'version': 0}
+
+@benchmark
+def item_store(sizes=(10000, 100000, 1000000), rotations=20, lots=4):
+
+    ''' memory per item of a catalog, and cost of closing a lot and
+        opening the next one: dictionaries searched for the smallest
+        waiting ids, against the ItemStore columns and cursor '''
+
+    for n in sizes:
+
+        # descriptions are read from a file: a new string per line
+        descriptions = ['A Cowboy Hat.', 'A Coin.', 'An old lamp.']
+        describe = lambda i: ' '.join(descriptions[i % 3].split())
+
+        tracemalloc.start()
+        items = {i + 1: former_item(describe(i), 10 + i)
+                 for i in range(n)}
+        former_bytes = tracemalloc.get_traced_memory()[0] / n
+        tracemalloc.stop()
+
+        # former rotation: delete the closed item, then search all
+        # the items for the smallest waiting ones
+        open_lots = dict.fromkeys(range(1, lots + 1))
+        start = time.perf_counter()
+        for _ in range(rotations):
+            closed = next(iter(open_lots))
+            del open_lots[closed]
+            del items[closed]
+            waiting = (i for i in items if i not in open_lots)
+            for item_id in heapq.nsmallest(1, waiting):
+                open_lots[item_id] = None
+        former_us = 1e6 * (time.perf_counter() - start) / rotations
+        del items
+
+        tracemalloc.start()
+        store = itemstore.ItemStore()
+        for i in range(n):
+            store.add(describe(i), 10 + i)
+        store_bytes = tracemalloc.get_traced_memory()[0] / n
+        tracemalloc.stop()
+
+        open_lots = dict.fromkeys(store.take(lots))
+        start = time.perf_counter()
+        for _ in range(rotations):
+            closed = next(iter(open_lots))
+            del open_lots[closed]
+            store.discard(closed)
+            for item_id in store.take(1):
+                open_lots[item_id] = None
+        store_us = 1e6 * (time.perf_counter() - start) / rotations
+
+        report('item_store', items=n,
+               dict_bytes_per_item=int(former_bytes),
+               store_bytes_per_item=int(store_bytes),
+               dict_rotation_us='%.1f' % former_us,
+               store_rotation_us='%.1f' % store_us)
+
+class MeshNode(Server_Base):
+
+    ''' a server without connections: messages are handed to
+        handle_messages() and its outbox is delivered to the
+        other nodes by the benchmark '''
+
+    def __init__(self, itemfile, **kwargs):
+
+        super().__init__(itemfile=itemfile, peers=[], **kwargs)
+        self.timers = timers.Timers()
+
+    def call_at(self, when, callback, *args):
+        return self.timers.call_at(when, callback, *args)
+
+@benchmark
+def price_contention(sizes=(2, 4, 8, 16), rounds=200):
+
+    ''' concurrent bids of (often) the same price at every server of
+        a mesh. Stale and duplicate syncs are dropped, so the peer
+        messages are bounded by the accepted bids and every server
+        ends up with the same holder. '''
+
+    (fd, itemfile) = tempfile.mkstemp(suffix='.txt')
+    with os.fdopen(fd, 'w') as items:
+        items.write('1\n1 A contended lot.\n')
+
+    rng = random.Random(1)
+
+    for n in sizes:
+
+        with contextlib.redirect_stderr(open(os.devnull, 'w')):
+
+            nodes = [MeshNode(itemfile) for _ in range(n)]
+            for node in nodes:
+                node.start_auction()
+                node.lots[1]['interest_phase'] = False
+                node.pending = []
+
+            (accepted, delivered) = (0, 0)
+
+            for r in range(rounds):
+
+                # one bid at every server, before any sync arrives
+                for (i, node) in enumerate(nodes):
+                    price = 10 * (r + 1) + rng.choice((0, 0, 1))
+                    node.handle_messages([messages.BidMsg(
+                            item_id=1, price=price, username='b%d' % i)],
+                        None)
+                    accepted += len(node.outbox)
+
+                # deliver the syncs until the mesh is quiet
+                while any(node.outbox for node in nodes):
+                    batches = [(node, node.outbox) for node in nodes]
+                    for node in nodes:
+                        node.outbox = []
+                    for (sender, batch) in batches:
+                        for node in nodes:
+                            if node is not sender and batch:
+                                node.handle_messages(list(batch), None)
+                                delivered += len(batch)
+
+        states = {(node.items[1]['price'], node.items[1]['holder'])
+                  for node in nodes}
+
+        report('price_contention', servers=n, accepted_bids=accepted,
+               peer_msgs=delivered,
+               per_bid='%.2f' % (delivered / max(accepted, 1)),
+               converged=len(states) == 1)
+
+        for node in nodes:
+            node.close()
+
+    os.unlink(itemfile)
+
+@benchmark
+def bid_batching(sizes=(1, 10, 100), bids=20000):
+
+    ''' a bidding war on a single lot: bids of increasing prices,
+        handed to a server one at a time or as the batches of a
+        read. Only the winner of each batch is applied, so syncs
+        and broadcasts are per batch rather than per bid. '''
+
+    (fd, itemfile) = tempfile.mkstemp(suffix='.txt')
+    with os.fdopen(fd, 'w') as items:
+        items.write('1\n1 A contended lot.\n')
+
+    war = [{'header': 'bid', 'item_id': 1, 'price': 10 + i,
+            'username': 'b%d' % (i % 50)} for i in range(bids)]
+
+    for size in sizes:
+
+        batches = [war[i:i + size] for i in range(0, bids, size)]
+
+        for mode in ('per_bid', 'batched'):
+
+            with contextlib.redirect_stderr(open(os.devnull, 'w')):
+
+                node = MeshNode(itemfile)
+                node.start_auction()
+                node.lots[1]['interest_phase'] = False
+                node.pending = []
+
+                (syncs, broadcasts) = (0, 0)
+                start = time.perf_counter()
+
+                for batch in batches:
+                    if mode == 'batched':
+                        node.handle_messages(batch, None)
+                    else:
+                        for bid in batch:
+                            node.handle_messages([bid], None)
+
+                    syncs += len(node.outbox)
+                    broadcasts += len(node.pending)
+                    (node.pending, node.outbox) = ([], [])
+
+                elapsed = time.perf_counter() - start
+                node.close()
+
+            report('bid_batching', batch=size, mode=mode,
+                   bids_per_sec=int(bids / elapsed),
+                   syncs_per_batch='%.2f' % (syncs / len(batches)),
+                   broadcasts_per_batch='%.2f' % (broadcasts / len(batches)))
+
+    os.unlink(itemfile)
+
+def place_bids(node, first, count, group=100):
+
+    ''' places count increasing bids on the first lot of a node,
+        committing the log every group bids (None: only once done) '''
+
+    for price in range(first, first + count):
+        node.handle_messages([messages.BidMsg(
+                item_id=1, price=price, username='b%d' % (price % 2))], None)
+        (node.pending, node.outbox) = ([], [])
+
+        if group and price % group == 0:
+            node.commit_log()
+
+    node.commit_log()
+
+@benchmark
+def wal_throughput(bids=5000, groups=(1, 10, 100)):
+
+    ''' accepted bids/sec of a server without the log, and with it
+        committing every group bids: 1 is a sync per bid, larger
+        groups stand for the bids handled in one loop iteration '''
+
+    (fd, itemfile) = tempfile.mkstemp(suffix='.txt')
+    with os.fdopen(fd, 'w') as items:
+        items.write('1\n1 A logged lot.\n')
+
+    logdir = tempfile.mkdtemp()
+
+    for group in (None,) + tuple(groups):
+
+        wal_path = os.path.join(logdir, 'bench.wal') if group else None
+
+        with contextlib.redirect_stderr(open(os.devnull, 'w')):
+
+            node = MeshNode(itemfile, wal_path=wal_path)
+            node.start_auction()
+            node.lots[1]['interest_phase'] = False
+
+            start = time.perf_counter()
+            place_bids(node, 1, bids, group)
+            elapsed = time.perf_counter() - start
+
+            commits = node.wal.commits if node.wal else 0
+            node.close()
+
+        report('wal_throughput',
+               log='off' if group is None else 'group=%d' % group,
+               bids_per_sec='%.0f' % (bids / elapsed),
+               syncs=commits)
+
+        if wal_path:
+            os.unlink(wal_path)
+
+    os.rmdir(logdir)
+    os.unlink(itemfile)
+
+@benchmark
+def restart_time(history=(1000, 10000, 100000), items=100000, tail=100):
+
+    ''' time to restart a server after history bids, replaying the
+        whole log versus loading the latest snapshot and replaying
+        only the tail logged since (tail bids) '''
+
+    (fd, itemfile) = tempfile.mkstemp(suffix='.txt')
+    with os.fdopen(fd, 'w') as catalog:
+        catalog.write('1\n')
+        for i in range(items):
+            catalog.write('%d Item number %d.\n' % (1 + i % 1000, i))
+
+    logdir = tempfile.mkdtemp()
+    wal_path = os.path.join(logdir, 'bench.wal')
+    snapshot_path = os.path.join(logdir, 'bench.snapshot')
+
+    for bids in history:
+
+        with contextlib.redirect_stderr(open(os.devnull, 'w')):
+
+            # the whole history in the log
+            node = MeshNode(itemfile, wal_path=wal_path)
+            node.start_auction()
+            node.lots[1]['interest_phase'] = False
+            place_bids(node, 1, bids)
+            node.close()
+
+            start = time.perf_counter()
+            node = MeshNode(itemfile, wal_path=wal_path)
+            replayed = time.perf_counter() - start
+            node.close()
+
+            os.unlink(wal_path)
+
+            # a snapshot, then the tail in the log
+            node = MeshNode(itemfile, wal_path=wal_path,
+                            snapshot_path=snapshot_path)
+            node.start_auction()
+            node.lots[1]['interest_phase'] = False
+            place_bids(node, 1, bids)
+            node.save_snapshot()
+            place_bids(node, bids + 1, tail)
+            node.close()
+
+            start = time.perf_counter()
+            node = MeshNode(itemfile, wal_path=wal_path,
+                            snapshot_path=snapshot_path)
+            restored = time.perf_counter() - start
+
+            assert node.items[1]['price'] == bids + tail
+            node.close()
+
+            os.unlink(wal_path)
+            os.unlink(snapshot_path)
+
+        report('restart_time', bids=bids, items=items,
+               log_only_ms='%.1f' % (1e3 * replayed),
+               snapshot_ms='%.1f' % (1e3 * restored))
+
+    os.rmdir(logdir)
+    os.unlink(itemfile)
+
+def free_ports(n):
+
+    ''' n currently unused TCP ports of localhost '''
+
+    socks = [socket.socket() for _ in range(n)]
+    for sock in socks:
+        sock.bind(('localhost', 0))
+    ports = [sock.getsockname()[1] for sock in socks]
+    for sock in socks:
+        sock.close()
+
+    return ports
+
+def run_server(engine, port, peers, itemfile, log_path=os.devnull,
+               **kwargs):
+
+    ''' process target: a quiet auction server, logging to log_path '''
+
+    sys.stdout = open(os.devnull, 'w')
+    sys.stderr = open(log_path, 'w', buffering=1)
+
+    if engine == 'asyncio':
+        from async_auctioneer import AsyncAuctioneer as server
+    else:
+        from auctioneer import Auctioneer as server
+
+    server(port=port, peers=peers, itemfile=itemfile, **kwargs).serve()
+
+class Observer(object):
+
+    ''' a raw bidder connection, collecting decoded messages '''
+
+    def __init__(self, name, port):
+
+        self.name = name
+        self.sock = socket.create_connection(('localhost', port))
+        self.decoder = serial.FrameDecoder()
+        self.send(messages.ConnectMsg(username=name))
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def send(self, msg):
+        self.sock.sendall(msg.send())
+
+    def read(self):
+        self.decoder.recv(self.sock, 65536)
+        return self.decoder.messages()
+
+def wait_all(observers, accept, timeout=5.0):
+
+    ''' reads from the observers until every one of them has
+        received a message accepted by accept(msg). Returns the
+        time at which the last one did, None on timeout. '''
+
+    waiting = set(observers)
+    deadline = time.perf_counter() + timeout
+
+    while waiting:
+
+        left = deadline - time.perf_counter()
+        if left <= 0: return None
+
+        [rx, _, _] = select.select(list(waiting), [], [], left)
+        for obs in rx:
+            if any(accept(msg) for msg in obs.read()):
+                waiting.discard(obs)
+
+    return time.perf_counter()
+
+@benchmark
+def peer_propagation(sizes=(2, 4, 8, 16), rounds=50,
+                     engines=('eventloop', 'asyncio')):
+
+    ''' latency from a bid at one server until the NewHighBid
+        reaches a bidder of every server, as the cluster grows.
+        Each server runs in its own process. '''
+
+    # L = 0.5s: the interest phase ends quickly, and a bid
+    # every round keeps the lot open
+    (fd, itemfile) = tempfile.mkstemp(suffix='.txt')
+    with os.fdopen(fd, 'w') as items:
+        items.write('0.5\n1 A benchmark lot.\n')
+
+    for engine in engines:
+        for n in sizes:
+
+            ports = free_ports(n)
+            procs = [multiprocessing.Process(
+                        target=run_server, daemon=True,
+                        args=(engine, port,
+                              [('localhost', i) for i in ports if i != port],
+                              itemfile))
+                     for port in ports]
+
+            for proc in procs:
+                proc.start()
+
+            # the first accepted connections of a server are its
+            # peers: wait for the mesh before connecting bidders
+            time.sleep(3)
+
+            try:
+                observers = [Observer('obs%d' % i, port)
+                             for (i, port) in enumerate(ports)]
+
+                # the first bidder starts the auction everywhere
+                wait_all(observers, lambda m: m['header'] == 'start_bid')
+                for obs in observers:
+                    obs.send(messages.InterestedMsg(username=obs.name,
+                                                    item_id=1))
+
+                # wait for the end of the interest phase
+                time.sleep(0.8)
+
+                latencies = []
+                for price in range(10, 10 + rounds):
+
+                    start = time.perf_counter()
+                    observers[0].send(messages.BidMsg(
+                            item_id=1, price=price, username='obs0'))
+
+                    done = wait_all(observers,
+                                    lambda m: m['header'] == 'new_high_bid'
+                                              and m['price'] >= price)
+                    if done is None: break
+                    latencies.append(done - start)
+
+                if len(latencies) < rounds:
+                    report('peer_propagation', engine=engine, servers=n,
+                           failed='after %d rounds' % len(latencies))
+                    continue
+
+                latencies.sort()
+                report('peer_propagation', engine=engine, servers=n,
+                       p50_ms='%.2f' % (1e3 * latencies[len(latencies) // 2]),
+                       p99_ms='%.2f' % (1e3 * latencies[-1 - len(latencies) // 100]))
+
+            finally:
+                for proc in procs:
+                    proc.terminate()
+                for proc in procs:
+                    proc.join()
+
+    os.unlink(itemfile)
+
+
+def percentiles(latencies):
+
+    ''' p50 and p99 of a list of latencies, in ms '''
+
+    latencies = sorted(latencies)
+    return ('%.2f' % (1e3 * latencies[len(latencies) // 2]),
+            '%.2f' % (1e3 * latencies[-1 - len(latencies) // 100]))
+
+@benchmark
+def rejoin_transfer(sizes=(10000, 100000, 500000), engine='eventloop'):
+
+    ''' a server of a pair is killed mid-auction and restarted with
+        rejoin=True. Reports the time the other server (the donor)
+        takes to stream the state of the auction, the time from the
+        restart until then (including the second the restarted server
+        waits for its peers to bind), and the bid latency at the
+        donor before and during the rejoin. '''
+
+    for n in sizes:
+
+        (fd, itemfile) = tempfile.mkstemp(suffix='.txt')
+        with os.fdopen(fd, 'w') as catalog:
+            catalog.write('0.5\n')
+            for i in range(n):
+                catalog.write('%d Item number %d.\n' % (1 + i % 1000, i))
+
+        (fd, donor_log) = tempfile.mkstemp(suffix='.err')
+        os.close(fd)
+
+        (donor, port) = free_ports(2)
+
+        def start(port, other, **kwargs):
+            proc = multiprocessing.Process(
+                        target=run_server, daemon=True,
+                        args=(engine, port, [('localhost', other)], itemfile),
+                        kwargs=kwargs)
+            proc.start()
+            return proc
+
+        def transferred():
+            with open(donor_log) as log:
+                for line in log:
+                    if line.startswith('state transfer done'):
+                        return line.split()
+            return None
+
+        procs = [start(donor, port, log_path=donor_log), start(port, donor)]
+
+        # the first accepted connections of a server are its peers:
+        # wait for the mesh, and for large catalogs to load
+        time.sleep(3 + n / 100000)
+
+        def bid(price):
+            start = time.perf_counter()
+            obs.send(messages.BidMsg(item_id=1, price=price, username='obs'))
+            done = wait_all([obs], lambda m: m['header'] == 'new_high_bid'
+                                             and m['price'] >= price)
+            return None if done is None else done - start
+
+        try:
+            obs = Observer('obs', donor)
+            wait_all([obs], lambda m: m['header'] == 'start_bid')
+            obs.send(messages.InterestedMsg(username='obs', item_id=1))
+            time.sleep(0.8)
+
+            price = 10
+            before = []
+            for price in range(price, price + 200):
+                before.append(bid(price))
+
+            procs[1].terminate()
+            procs[1].join()
+
+            restarted = time.perf_counter()
+            procs[1] = start(port, donor, rejoin=True)
+
+            # keep bidding at the donor until it is done streaming
+            (during, done) = ([], None)
+
+            while done is None and time.perf_counter() - restarted < 60:
+                price += 1
+                during.append(bid(price))
+                done = transferred()
+
+            rejoined = time.perf_counter() - restarted
+
+            if None in before or None in during or done is None:
+                report('rejoin_transfer', items=n, failed=True)
+                continue
+
+            # state transfer done: <chunks> chunks, <bytes> bytes in <t>s
+            report('rejoin_transfer', items=n,
+                   transfer_s=done[-1].rstrip('s'),
+                   mbytes='%.1f' % (int(done[5]) / 1e6),
+                   rejoin_s='%.2f' % rejoined,
+                   donor_p50_p99_ms='%s/%s -> %s/%s' % (
+                        percentiles(before) + percentiles(during)),
+                   donor_max_ms='%.2f' % (1e3 * max(during)))
+
+        finally:
+            for proc in procs:
+                proc.terminate()
+            for proc in procs:
+                proc.join()
+
+            os.unlink(itemfile)
+            os.unlink(donor_log)
+
+
+@benchmark
+def load_test(sizes=(100, 1000, 2000), rate=200, duration=8):
+
+    ''' simulated bidders (loadgen.py) against a pair of servers,
+        at a fixed bid rate: throughput and bid latency as the
+        number of connected bidders grows '''
+
+    raise_fd_limit()
+    itemfile = loadgen.items_file(window=1)
+
+    for n in sizes:
+
+        (ports, procs) = loadgen.spawn('eventloop', 2, itemfile, n + 10)
+
+        try:
+            generator = loadgen.LoadGenerator(
+                            [('localhost', port) for port in ports],
+                            bidders=n, rate=rate, duration=duration,
+                            window=1)
+            results = generator.run()
+        finally:
+            for proc in procs:
+                proc.terminate()
+            for proc in procs:
+                proc.join()
+
+        report('load_test', bidders=n, rate=rate,
+               **{key: results[key] for key in
+                  ('bids_per_s', 'msgs_per_s', 'p50_ms',
+                   'p99_ms', 'p999_ms')})
+
+    os.unlink(itemfile)
+
+def reference():
+
+    ''' a fixed piece of work that does not depend on the code
+        being measured, timed alongside it (see per_op()) '''
+
+    return json.dumps({'header': 'reference', 'item_id': 3})
+
+def per_op(func, number, repeat=20):
+
+    ''' (ns, rel) for a call of func: nanoseconds for the best of
+        repeat runs of number / repeat calls, and the same relative
+        to reference(), timed right before each run. The noise of
+        the machine cancels out in rel, which is what is compared
+        with a baseline. '''
+
+    calls = max(number // repeat, 1)
+    (best, ref) = (float('inf'), float('inf'))
+
+    for _ in range(repeat):
+        ref = min(ref, timeit.timeit(reference, number=calls))
+        best = min(best, timeit.timeit(func, number=calls))
+
+    return (int(1e9 * best / calls), round(best / ref, 3))
+
+# fields of a realistic message of each type, by header
+SAMPLE_FIELDS = {
+    'connect':          dict(username='johndoe', codec=serial.JSON),
+    'i_am_interested':  dict(username='johndoe', item_id=3),
+    'ack_interest':     dict(item_id=3),
+    'start_bid':        dict(item_id=3, price=250.0,
+                             description='A mint condition cassette.'),
+    'stop_bid':         dict(item_id=3, winner='johndoe', price=420.0),
+    'new_high_bid':     dict(item_id=3, bidder='johndoe', price=420.0,
+                             version=7),
+    'error':            dict(username='johndoe',
+                             error=errors.not_accepting),
+    'bid':              dict(item_id=3, price=420.0, username='johndoe'),
+    'sync_price':       dict(item_id=3, price=420.0, username='johndoe',
+                             version=7),
+    'sync_interest':    dict(username='johndoe', item_id=3),
+    'quit':             dict(username='johndoe'),
+    'join':             dict(host='localhost', port=9090, transfer=True),
+    'state_chunk':      dict(first=1, last=512, items=[
+                            [i, 250.0, 'johndoe', 7, ['johndoe', 'janedoe']]
+                            for i in range(1, 513)]),
+    'state_end':        dict(auctioning=True, cursor=513, lots=[
+                            [3, False, 2.5, 1, 420.0, 'johndoe', 7,
+                             ['johndoe']]]),
+}
+
+@benchmark
+def serializer_micro(number=20000):
+
+    ''' ns/op of the JSON codec of serializer.py, for a bid '''
+
+    fields = SAMPLE_FIELDS['bid']
+    frame = serial.encode_msg('bid', fields)[:-1]
+    status = dict(item_id=3, price=420.0, holder='johndoe',
+                  interested=True, description='A mint condition cassette.')
+
+    ops = {
+        'encode_msg':    lambda: serial.encode_msg('bid', fields),
+        'decode_msg':    lambda: serial.decode_msg(frame),
+        'encode_status': lambda: serial.encode_status(status),
+    }
+
+    for (op, func) in ops.items():
+        (ns, rel) = per_op(func, number)
+        report('serializer_micro', op=op, ns=ns, rel=rel)
+
+@benchmark
+def messages_micro(number=20000):
+
+    ''' ns/op for constructing every message type, and for the first
+        send() of a fresh message with each codec (later sends of the
+        same message hit its cache) '''
+
+    for (header, cls) in messages.MESSAGE_TYPES.items():
+
+        fields = SAMPLE_FIELDS.get(header, {})
+
+        # chunks are a lot bigger than the other messages
+        n = number // 100 if header == 'state_chunk' else number
+
+        ops = {
+            'construct': lambda: cls(**fields),
+            'json':      lambda: cls(**fields).send(),
+            'binary':    lambda: cls(**fields).send(serial.BINARY),
+        }
+
+        results = {}
+        for (op, func) in ops.items():
+            (results[op + '_ns'], results[op + '_rel']) = per_op(func, n)
+
+        report('messages_micro', msg=cls.__name__, **results)
+
+def mixed_frames(count, users=100):
+
+    ''' count received buffers, as a connection reads them: a
+        bidder (re)connecting and bidding on the open lot, a peer
+        syncing a higher price, and a bidder interested in the lot
+        that is in its interest phase. Prices keep going up, so that
+        every bid and sync is accepted. '''
+
+    batches = []
+    for i in range(count):
+
+        username = 'bidder%d' % (i % users)
+        price = 100 + 2 * i
+
+        batches.append(bytes(''.join((
+            serial.encode_msg('connect', dict(username=username)),
+            serial.encode_msg('bid', dict(item_id=2, price=price,
+                                          username=username)),
+            serial.encode_msg('sync_price', dict(item_id=2, price=price + 1,
+                                                 username='peerbidder',
+                                                 version=2 * i + 2)),
+            serial.encode_msg('i_am_interested', dict(item_id=1,
+                                                      username=username)),
+        )), 'ascii'))
+
+    return batches
+
+@benchmark
+def parse_micro(number=5000, repeat=5):
+
+    ''' us per buffer of mixed frames, fed to the FrameDecoder of
+        their connection and handled by handle_frames(), as the
+        engines do '''
+
+    (fd, itemfile) = tempfile.mkstemp(suffix='.txt')
+    with os.fdopen(fd, 'w') as items:
+        items.write('2\n1 A lot in its interest phase.\n'
+                    '2 A lot open for bids.\n')
+
+    batches = mixed_frames(number)
+    conns = [object() for _ in range(100)]
+    (best, ref) = (float('inf'), float('inf'))
+
+    with contextlib.redirect_stderr(open(os.devnull, 'w')):
+
+        for _ in range(repeat):
+
+            # a fresh server each time, for the prices to go up again
+            node = MeshNode(itemfile, lots=2)
+            node.start_auction()
+            node.lots[2]['interest_phase'] = False
+
+            ref = min(ref, timeit.timeit(reference, number=number))
+
+            decoders = [serial.FrameDecoder() for _ in conns]
+
+            start = time.perf_counter()
+            for (i, data) in enumerate(batches):
+                decoder = decoders[i % len(conns)]
+                decoder.feed(data)
+                node.handle_frames(decoder, conns[i % len(conns)])
+            elapsed = time.perf_counter() - start
+
+            assert node.items[2]['price'] == 100 + 2 * (number - 1) + 1
+            best = min(best, elapsed)
+            node.close()
+
+    report('parse_micro', frames=4, us_per_buffer='%.2f' % (
+                1e6 * best / number), rel=round(best / ref, 2))
+
+    os.unlink(itemfile)
+
+# groups of benchmarks that can be run by a single name
+SUITES = {
+    'micro': ('serializer_micro', 'messages_micro', 'parse_micro'),
+}
+
+# metrics compared with a baseline, by suffix of their name. Absolute
+# timings of the microbenchmarks (ns) vary too much from one run to
+# the next: their cost relative to reference() is compared instead.
+LOWER_IS_BETTER  = ('rel', '_us', '_ms')
+HIGHER_IS_BETTER = ('per_sec', '_per_s')
+
+def result_key(result):
+
+    ''' identifies a result across runs: its benchmark and
+        its non-numeric fields (e.g. op=encode_msg) '''
+
+    return tuple(sorted((k, v) for (k, v) in result.items()
+                        if isinstance(v, (str, bool)) and
+                           not k.endswith(LOWER_IS_BETTER + HIGHER_IS_BETTER)))
+
+def compare(results, baseline, tolerance):
+
+    ''' prints every metric that differs from the baseline by more
+        than tolerance (a fraction) and returns the number of
+        regressions '''
+
+    saved = {result_key(result): result for result in baseline}
+    regressions = 0
+
+    for result in results:
+
+        base = saved.get(result_key(result))
+        if base is None: continue
+
+        for (metric, value) in result.items():
+
+            if not metric.endswith(LOWER_IS_BETTER + HIGHER_IS_BETTER):
+                continue
+
+            try:
+                (old, new) = (float(base[metric]), float(value))
+            except (KeyError, ValueError, TypeError):
+                continue
+            if old <= 0: continue
+
+            # positive change: got worse
+            change = (new - old) / old
+            if metric.endswith(HIGHER_IS_BETTER):
+                change = -change
+
+            if abs(change) <= tolerance: continue
+
+            verdict = 'REGRESSION' if change > 0 else 'improvement'
+            regressions += change > 0
+
+            fields = ' '.join('{0}={1}'.format(k, v)
+                              for (k, v) in result_key(result)
+                              if k != 'benchmark')
+            print('{0:<12} {1} {2} {3}: {4} -> {5} ({6:+.0%})'.format(
+                    verdict, result['benchmark'], fields, metric,
+                    base[metric], value, change))
+
+    return regressions
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+                description='Benchmarks for the hot paths of the auction')
+    parser.add_argument('names', nargs='*', metavar='name',
+                        help='benchmarks or suites to run (default: all)')
+    parser.add_argument('--json', metavar='FILE',
+                        help='write the results to FILE')
+    parser.add_argument('--baseline', metavar='FILE',
+                        help='compare the results with FILE')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='allowed slowdown against the baseline, '
+                             'as a fraction (default: 0.5)')
+    args = parser.parse_args()
+
+    names = []
+    for name in args.names or list(BENCHMARKS):
+        if name not in BENCHMARKS and name not in SUITES:
+            print('Unknown benchmark %s, choose from: %s' % (
+                        name, ', '.join(list(BENCHMARKS) + list(SUITES))))
+            exit(1)
+
+        names.extend(SUITES.get(name, (name,)))
+
+    for name in names:
+        BENCHMARKS[name]()
+
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump({'python': sys.version.split()[0],
+                       'benchmarks': names, 'results': RESULTS}, out,
+                      indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as saved:
+            baseline = json.load(saved)['results']
+
+        if compare(RESULTS, baseline, args.tolerance):
+            exit(1)
@@ -2,13 +2,16 @@
 
 # imports here
 import os
-import time, json, socket, signal, select
+import time, json, socket, signal
 from socket import error as SocketError
 import sys
 
 # import my modules
-import messages, errors
-from serializer import unpack_msg, decode_msg, encode_status
+import errors, dispatch, eventloop, client
+from serializer import decode_msg, encode_status, JSON
+
+# messages about a single lot
+LOT_HEADERS = ('sync_price', 'new_high_bid', 'ack_interest', 'stop_bid')
 
 def log(msg):
    
@@ -23,11 +26,19 @@ class Bidder(object):
         connection is established, the bidding logic is implemented.
     '''
 
-    def __init__(self, username, server_address=('localhost', 50000)):
+    def __init__(self, username, server_address=('localhost', 50000),
+                       codec=JSON, strategy=None):
 
         # initialize my identifier(s)
         self.username = username
 
+        # optional bidding strategy, consulted on the events of
+        # my lot instead of waiting for a frontend (see strategy.py)
+        self.strategy = strategy
+
+        # wire codec of the messages I send and ask to receive
+        self.codec = codec
+
         # client status structure
         self.status = {
             'bidding': False,       # can i bid?
@@ -38,26 +49,39 @@ class Bidder(object):
             'description': ''
         }
 
-        # NOTE: using the **kwargs notation for initializing messages
-        connmsg = messages.ConnectMsg(username=username)
-        
-        # try to initialize socket
-        try:
-            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        except SocketError:
-            log('Unable to initialize socket')
-            exit(1)
+        # handlers of the messages of the server, by header
+        self.handlers = dispatch.handler_table(self)
+
+        # the connection to the server and the connections of
+        # the frontends, on an event loop (see client.py)
+        self.loop = eventloop.EventLoop()
+        self.client = client.AuctionClient(self.loop, server_address,
+                                           username, codec)
+        self.frontends = {}
+
+        # the timer of the strategy, if it has one
+        self.timer = None
+
+        # set when the status changed, to echo it to the frontends
+        self.msg_received = False
 
-        # attempt a connection to the server
+        for header in self.handlers:
+            self.client.on(header, self.handle_event)
+        self.client.on('closed', self.disconnected)
+
+        # attempt a connection to the server, and send a connection
+        # message in order to become registered
         try:
-            self.sock.connect(server_address)
+            self.client.connect()
         except ConnectionRefusedError:
             log('Connection refused on {0}:{1}'.format(server_address[0],
                                                          server_address[1]))
             exit(1)
+        except SocketError:
+            log('Unable to initialize socket')
+            exit(1)
 
-        # send a connection message in order to become registered
-        self.sock.sendall(connmsg.send())
+        self.sock = self.client.sock
 
     def update_price(self, price, bidder):
 
@@ -70,23 +94,10 @@ class Bidder(object):
 
     def send_bid(self, bid_price):
 
-        ''' insists on sending a Bid Message 
-            to the auction server '''
-
-        [_, wx, _] = select.select([], [self.sock], [])
+        ''' sends a Bid Message to the auction server. What the
+            socket does not accept right away is sent by the loop. '''
 
-        while True:
-
-            if self.sock in wx:
-                
-                # insist on sending the message to the auction server
-                self.sock.sendall(messages.BidMsg(
-                                    item_id=self.status['item_id'],
-                                    price=bid_price,
-                                    username=self.username).send())
-
-                # exit the "insist" loop
-                break
+        self.client.bid(self.status['item_id'], bid_price)
 
     def parse_client(self, data):
 
@@ -96,6 +107,12 @@ class Bidder(object):
         # if empty: skip
         if not data: return
 
+        if not self.client.connected and data[0].lower() in (
+                'bid', 'int', 'quit'):
+            log('Not connected to the server')
+            if data[0].lower() == 'quit': exit(1)
+            return
+
         if data[0].lower() == 'bid':
 
             # if not acknowledged, client cannot bid
@@ -112,31 +129,20 @@ class Bidder(object):
 
             else:
                 # submit the client's bid
-                while True:
-
-                    [_, rx, _] = select.select([], [self.sock], [])
-
-                    if self.sock in rx:
-                        self.sock.sendall(messages.BidMsg(
-                                            item_id=self.status['item_id'],
-                                            price=price,
-                                            username=self.username).send())
-
-                        break
+                self.send_bid(price)
         
         elif data[0].lower() == 'int':
 
             # send an InterestedMsg to the server to enable bidding
-            self.sock.sendall(messages.InterestedMsg(
-                                username=self.username).send())
+            self.client.interested(self.status['item_id'])
 
         elif data[0].lower() == 'quit':
 
             # send a 'quit' message to the server to finish session
-            self.sock.sendall(messages.QuitMsg(username=self.username).send())
+            self.client.quit()
 
-            # close socket and exit application 
-            self.sock.close()
+            # close socket (once the message is sent) and exit
+            self.client.close()
             exit(1)
 
         elif data[0].lower() == 'list_bid':
@@ -156,102 +162,186 @@ class Bidder(object):
 
         ''' Parses received data from auction servers '''
 
-        response = []
-
-        # split based on delimiter and advance buffer
+        # split based on delimiter
         msg_list = [decode_msg(msg) for msg in data.strip('|').split('|')]
-        data = data[sum(len(i) + 1 for i in msg_list):]
+
+        return self.handle_messages(msg_list, connection)
+
+    def handle_messages(self, msg_list, connection):
+
+        ''' Handles a list of decoded messages from auction servers '''
+
+        response = []
 
         # log
         # print('DATA: ', msg_list)
 
-
         for msg in msg_list:
 
             # TODO: define a meaningful return value 
             #       for the client's parse_messages() method
 
-            if msg['header'] == 'sync_price':
-                self.update_price(msg['price'], msg['username'])
-                log('New price: %d' % msg['price'])
+            header = dispatch.header(msg)
+            entry = self.handlers.get(header)
+            if entry is None: continue
 
-            if msg['header'] == 'new_high_bid':
-                self.update_price(msg['price'], msg['bidder'])
-                log('New price: %d' % msg['price'])
+            (handler, check) = entry
 
-            if msg['header'] == 'ack_interest':
-                self.status['acknowledged'] = True
+            # skip messages the server should not have sent
+            field = check(msg)
+            if field is not None:
+                log('error: malformed {0} message ({1})'.format(header,
+                                                                field))
+                continue
 
-                log('Can now bid for item')
+            # with several lots open at once, only follow
+            # the lot I am currently bidding on
+            if (header in LOT_HEADERS and
+                msg.get('item_id') != self.status['item_id']):
+                continue
 
-            if msg['header'] == 'start_bid':
-                
-                # mark myself as participant, as a new item is introduced
-                self.status['bidding'] = True
+            handler(msg)
 
-                # need an explicit acknowledgement message
-                self.status['acknowledged'] = False
+        # print(self.status)
+        return response
 
-                # update status variable
-                self.status['item_id'] = msg['item_id']
-                self.status['min_price'] = msg['price']
-                self.status['description'] = msg['description']
+    def handle_event(self, msg):
 
-                log('New item: {0} - {1}'.format(
-                        msg['description'],
-                        msg['price']))
+        ''' callback of the client, for each message of the server '''
 
+        self.handle_messages([msg], self.client)
+        self.msg_received = True
 
-            if msg['header'] == 'stop_bid':
+    def consult(self, callback, msg=None):
 
-                # disable bidding until next item is presented
-                self.status['bidding'] = False
-                self.status['acknowledged'] = False
+        ''' runs a callback of the strategy, and its action '''
 
-                # update log
-                log('Item %d won by %s' % (msg['item_id'], msg['winner']))
+        if self.strategy is None: return
 
-                # update holder/price on status variable
-                self.status['holder'] = None
-                self.status['min_price'] = 0
+        if msg is None:
+            action = getattr(self.strategy, callback)(self)
+        else:
+            action = getattr(self.strategy, callback)(self, msg)
 
-            if msg['header'] == 'ack':
-                log('acknowledged from server')
+        if action:
+            self.parse_client(action.split())
 
-            if msg['header'] == 'complete':
-                log('Auction has finished, will now terminate...')
+    def strategy_timer(self):
 
-                # send quit message before exiting and closing socket 
-                self.sock.sendall(messages.QuitMsg(username=self.username).send())
-                self.sock.close()
-                exit(0)
+        ''' timer callback: the periodic action of the strategy '''
 
-            if msg['header'] == 'error':
+        self.timer = self.loop.call_later(self.strategy.frequency,
+                                          self.strategy_timer)
+        self.consult('on_timer')
 
-                if msg['error'] == errors.invalid_item_id:
-                    log('error: id {0} is not valid'.format(msg['item_id']))
-                
-                if msg['error'] == errors.reject_register:
-                    log('error: username {0} is already used'.format(
-                                                        msg['username']))
-                    exit(1) # NOTE: fatal error!
+    def disconnected(self, _):
 
-                if msg['error'] == errors.low_price_bid:
-                    log('error: bid price was too low')
+        # keep serving the frontends, without a strategy
+        log('Disconnected from {0}:{1}'.format(*self.client.address))
 
-                if msg['error'] == errors.max_connections:
-                    log('error: maximum No. of connections reached')
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
 
-                    exit(1) # NOTE: fatal error!
+    @dispatch.handles('sync_price')
+    def on_sync_price(self, msg):
 
-                if msg['error'] == errors.not_accepting:
-                    log('Currently not accepting bids')
+        self.update_price(msg['price'], msg['username'])
+        log('New price: %d' % msg['price'])
 
-                if msg['error'] == errors.interest_phase:
-                    log('We are not yet in the bidding phase! Please wait')
+    @dispatch.handles('new_high_bid')
+    def on_new_high_bid(self, msg):
 
-        # print(self.status)
-        return response
+        self.update_price(msg['price'], msg['bidder'])
+        log('New price: %d' % msg['price'])
+
+        self.consult('on_new_high_bid', msg)
+
+    @dispatch.handles('ack_interest')
+    def on_ack_interest(self, msg):
+
+        self.status['acknowledged'] = True
+
+        log('Can now bid for item')
+
+    @dispatch.handles('start_bid')
+    def on_start_bid(self, msg):
+
+        # mark myself as participant, as a new item is introduced
+        self.status['bidding'] = True
+
+        # need an explicit acknowledgement message
+        self.status['acknowledged'] = False
+
+        # update status variable
+        self.status['item_id'] = msg['item_id']
+        self.status['min_price'] = msg['price']
+        self.status['description'] = msg['description']
+
+        log('New item: {0} - {1}'.format(
+                msg['description'],
+                msg['price']))
+
+        self.consult('on_start_bid', msg)
+
+    @dispatch.handles('stop_bid')
+    def on_stop_bid(self, msg):
+
+        # disable bidding until next item is presented
+        self.status['bidding'] = False
+        self.status['acknowledged'] = False
+
+        # update log
+        log('Item %d won by %s' % (msg['item_id'], msg['winner']))
+
+        # update holder/price on status variable
+        self.status['holder'] = None
+        self.status['min_price'] = 0
+
+        self.consult('on_stop_bid', msg)
+
+    @dispatch.handles('ack')
+    def on_ack(self, msg):
+        log('acknowledged from server')
+
+    @dispatch.handles('complete')
+    def on_complete(self, msg):
+
+        log('Auction has finished, will now terminate...')
+
+        # send quit message before exiting and closing socket 
+        self.client.quit()
+        self.client.close()
+        exit(0)
+
+    @dispatch.handles('error')
+    def on_error(self, msg):
+
+        if msg['error'] == errors.invalid_item_id:
+            log('error: id {0} is not valid'.format(msg['item_id']))
+        
+        if msg['error'] == errors.reject_register:
+            log('error: username {0} is already used'.format(
+                                                msg['username']))
+            exit(1) # NOTE: fatal error!
+
+        if msg['error'] == errors.low_price_bid:
+            log('error: bid price was too low')
+
+        if msg['error'] == errors.max_connections:
+            log('error: maximum No. of connections reached')
+
+            exit(1) # NOTE: fatal error!
+
+        if msg['error'] == errors.not_accepting:
+            log('Currently not accepting bids')
+
+        if msg['error'] == errors.interest_phase:
+            log('We are not yet in the bidding phase! Please wait')
+
+        if msg['error'] == errors.malformed_msg:
+            log('error: the server rejected a malformed {0} message'.format(
+                                                msg.get('message')))
 
     def run(self):
 
@@ -271,70 +361,64 @@ class Bidder(object):
             log('Could not bind to socket %s' % self.username)
             exit(0)
 
-        flag = True
-        rdr_list = [self.sock, frontend]
-        wrr_list = [self.sock, frontend]
-
-        # boolean that indicates I have received a message from server
-        msg_received = False
-
-        # my unix socket connection
-        usock_connection = None
-
-        while flag:
-
-            # wait until something is ready
-            [rx, wx, ex] = select.select(rdr_list,
-                                         wrr_list,
-                                         [])
- 
-            for conn in rx:
-
-                # something was received
-                if conn == self.sock:
-                    # receive 1K packet
-                    data = unpack_msg(conn.recv(1024))
-
-                    # parse data if available
-                    if data:
-                        self.parse_messages(data, conn)
-                        msg_received = True
-                    else:
-                        log('Disconnected from {0}'.format(conn))
-                        rdr_list.remove(conn)
-                   
-                elif conn == frontend:
-                    
-                    # connection in local UNIX socket attempted                    
-                    usock_connection, client_address = conn.accept()
-                    log('New connection from {0}'.format(client_address))
-
-                    # nonblocking connection
-                    usock_connection.setblocking(0)
-                    
-                    # add to lists
-                    rdr_list.append(usock_connection)
-                    wrr_list.append(usock_connection)
-
-                else:
-                    # AF_UNIX socket case!
-                    data = conn.recv(512).decode('ascii')
-
-                    if data:
-                        log('Received from frontend: %s' % data)
-                        self.parse_client(data.split())
-                    else:
-                        log('Removed {0}'.format(conn))
-                        rdr_list.remove(conn)
-                        wrr_list.remove(conn)
+        frontend.setblocking(0)
+        self.loop.add_reader(frontend, self.accept_frontend)
+
+        if self.strategy and self.strategy.frequency:
+            self.timer = self.loop.call_later(self.strategy.frequency,
+                                              self.strategy_timer)
+
+        # the loop only waits on the sockets that have output
+        # queued, so an idle bidder sleeps until it gets a message
+        while True:
+
+            self.loop.run_once()
 
             # If i received something from server I must
-            # echo my status to the frontend
-            if msg_received and usock_connection in wx:
-                usock_connection.sendall(encode_status(self.status))
+            # echo my status to the frontends
+            if self.msg_received:
+                status = encode_status(self.status)
+                for conn in self.frontends.values():
+                    conn.write(status)
 
                 # reset msg flag
-                msg_received = False
+                self.msg_received = False
+
+    def accept_frontend(self, frontend):
+
+        ''' reader callback: a connection in the local UNIX socket '''
+
+        try:
+            usock_connection, client_address = frontend.accept()
+        except BlockingIOError:
+            return
+
+        log('New connection from {0}'.format(client_address))
+
+        # nonblocking connection, with its own output queue
+        usock_connection.setblocking(0)
+        self.frontends[usock_connection] = eventloop.Connection(
+                                                self.loop, usock_connection)
+        self.loop.add_reader(usock_connection, self.read_frontend)
+
+    def read_frontend(self, conn):
+
+        ''' reader callback of a frontend connection '''
+
+        try:
+            data = conn.recv(512).decode('ascii')
+        except OSError:
+            data = None
+
+        if data:
+            log('Received from frontend: %s' % data)
+            self.parse_client(data.split())
+        else:
+            log('Removed {0}'.format(conn))
+            self.loop.remove(conn)
+            del self.frontends[conn]
+            conn.close()
+
 
 def parse_address(address_string):
 
@@ -358,11 +442,14 @@ if __name__ == '__main__':
         finally:
             pass
 
+        # optional wire codec, e.g. 'binary'
+        codec = sys.argv[3] if len(sys.argv) >= 4 else JSON
+
         try:
-            bidr = Bidder(sys.argv[1], server_address)
+            bidr = Bidder(sys.argv[1], server_address, codec)
             bidr.run()
         finally:
             pass
     else:
-        log('Usage: ./bidder.py username [host:port]')
+        log('Usage: ./bidder.py username [host:port] [json|binary]')
 
@@ -0,0 +1,273 @@
+#!/usr/bin/python
+
+''' An event-driven client library for the auction servers.
+
+    A client connects a bidder to an auction server, registers it and
+    sends its interest and its bids. The messages of the server are
+    delivered as typed events, the message classes of messages.py
+    (e.g. NewHighBidMsg), to the callbacks registered for their header.
+
+    With the EventLoop of the servers (eventloop.py):
+
+        loop = eventloop.EventLoop()
+        client = AuctionClient(loop, ('localhost', 50000), 'johndoe')
+        client.on('start_bid',
+                  lambda msg: client.interested(msg['item_id']))
+        client.connect()
+
+        while True:
+            loop.run_once()
+
+    With asyncio:
+
+        client = AsyncAuctionClient('johndoe')
+        await client.connect(('localhost', 50000))
+
+        async for msg in client.events():
+            if msg['header'] == 'start_bid':
+                client.interested(msg['item_id'])
+
+    Neither client waits on the writability of its socket unless it
+    has output queued: AuctionClient writes through a Connection of
+    the event loop, AsyncAuctionClient through an asyncio transport.
+    Messages of the server with a missing or mistyped field (see
+    dispatch.SCHEMAS) are dropped, and so are the messages sent once
+    the connection is closed.
+'''
+
+import socket, asyncio
+
+import messages, dispatch, eventloop
+from serializer import FrameDecoder, JSON
+
+# headers of the messages sent by the servers to their bidders
+EVENTS = ('ack', 'ack_interest', 'start_bid', 'new_high_bid',
+          'sync_price', 'stop_bid', 'error', 'complete')
+
+class ClientBase(object):
+
+    ''' ClientBase builds the messages of a bidder and dispatches
+        the events it receives. Subclasses implement write(). '''
+
+    def __init__(self, username, codec=JSON):
+
+        (self.username, self.codec) = (username, codec)
+
+        # callbacks by header, run in the order they were added
+        self.callbacks = {}
+
+        # validators of the events, by header
+        self.checks = {header: dispatch.validator(dispatch.SCHEMAS[header])
+                       for header in EVENTS}
+
+        # frames of the server, decoded into typed messages
+        self.decoder = FrameDecoder(factory=messages.from_frame)
+
+        # statistics
+        (self.received, self.dropped) = (0, 0)
+
+    def on(self, header, callback):
+
+        ''' runs callback(msg) on every event with header. The
+            'closed' callbacks run with None once the server
+            closes the connection. '''
+
+        self.callbacks.setdefault(header, []).append(callback)
+
+    def emit(self, msg):
+
+        ''' runs the callbacks of a received message. Returns False
+            if the message was dropped. '''
+
+        self.received += 1
+
+        header = dispatch.header(msg)
+        check = self.checks.get(header)
+
+        if check is None or check(msg) is not None:
+            self.dropped += 1
+            return False
+
+        for callback in self.callbacks.get(header, ()):
+            callback(msg)
+
+        return True
+
+    def closed(self):
+
+        for callback in self.callbacks.get('closed', ()):
+            callback(None)
+
+    def write(self, data):
+        raise NotImplementedError
+
+    def send(self, msg):
+        self.write(msg.send(self.codec))
+
+    def register(self):
+
+        ''' asks the server to register my username, and to
+            use my codec for the messages it sends me '''
+
+        if self.codec == JSON:
+            self.send(messages.ConnectMsg(username=self.username))
+        else:
+            self.send(messages.ConnectMsg(username=self.username,
+                                          codec=self.codec))
+
+    def interested(self, item_id=None):
+
+        ''' declares my interest in a lot (the first open
+            one if item_id is None) '''
+
+        if item_id is None:
+            self.send(messages.InterestedMsg(username=self.username))
+        else:
+            self.send(messages.InterestedMsg(username=self.username,
+                                             item_id=item_id))
+
+    def bid(self, item_id, price):
+
+        self.send(messages.BidMsg(item_id=item_id, price=price,
+                                  username=self.username))
+
+    def quit(self):
+
+        self.send(messages.QuitMsg(username=self.username))
+
+
+class AuctionClient(ClientBase):
+
+    ''' AuctionClient runs on an eventloop.EventLoop: the callbacks
+        of the events run from the loop, which the caller drives. '''
+
+    def __init__(self, loop, address, username, codec=JSON):
+
+        super().__init__(username, codec)
+
+        (self.loop, self.address) = (loop, address)
+        (self.sock, self.conn) = (None, None)
+
+    def connect(self):
+
+        ''' connects to the server (blocking until the connection
+            is established) and registers '''
+
+        self.sock = socket.create_connection(self.address)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.setblocking(0)
+
+        self.conn = eventloop.Connection(self.loop, self.sock)
+        self.loop.add_reader(self.sock, self.read)
+
+        self.register()
+
+    @property
+    def connected(self):
+        return self.sock is not None
+
+    def write(self, data):
+
+        # output is dropped once the connection is closed
+        if self.conn: self.conn.write(data)
+
+    def read(self, sock):
+
+        ''' reader callback of the connection '''
+
+        try:
+            count = self.decoder.recv(sock, 65536)
+        except OSError:
+            count = 0
+
+        if not count:
+            self.close(flush=False)
+            self.closed()
+            return
+
+        for msg in self.decoder.messages():
+            self.emit(msg)
+
+    def flush(self):
+
+        ''' blocks until the queued output has been sent '''
+
+        if self.conn and self.conn.outbound and not self.conn.closed:
+
+            self.sock.setblocking(1)
+            while self.conn.outbound and not self.conn.closed:
+                self.conn.handle_write(self.sock)
+            self.sock.setblocking(0)
+
+    def close(self, flush=True):
+
+        if self.sock is None: return
+
+        if flush: self.flush()
+
+        self.loop.remove(self.sock)
+        self.sock.close()
+        (self.sock, self.conn) = (None, None)
+
+
+class AsyncAuctionClient(ClientBase):
+
+    ''' AsyncAuctionClient runs on asyncio streams. Events are both
+        yielded by events() and passed to their callbacks. '''
+
+    def __init__(self, username, codec=JSON):
+
+        super().__init__(username, codec)
+
+        (self.reader, self.writer) = (None, None)
+
+    async def connect(self, address):
+
+        (self.reader, self.writer) = await asyncio.open_connection(
+                                                *address)
+
+        sock = self.writer.get_extra_info('socket')
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        self.register()
+
+    def write(self, data):
+        self.writer.write(data)
+
+    async def drain(self):
+
+        ''' waits until the transport accepts more output '''
+
+        await self.writer.drain()
+
+    async def events(self):
+
+        ''' yields the events of the server, until it closes
+            the connection '''
+
+        while True:
+
+            data = await self.reader.read(65536)
+
+            if not data:
+                self.closed()
+                return
+
+            self.decoder.feed(data)
+
+            for msg in self.decoder.messages():
+                if self.emit(msg):
+                    yield msg
+
+    async def run(self):
+
+        ''' runs the callbacks of the events, until the server
+            closes the connection '''
+
+        async for _ in self.events():
+            pass
+
+    async def close(self):
+
+        self.writer.close()
+        await self.writer.wait_closed()
@@ -0,0 +1,232 @@
+#!/usr/bin/python
+
+''' Table-driven dispatch of the received messages.
+
+    Each message type is handled by its own method, marked with the
+    header it handles:
+
+        @dispatch.handles('bid')
+        def on_bid(self, msg, connection, response): ...
+
+    handler_table() collects the marked methods of an object (those
+    of its subclasses override the ones of its base classes) into a
+    dict by header, so that a message is dispatched with a single
+    lookup, and a new message type is handled by adding a method.
+
+    Every message is checked against the schema of its header before
+    it is handled: a dict of its fields and of the types each one may
+    have. The schemas are compiled into validators once, when the
+    table is built, and a message with a missing field or a field of
+    the wrong type is rejected before it reaches the auction state.
+'''
+
+import math
+
+class Missing(object):
+
+    ''' the type of MISSING, for fields that may be omitted '''
+
+    __slots__ = ()
+
+# value of the fields absent from a message
+MISSING = Missing()
+
+# field types. A field type is either a tuple of the types its
+# values may have, or a function that tells whether a value is
+# valid, for the fields that need more than a type check.
+INT    = (int,)
+STRING = (str,)
+BOOL   = (bool,)
+LIST   = (list,)
+
+# usernames, None while a lot has no holder
+NAME   = (str, type(None))
+
+# bounds of the values kept in the columns of the item store
+# (itemstore.py): prices are doubles, which hold the ints up to
+# 2 ** 53 exactly, and versions and timeouts are 32 bit ints. The
+# versions received stop well short of 2 ** 31, leaving room for
+# the bids counted on top of them.
+MAX_PRICE = 2 ** 53
+MAX_COUNT = 2 ** 30
+
+def finite(value):
+
+    ''' the ints up to MAX_PRICE, and the floats other than
+        NaN and +-inf '''
+
+    kind = type(value)
+
+    if kind is int:
+        return -MAX_PRICE <= value <= MAX_PRICE
+
+    return kind is float and math.isfinite(value)
+
+def counter(value):
+
+    ''' the ints from 0 to MAX_COUNT '''
+
+    return type(value) is int and 0 <= value <= MAX_COUNT
+
+# prices, and the versions and timeouts of the items
+NUMBER = finite
+COUNT  = counter
+
+def valid(types, value):
+
+    ''' tells whether value is of a field type '''
+
+    if type(types) is tuple:
+        return type(value) in types
+
+    return types(value)
+
+def optional(types):
+
+    ''' the types of a field that may also be omitted '''
+
+    if type(types) is tuple:
+        return types + (Missing,)
+
+    return lambda value: value is MISSING or types(value)
+
+def list_of(types):
+
+    ''' the type of a list of values of types '''
+
+    def check(value):
+        return (type(value) is list and
+                all(valid(types, element) for element in value))
+
+    return check
+
+def record(*fields):
+
+    ''' the type of a record: a list with a value of each of
+        the types of fields, in order '''
+
+    def check(value):
+        return (type(value) in (list, tuple) and
+                len(value) == len(fields) and
+                all(valid(types, field)
+                    for (types, field) in zip(fields, value)))
+
+    return check
+
+# the records of a state transfer: the items of a StateChunkMsg
+# (item_id, price, holder, version, interested) and the open lots
+# of a StateEndMsg (item_id, interest_phase, left, timeouts, price,
+# holder, version, interested)
+ITEM_RECORD = record(INT, NUMBER, NAME, COUNT, list_of(STRING))
+LOT_RECORD  = record(INT, BOOL, NUMBER, COUNT, NUMBER, NAME, COUNT,
+                     list_of(STRING))
+
+# fields of the received messages, by header
+SCHEMAS = {
+
+    # bidder -> auctioneer
+    'connect':          {'username': STRING, 'codec': optional(STRING)},
+    'bid':              {'item_id': INT, 'price': NUMBER,
+                         'username': STRING},
+    'i_am_interested':  {'username': STRING, 'item_id': optional(INT)},
+    'quit':             {'username': STRING},
+
+    # auctioneer -> auctioneer
+    'start_auction':    {},
+    'sync_price':       {'item_id': INT, 'price': NUMBER,
+                         'username': NAME, 'version': optional(COUNT)},
+    'sync_interest':    {'username': STRING, 'item_id': optional(INT)},
+    'stop_bid':         {'item_id': INT, 'winner': NAME,
+                         'price': NUMBER},
+    'join':             {'host': STRING, 'port': INT, 'transfer': BOOL},
+    'state_chunk':      {'first': INT, 'last': INT,
+                         'items': list_of(ITEM_RECORD)},
+    'state_end':        {'auctioning': BOOL, 'cursor': INT,
+                         'lots': list_of(LOT_RECORD)},
+
+    # auctioneer -> bidder
+    'ack':              {},
+    'ack_interest':     {'item_id': INT},
+    'start_bid':        {'item_id': INT, 'price': NUMBER,
+                         'description': STRING},
+    'new_high_bid':     {'item_id': INT, 'price': NUMBER,
+                         'bidder': NAME, 'version': optional(COUNT)},
+    'error':            {'error': INT},
+    'complete':         {},
+}
+
+def validator(schema):
+
+    ''' compiles a schema into a function that returns the name of
+        the first invalid field of a message, None if it is valid '''
+
+    # the fields with a tuple of types are checked inline, the
+    # others by their function
+    fields = tuple((field, types, type(types) is not tuple)
+                   for (field, types) in schema.items())
+
+    def check(msg):
+
+        get = msg.get
+
+        for (field, types, call) in fields:
+
+            value = get(field, MISSING)
+
+            if call:
+                if not types(value): return field
+            elif type(value) not in types:
+                return field
+
+        return None
+
+    return check
+
+def handles(header, schema=None):
+
+    ''' marks a method as the handler of the messages with header.
+        Message types without an entry in SCHEMAS give their
+        schema here. '''
+
+    def mark(method):
+
+        method.handles = header
+        method.schema = schema
+
+        return method
+
+    return mark
+
+def handler_table(obj):
+
+    ''' the handlers of obj, as a dict of
+        header -> (bound method, validator) '''
+
+    # method name by header, base classes first
+    names = {}
+    schemas = {}
+
+    for cls in reversed(type(obj).__mro__):
+        for (name, attr) in vars(cls).items():
+
+            header = getattr(attr, 'handles', None)
+            if header is None: continue
+
+            names[header] = name
+            if attr.schema is not None:
+                schemas[header] = attr.schema
+
+    return {header: (getattr(obj, name),
+                     validator(schemas.get(header, SCHEMAS.get(header, {}))))
+            for (header, name) in names.items()}
+
+def header(msg):
+
+    ''' the header of a received message, None if it has none '''
+
+    try:
+        header = msg['header']
+    except (KeyError, TypeError, IndexError):
+        return None
+
+    return header if type(header) is str else None
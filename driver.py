@@ -5,41 +5,37 @@
 import xml.etree.ElementTree as ET
 import multiprocessing
 import sys, time
-import auctioneer, bidder, messenger
+import auctioneer, bidder, strategy
     
-def client_worker(port, username):
+def client_worker(port, username, frequency, offers):
 
-    # create a bidder at specified port
+    # create a bidder at specified port, which makes
+    # its offers itself, every frequency seconds
     clnt = bidder.Bidder(username = username,
-                         server_address = ('localhost', port))
+                         server_address = ('localhost', port),
+                         strategy = strategy.OfferList(offers, frequency))
 
     clnt.run()
 
     return
 
-def messenger_worker(username, frequency, min_bid, max_bid, offers):
 
-    # create a messenger script to communicate 
-    # with its corresponding client
-    msgr = messenger.Messenger(username,
-                               frequency,
-                               min_bid,
-                               max_bid,
-                               offers)
-
-    msgr.simulate()
-
-    return
-
-
-def worker(port, other_port, items_file, connections):
+def worker(host, port, peers, items_file, connections, lots=1,
+           idle_timeout=None, wal_path=None, snapshot_path=None,
+           admin_path=None):
 
     sys.stderr = open('auctlog_' + str(port) + ".err", 'w')
     # create an auctioneer with specified parameters
-    server = auctioneer.Auctioneer(port = port,
-                                   other_port = other_port,
+    server = auctioneer.Auctioneer(host = host,
+                                   port = port,
+                                   peers = peers,
                                    itemfile = items_file,
-                                   max_connections = connections)
+                                   max_connections = connections,
+                                   lots = lots,
+                                   idle_timeout = idle_timeout,
+                                   wal_path = wal_path,
+                                   snapshot_path = snapshot_path,
+                                   admin_path = admin_path)
 
     server.serve()
 
@@ -60,12 +56,20 @@ def server_data(conf_file):
     
     # get item file from config
     item_fd = root.find('items').attrib['file']
+
+    # number of lots auctioned at once
+    lots = int(root.find('items').attrib.get('lots', 1))
     
-    # get individual server configs
-    servers = [(srv.attrib['port'], srv.attrib['clients'])
+    # get individual server configs: the membership of the auction,
+    # the optional idle timeout of their bidders, their logs,
+    # snapshots and admin sockets
+    servers = [(srv.attrib.get('host', 'localhost'),
+                srv.attrib['port'], srv.attrib['clients'],
+                srv.attrib.get('idle'), srv.attrib.get('wal'),
+                srv.attrib.get('snapshot'), srv.attrib.get('admin'))
                 for srv in root.iter('server')]
 
-    return (item_fd, servers)
+    return (item_fd, servers, lots)
 
 def client_data(conf_file):
 
@@ -85,7 +89,7 @@ def client_data(conf_file):
     clients = [ 
         {
          'username': clnt.attrib['username'],
-         'conf': client_data(*clnt.getchildren()),
+         'conf': client_data(*list(clnt)),
          'offers': [int(i) for i in \
                     clnt.find('offers').text.strip().split()]
         } 
@@ -96,54 +100,50 @@ def client_data(conf_file):
 if __name__ == '__main__':
 
     # retrieve server and client parameters
-    itemfile, server_conf = server_data('config.xml')
+    itemfile, server_conf, lots = server_data('config.xml')
     clients = client_data('config.xml')
 
-    # get ports and max connections
-    ports, conns = zip(*[(int(i[0]), int(i[1])) for i in server_conf])
+    # get addresses and max connections
+    addrs = [(i[0], int(i[1])) for i in server_conf]
+    conns = [int(i[2]) for i in server_conf]
+    idles = [float(i[3]) if i[3] else None for i in server_conf]
+    wals = [i[4] for i in server_conf]
+    snapshots = [i[5] for i in server_conf]
+    admins = [i[6] for i in server_conf]
 
-    # create both auctioneers
-    auct1 = multiprocessing.Process(
-                target = worker, 
-                args = (ports[0], ports[1], itemfile, conns[0])
-            )
+    # create all the auctioneers, each one peering
+    # with every other server of the config
+    for (addr, max_conns, idle, wal_path, snapshot_path, admin_path) in zip(
+                addrs, conns, idles, wals, snapshots, admins):
 
-    
-    auct2 = multiprocessing.Process(
-                target = worker, 
-                args = (ports[1], ports[0], itemfile, conns[1])
-            )
+        peers = [i for i in addrs if i != addr]
+
+        auct = multiprocessing.Process(
+                    target = worker,
+                    args = (addr[0], addr[1], peers,
+                            itemfile, max_conns, lots, idle,
+                            wal_path, snapshot_path, admin_path)
+                )
 
-    # start serving
-    auct1.start()
-    auct2.start()
+        # start serving
+        auct.start()
 
     # wait for auctioneers to start
     print("Starting servers...")
     time.sleep(3)
     
 
-    # TODO: create the client processes and their 
-    #       messenger counterparts
+    # create the client processes, each one running
+    # its bidding strategy in-process
     
     for clnt in clients:
 
         # create all of the bidder clients
         clnt_proc = multiprocessing.Process(
                 target = client_worker,
-                args = (int(clnt['conf']['port']), clnt['username'],)
+                args = (int(clnt['conf']['port']), clnt['username'],
+                        clnt['conf']['freq'], clnt['offers'],)
         )
 
         clnt_proc.start()
-       
-        msgr = multiprocessing.Process(
-                target = messenger_worker,
-                args = (clnt['username'],
-                        clnt['conf']['freq'],
-                        clnt['conf']['min'],
-                        clnt['conf']['max'],
-                        clnt['offers'],)
-        )
-
-        msgr.start()
 
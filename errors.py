@@ -8,3 +8,5 @@ invalid_item_id = 0x62
 low_price_bid   = 0x63
 interest_phase  = 0x64
 not_accepting   = 0x65
+malformed_msg   = 0x66
+not_a_peer      = 0x67
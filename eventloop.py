@@ -0,0 +1,367 @@
+#!/usr/bin/python
+
+''' A small readiness-based event loop for the auction servers.
+
+    The loop is built on the selectors module, which picks the best
+    polling interface of the platform (epoll on Linux, kqueue on BSD).
+    Contrary to a select.select() loop over every socket, a connection
+    is only watched for writability while it has a writer callback
+    registered, i.e. while it actually has queued output. Timers (see
+    timers.py) bound the time spent polling.
+'''
+
+import os, selectors, signal, socket, time
+
+import timers
+from collections import deque
+from itertools import islice
+
+# scatter-gather sends, if the platform has them
+SENDMSG = hasattr(socket.socket, 'sendmsg')
+
+# maximum number of buffers in a single sendmsg()
+try:
+    IOV_MAX = os.sysconf('SC_IOV_MAX')
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 1024
+
+class EventLoop(object):
+
+    ''' EventLoop keeps a reader and a writer callback for each
+        registered socket. Callbacks receive the ready socket as
+        their single argument. Timed callbacks are scheduled with
+        call_at() and call_later().
+    '''
+
+    def __init__(self):
+
+        self.selector = selectors.DefaultSelector()
+
+        # monotonic-clock timers, run by run_once()
+        self.timers = timers.Timers()
+
+        # seconds spent waiting in the last poll, so that the
+        # time spent running callbacks can be told apart
+        self.polled = 0.0
+
+        # optional profiling.Watchdog, told when an iteration starts
+        self.watchdog = None
+
+        # signal handlers (e.g. SIGINT) must interrupt a blocking
+        # poll, so that their effects are seen right away: a
+        # socketpair is used as wakeup fd
+        (self.waker, self.wakee) = socket.socketpair()
+        self.waker.setblocking(0)
+        self.wakee.setblocking(0)
+
+        try:
+            signal.set_wakeup_fd(self.waker.fileno())
+        except ValueError: # not in the main thread
+            pass
+
+        self.add_reader(self.wakee, self._drain_wakeup)
+
+    def _drain_wakeup(self, conn):
+
+        ''' consumes the bytes written by the wakeup fd '''
+
+        try:
+            while conn.recv(512):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _update(self, conn, reader, writer):
+
+        ''' (re)registers a socket with the selector according
+            to the callbacks that are currently set for it '''
+
+        events = 0
+        if reader: events |= selectors.EVENT_READ
+        if writer: events |= selectors.EVENT_WRITE
+
+        try:
+            self.selector.get_key(conn)
+            registered = True
+        except KeyError:
+            registered = False
+
+        if not events:
+            if registered:
+                self.selector.unregister(conn)
+
+        elif registered:
+            self.selector.modify(conn, events, (reader, writer))
+
+        else:
+            self.selector.register(conn, events, (reader, writer))
+
+    def _callbacks(self, conn):
+
+        try:
+            return self.selector.get_key(conn).data
+        except KeyError:
+            return (None, None)
+
+    def _current(self, key):
+
+        ''' the callbacks of the socket of a ready event, if it
+            is still registered. The socket may have been closed
+            meanwhile, or its descriptor reused by a new one. '''
+
+        current = self.selector.get_map().get(key.fd)
+
+        if current is None or current.fileobj is not key.fileobj:
+            return (None, None)
+
+        return current.data
+
+    def add_reader(self, conn, callback):
+        self._update(conn, callback, self._callbacks(conn)[1])
+
+    def remove_reader(self, conn):
+        self._update(conn, None, self._callbacks(conn)[1])
+
+    def add_writer(self, conn, callback):
+        self._update(conn, self._callbacks(conn)[0], callback)
+
+    def remove_writer(self, conn):
+        self._update(conn, self._callbacks(conn)[0], None)
+
+    def remove(self, conn):
+
+        ''' stops watching a socket altogether '''
+
+        self._update(conn, None, None)
+
+    def __len__(self):
+
+        # the wakeup socket is not counted
+        return len(self.selector.get_map()) - 1
+
+    def time(self):
+
+        ''' the clock of the timers '''
+
+        return self.timers.clock()
+
+    def call_at(self, when, callback, *args):
+
+        ''' runs callback(*args) at time when, see time() '''
+
+        return self.timers.call_at(when, callback, *args)
+
+    def call_later(self, delay, callback, *args):
+
+        ''' runs callback(*args) after delay seconds '''
+
+        return self.timers.call_later(delay, callback, *args)
+
+    def run_once(self, timeout=None):
+
+        ''' waits (up to timeout seconds, forever if None) until at
+            least one socket is ready or a timer is due, and runs
+            the callbacks. Returns the number of callbacks run.
+        '''
+
+        # do not sleep past the first deadline
+        due = self.timers.timeout()
+        if due is not None and (timeout is None or due < timeout):
+            timeout = due
+
+        if self.watchdog: self.watchdog.clear()
+
+        start = time.perf_counter()
+        events = self.selector.select(timeout)
+        self.polled = time.perf_counter() - start
+
+        if self.watchdog: self.watchdog.enter('iteration')
+
+        # deadlines first: a bid that arrives after the end of
+        # a window must find the window already closed
+        ran = self.timers.run_due()
+
+        for (key, mask) in events:
+
+            # a previous callback of this iteration may
+            # have unregistered or modified the socket
+            (reader, writer) = self._current(key)
+
+            if mask & selectors.EVENT_READ and reader:
+                reader(key.fileobj)
+
+            # re-read: the reader may have closed the connection
+            (reader, writer) = self._current(key)
+
+            if mask & selectors.EVENT_WRITE and writer:
+                writer(key.fileobj)
+
+        return len(events) + ran
+
+    def close(self):
+
+        try:
+            signal.set_wakeup_fd(-1)
+        except ValueError:
+            pass
+
+        self.selector.close()
+        self.waker.close()
+        self.wakee.close()
+
+
+class Connection(object):
+
+    ''' Connection wraps a non-blocking socket with its own outbound
+        byte queue. write() never blocks: whatever the socket does not
+        accept right away is queued, and the loop is asked to call
+        handle_write() once the socket becomes writable again.
+
+        Two watermarks bound the queue: when more than high_water bytes
+        are buffered, on_high_water(conn) is called (e.g. to stop
+        reading from a slow peer) and once the queue drains below
+        low_water, on_low_water(conn) is called.
+
+        With max_buffered, the queue is also capped: a connection
+        that would buffer more is aborted, and on_overflow(conn) is
+        called (e.g. to disconnect a consumer that is stuck).
+    '''
+
+    HIGH_WATER = 64 * 1024
+    LOW_WATER  = 16 * 1024
+
+    def __init__(self, loop, sock,
+                       on_high_water=None,
+                       on_low_water=None,
+                       high_water=HIGH_WATER,
+                       low_water=LOW_WATER,
+                       max_buffered=None,
+                       on_overflow=None):
+
+        (self.loop, self.sock) = (loop, sock)
+
+        (self.on_high_water, self.on_low_water) = (on_high_water,
+                                                   on_low_water)
+        (self.high_water, self.low_water) = (high_water, low_water)
+        (self.max_buffered, self.on_overflow) = (max_buffered, on_overflow)
+
+        # queued chunks (bytes or memoryviews) and their total size
+        self.outbound = deque()
+        self.buffered = 0
+
+        # True while above the high watermark
+        self.paused = False
+
+        # set once a send fails, further output is discarded
+        self.closed = False
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def write(self, data):
+
+        ''' queues data to be sent, trying to send it right away
+            if nothing else is queued '''
+
+        self.writev((data,))
+
+    def writev(self, buffers):
+
+        ''' queues a sequence of buffers, without joining them. The
+            buffers are only referenced, so the same (immutable)
+            buffers can be queued on many connections at once. '''
+
+        if self.closed: return
+
+        idle = not self.outbound
+
+        for data in buffers:
+            if data:
+                self.outbound.append(data)
+                self.buffered += len(data)
+
+        if idle and self.outbound:
+
+            self._flush()
+
+            if self.outbound and not self.closed:
+                self.loop.add_writer(self.sock, self.handle_write)
+
+        if self.max_buffered and self.buffered > self.max_buffered:
+            self.abort()
+            if self.on_overflow: self.on_overflow(self)
+            return
+
+        if not self.paused and self.buffered > self.high_water:
+            self.paused = True
+            if self.on_high_water: self.on_high_water(self)
+
+    def _send(self, chunks):
+
+        ''' a single non-blocking scatter-gather send of a list of
+            buffers, returns the number of bytes sent '''
+
+        try:
+            if SENDMSG:
+                return self.sock.sendmsg(chunks)
+            return self.sock.send(b''.join(chunks))
+        except BlockingIOError:
+            return 0
+        except OSError: # reset by peer, broken pipe etc.
+            self.abort()
+            return 0
+
+    def _flush(self):
+
+        ''' sends as much of the queue as the socket accepts,
+            with partial writes '''
+
+        outbound = self.outbound
+
+        while outbound:
+
+            chunks = list(islice(outbound, IOV_MAX))
+            sent = self._send(chunks)
+            self.buffered -= sent
+
+            # drop the buffers that were sent entirely
+            for chunk in chunks:
+                if sent < len(chunk): break
+                sent -= len(chunk)
+                outbound.popleft()
+            else:
+                continue
+
+            # partial write, socket buffer is full
+            if sent: outbound[0] = memoryview(outbound[0])[sent:]
+            break
+
+    def handle_write(self, sock):
+
+        ''' writer callback: flushes the queue once the socket
+            is writable again '''
+
+        self._flush()
+
+        if not self.outbound and not self.closed:
+            self.loop.remove_writer(self.sock)
+
+        if self.paused and self.buffered <= self.low_water:
+            self.paused = False
+            if self.on_low_water: self.on_low_water(self)
+
+    def abort(self):
+
+        ''' discards queued output of a broken connection. The
+            connection itself is cleaned up once its reader sees
+            the end of stream. '''
+
+        self.closed = True
+        self.outbound.clear()
+        self.buffered = 0
+        self.loop.remove_writer(self.sock)
+
+        # a paused reader must see the end of stream too
+        if self.paused:
+            self.paused = False
+            if self.on_low_water: self.on_low_water(self)
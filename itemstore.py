@@ -0,0 +1,278 @@
+#!/usr/bin/python
+
+''' A compact, array-backed store of the items of an auction.
+
+    Instead of one dictionary per item, ItemStore keeps one array per
+    field (price, timeouts, version, holder) indexed by item id, so an
+    item costs a few dozen bytes whatever the size of the catalog.
+    Holders and descriptions are interned: each distinct username or
+    description is stored once, and items refer to it by index.
+'''
+
+from array import array
+
+# holder index of an item that nobody has bid on
+NO_HOLDER = -1
+
+class Item(object):
+
+    ''' a view of a single item of an ItemStore, with the same
+        fields as the former item dictionaries:
+
+            item['about'], item['price'], item['holder'],
+            item['interested'], item['timeouts'], item['version']
+    '''
+
+    __slots__ = ('store', 'index')
+
+    FIELDS = ('about', 'price', 'holder', 'interested',
+              'timeouts', 'version')
+
+    def __init__(self, store, index):
+        (self.store, self.index) = (store, index)
+
+    def __getitem__(self, field):
+
+        if field not in self.FIELDS: raise KeyError(field)
+        return getattr(self, '_' + field)
+
+    def __setitem__(self, field, value):
+
+        if field not in self.FIELDS: raise KeyError(field)
+        setattr(self, '_' + field, value)
+
+    @property
+    def _about(self):
+        return self.store.descriptions[self.store.about[self.index]]
+
+    @property
+    def _price(self):
+
+        # prices are stored as doubles, restore integral ones
+        price = self.store.prices[self.index]
+        return int(price) if price.is_integer() else price
+
+    @_price.setter
+    def _price(self, value):
+        self.store.prices[self.index] = value
+
+    @property
+    def _holder(self):
+
+        holder = self.store.holders[self.index]
+        return None if holder == NO_HOLDER else self.store.users[holder]
+
+    @_holder.setter
+    def _holder(self, username):
+        self.store.holders[self.index] = self.store.intern_user(username)
+
+    @property
+    def _interested(self):
+
+        # only items that someone is interested in have a list
+        return self.store.interested.setdefault(self.index, [])
+
+    @property
+    def _timeouts(self):
+        return self.store.timeouts[self.index]
+
+    @_timeouts.setter
+    def _timeouts(self, value):
+        self.store.timeouts[self.index] = value
+
+    @property
+    def _version(self):
+        return self.store.versions[self.index]
+
+    @_version.setter
+    def _version(self, value):
+        self.store.versions[self.index] = value
+
+
+class ItemStore(object):
+
+    ''' ItemStore keeps the catalog of an auction. Item ids are
+        assigned sequentially from 1, in order of addition. Items
+        are opened for bidding in order of id, so the next items to
+        open are found with a cursor instead of a search.
+    '''
+
+    # the array columns, in the order they are saved
+    COLUMNS = ('prices', 'timeouts', 'versions', 'holders', 'about')
+
+    def __init__(self):
+
+        # one column per field, indexed by item id - 1
+        self.prices   = array('d')
+        self.timeouts = array('i')
+        self.versions = array('i')
+        self.holders  = array('i')
+        self.about    = array('i')
+
+        # 1 while the item is in the auction (not yet awarded)
+        self.alive = bytearray()
+        self.count = 0
+
+        # interned usernames and descriptions
+        (self.users, self.user_ids) = ([], {})
+        (self.descriptions, self.description_ids) = ([], {})
+
+        # lists of interested users, for the items that have any
+        self.interested = {}
+
+        # index of the first item that has never been taken
+        self.cursor = 0
+
+    def intern_user(self, username):
+
+        ''' the index of a username, added on first use '''
+
+        if username is None: return NO_HOLDER
+
+        index = self.user_ids.get(username)
+        if index is None:
+            index = self.user_ids[username] = len(self.users)
+            self.users.append(username)
+
+        return index
+
+    def intern_description(self, about):
+
+        index = self.description_ids.get(about)
+        if index is None:
+            index = self.description_ids[about] = len(self.descriptions)
+            self.descriptions.append(about)
+
+        return index
+
+    def add(self, about, price):
+
+        ''' appends an item to the catalog and returns its id '''
+
+        self.prices.append(price)
+        self.timeouts.append(0)
+        self.versions.append(0)
+        self.holders.append(NO_HOLDER)
+        self.about.append(self.intern_description(about))
+        self.alive.append(1)
+        self.count += 1
+
+        return len(self.alive)
+
+    def last_id(self):
+
+        ''' the highest item id assigned so far '''
+
+        return len(self.alive)
+
+    def __len__(self):
+
+        ''' number of items still in the auction '''
+
+        return self.count
+
+    def __contains__(self, item_id):
+
+        return (isinstance(item_id, int) and
+                0 < item_id <= len(self.alive) and
+                self.alive[item_id - 1] == 1)
+
+    def __getitem__(self, item_id):
+
+        if item_id not in self: raise KeyError(item_id)
+        return Item(self, item_id - 1)
+
+    def __iter__(self):
+
+        ''' ids of the items still in the auction '''
+
+        return (i + 1 for (i, alive) in enumerate(self.alive) if alive)
+
+    def discard(self, item_id):
+
+        ''' removes an item from the auction. Returns False if it
+            had already been removed. '''
+
+        if item_id not in self: return False
+
+        self.alive[item_id - 1] = 0
+        self.count -= 1
+        self.interested.pop(item_id - 1, None)
+
+        return True
+
+    def interest(self, item_id):
+
+        ''' the users interested in an item, read-only: unlike
+            item['interested'], no list is created for the item '''
+
+        return tuple(self.interested.get(item_id - 1, ()))
+
+    def take(self, count):
+
+        ''' the ids of the next count items that have never been
+            taken, in order of id. Amortized O(1) per item. '''
+
+        taken = []
+
+        while len(taken) < count and self.cursor < len(self.alive):
+            if self.alive[self.cursor]:
+                taken.append(self.cursor + 1)
+            self.cursor += 1
+
+        return taken
+
+    def header(self):
+
+        ''' everything but the columns, as a JSON-friendly dict '''
+
+        return {
+            'size': len(self.alive),
+            'count': self.count,
+            'cursor': self.cursor,
+            'typecodes': [getattr(self, c).typecode for c in self.COLUMNS],
+            'users': self.users,
+            'descriptions': self.descriptions,
+            'interested': {str(i): users
+                           for (i, users) in self.interested.items()}
+        }
+
+    def columns(self):
+
+        ''' the columns as buffers, in order: the arrays of COLUMNS,
+            then the alive flags '''
+
+        return [getattr(self, c) for c in self.COLUMNS] + [self.alive]
+
+    @classmethod
+    def restore(cls, header, fd):
+
+        ''' rebuilds a store from its header() and the columns()
+            read from a binary file '''
+
+        store = cls()
+        size = header['size']
+
+        if header['typecodes'] != [getattr(store, c).typecode
+                                   for c in cls.COLUMNS]:
+            raise ValueError('incompatible item columns')
+
+        for column in cls.COLUMNS:
+            getattr(store, column).fromfile(fd, size)
+
+        store.alive = bytearray(fd.read(size))
+        if len(store.alive) != size:
+            raise EOFError('truncated item columns')
+
+        (store.count, store.cursor) = (header['count'], header['cursor'])
+
+        store.users = header['users']
+        store.user_ids = {u: i for (i, u) in enumerate(store.users)}
+        store.descriptions = header['descriptions']
+        store.description_ids = {d: i for (i, d)
+                                 in enumerate(store.descriptions)}
+
+        store.interested = {int(i): users for (i, users)
+                            in header['interested'].items()}
+
+        return store
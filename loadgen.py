@@ -0,0 +1,348 @@
+#!/usr/bin/python
+
+''' A synthetic load generator for the auction servers.
+
+    Thousands of bidders are simulated in a single process, each one
+    with a TCP connection of its own, on the EventLoop of the servers
+    (eventloop.py). Bids arrive as a Poisson process of the given
+    rate, each one from a bidder interested in an open lot, and the
+    time from a bid until its NewHighBid reaches the bidder is
+    recorded in a log-scale histogram.
+
+    Usage: ./loadgen.py [options] [port ...]
+
+    Without ports, a pair of servers is spawned for the run (see
+    --spawn). ./loadgen.py --help lists the options.
+'''
+
+import sys, os, time, socket, random, argparse
+import tempfile, multiprocessing
+
+import eventloop, messages, benchmark
+from metrics import Histogram
+import serializer as serial
+
+# bid increments, above the current price, by distribution name
+DISTRIBUTIONS = {
+    'fixed':       lambda rng, step: step,
+    'uniform':     lambda rng, step: rng.uniform(1, 2 * step - 1),
+    'exponential': lambda rng, step: 1 + rng.expovariate(1 / step),
+}
+
+class SimBidder(object):
+
+    ''' the connection and state of a simulated bidder '''
+
+    __slots__ = ('name', 'sock', 'conn', 'decoder', 'interested')
+
+    def __init__(self, name, sock, conn):
+
+        (self.name, self.sock, self.conn) = (name, sock, conn)
+        self.decoder = serial.FrameDecoder()
+
+        # lots the server acknowledged my interest in
+        self.interested = set()
+
+
+class LoadGenerator(object):
+
+    ''' LoadGenerator connects bidders to the servers at addresses
+        (round robin) and bids for duration seconds:
+
+            rate        bids per second, over all bidders
+            interest    fraction of the bidders interested in a lot
+            dist, step  distribution (see DISTRIBUTIONS) and mean of
+                        the increment of a bid over the current price
+            window      the L of the servers: lots are only bid on
+                        once their interest phase is over
+    '''
+
+    def __init__(self, addresses, bidders=1000, rate=1000.0,
+                 interest=0.5, dist='uniform', step=10, duration=10.0,
+                 window=2.0, seed=1):
+
+        self.addresses = addresses
+        (self.bidders, self.rate) = (bidders, rate)
+        (self.interest, self.duration) = (interest, duration)
+
+        self.increment = DISTRIBUTIONS[dist]
+        (self.step, self.window) = (step, window)
+        self.rng = random.Random(seed)
+
+        self.loop = eventloop.EventLoop()
+        self.clients = {}
+
+        # open lots: current price, interested bidders and
+        # the end of their interest phase
+        (self.prices, self.interested, self.hold) = ({}, {}, {})
+
+        # send time of the bids still waiting for their NewHighBid,
+        # by (bidder, item id, price)
+        self.pending = {}
+        self.latency = Histogram()
+
+        # statistics
+        (self.sent, self.received, self.complete) = (0, 0, False)
+        self.errors = {}
+
+    def connect(self):
+
+        ''' opens every connection, registering its bidder '''
+
+        for i in range(self.bidders):
+
+            name = 'sim%d' % i
+            sock = socket.create_connection(
+                        self.addresses[i % len(self.addresses)])
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.setblocking(0)
+
+            bidder = SimBidder(name, sock,
+                               eventloop.Connection(self.loop, sock))
+            self.clients[sock] = bidder
+
+            self.loop.add_reader(sock, self.read)
+            bidder.conn.write(messages.ConnectMsg(username=name).send())
+
+    def read(self, sock):
+
+        ''' reader callback of a bidder connection '''
+
+        bidder = self.clients[sock]
+
+        try:
+            count = bidder.decoder.recv(sock, 65536)
+        except OSError:
+            count = 0
+
+        if not count:
+            self.loop.remove(sock)
+            del self.clients[sock]
+            return
+
+        now = time.perf_counter()
+
+        for msg in bidder.decoder.messages():
+            self.received += 1
+            self.handle(bidder, msg, now)
+
+    def handle(self, bidder, msg, now):
+
+        header = msg['header']
+
+        if header == 'start_bid':
+
+            item_id = msg['item_id']
+            if item_id not in self.prices:
+                self.prices[item_id] = msg['price']
+                self.hold[item_id] = now + self.window
+
+            if self.rng.random() < self.interest:
+                bidder.conn.write(messages.InterestedMsg(
+                        username=bidder.name, item_id=item_id).send())
+
+        elif header == 'ack_interest':
+
+            item_id = msg['item_id']
+            bidder.interested.add(item_id)
+            self.interested.setdefault(item_id, []).append(bidder)
+
+        elif header in ('new_high_bid', 'sync_price'):
+
+            item_id = msg['item_id']
+            if msg['price'] > self.prices.get(item_id, 0):
+                self.prices[item_id] = msg['price']
+
+            # the NewHighBid of one of my own bids
+            if header == 'new_high_bid' and msg['bidder'] == bidder.name:
+                sent = self.pending.pop(
+                        (bidder.name, item_id, msg['price']), None)
+                if sent is not None:
+                    self.latency.record(now - sent)
+
+        elif header == 'stop_bid':
+
+            item_id = msg['item_id']
+            self.prices.pop(item_id, None)
+            self.interested.pop(item_id, None)
+            self.hold.pop(item_id, None)
+            bidder.interested.discard(item_id)
+
+        elif header == 'error':
+
+            code = msg['error']
+            self.errors[code] = self.errors.get(code, 0) + 1
+
+        elif header == 'complete':
+            self.complete = True
+
+    def bid(self):
+
+        ''' timer callback: the next bid of the Poisson process '''
+
+        self.loop.call_later(self.rng.expovariate(self.rate), self.bid)
+
+        now = time.perf_counter()
+        lots = [item_id for (item_id, bidders) in self.interested.items()
+                if bidders and self.hold.get(item_id, 0) <= now]
+        if not lots: return
+
+        item_id = self.rng.choice(lots)
+        bidder = self.rng.choice(self.interested[item_id])
+
+        price = round(self.prices[item_id] +
+                      self.increment(self.rng, self.step))
+
+        self.pending[(bidder.name, item_id, price)] = now
+        self.sent += 1
+
+        bidder.conn.write(messages.BidMsg(item_id=item_id, price=price,
+                                          username=bidder.name).send())
+
+    def run(self):
+
+        ''' connects the bidders, bids for the duration of the run
+            and returns the results '''
+
+        started = time.perf_counter()
+        self.connect()
+        connected = time.perf_counter()
+
+        self.bid()
+
+        end = connected + self.duration
+        while time.perf_counter() < end and not self.complete:
+            self.loop.run_once(end - time.perf_counter())
+
+        elapsed = time.perf_counter() - connected
+
+        for sock in list(self.clients):
+            sock.close()
+
+        return {
+            'bidders': self.bidders,
+            'connect_s': round(connected - started, 2),
+            'elapsed_s': round(elapsed, 2),
+            'bids_sent': self.sent,
+            'bids_won': self.latency.count,
+            'unanswered': len(self.pending),
+            'bids_per_s': round(self.latency.count / elapsed, 1),
+            'msgs_per_s': round(self.received / elapsed, 1),
+            'errors': {'0x%x' % code: count
+                       for (code, count) in self.errors.items()},
+            'p50_ms': round(1e3 * self.latency.percentile(0.5), 3),
+            'p99_ms': round(1e3 * self.latency.percentile(0.99), 3),
+            'p999_ms': round(1e3 * self.latency.percentile(0.999), 3),
+            'max_ms': round(1e3 * self.latency.max, 3),
+        }
+
+
+def serve(engine, port, peers, itemfile, max_connections):
+
+    ''' process target: a quiet auction server '''
+
+    sys.stdout = sys.stderr = open(os.devnull, 'w')
+    benchmark.raise_fd_limit()
+
+    if engine == 'asyncio':
+        from async_auctioneer import AsyncAuctioneer as server
+    else:
+        from auctioneer import Auctioneer as server
+
+    server(port=port, peers=peers, itemfile=itemfile,
+           max_connections=max_connections).serve()
+
+def spawn(engine, count, itemfile, max_connections):
+
+    ''' starts count peered servers, returns their ports and
+        processes once they have formed the mesh '''
+
+    socks = [socket.socket() for _ in range(count)]
+    for sock in socks:
+        sock.bind(('localhost', 0))
+    ports = [sock.getsockname()[1] for sock in socks]
+    for sock in socks:
+        sock.close()
+
+    procs = [multiprocessing.Process(
+                target=serve, daemon=True,
+                args=(engine, port,
+                      [('localhost', i) for i in ports if i != port],
+                      itemfile, max_connections))
+             for port in ports]
+
+    for proc in procs:
+        proc.start()
+
+    # the first accepted connections of a server are its peers
+    time.sleep(3)
+
+    return (ports, procs)
+
+def items_file(window, count=1000):
+
+    ''' a temporary items file: L = window, count items '''
+
+    (fd, path) = tempfile.mkstemp(suffix='.txt')
+    with os.fdopen(fd, 'w') as items:
+        items.write('%g\n' % window)
+        for i in range(count):
+            items.write('%d Simulated item %d.\n' % (10 + i % 100, i))
+
+    return path
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+                description='Simulates bidders against auction servers.')
+    parser.add_argument('ports', type=int, nargs='*',
+                        help='ports of running servers (on localhost)')
+    parser.add_argument('--bidders', type=int, default=1000)
+    parser.add_argument('--rate', type=float, default=1000,
+                        help='bids per second, over all bidders')
+    parser.add_argument('--interest', type=float, default=0.5,
+                        help='fraction of the bidders interested in a lot')
+    parser.add_argument('--dist', choices=sorted(DISTRIBUTIONS),
+                        default='uniform', help='bid increments')
+    parser.add_argument('--step', type=float, default=10,
+                        help='mean bid increment')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--spawn', type=int, default=2,
+                        help='servers to spawn when no port is given')
+    parser.add_argument('--engine', choices=('eventloop', 'asyncio'),
+                        default='eventloop')
+    parser.add_argument('--window', type=float, default=2,
+                        help='L of the servers, in seconds')
+    parser.add_argument('--histogram', action='store_true')
+
+    args = parser.parse_args()
+    benchmark.raise_fd_limit()
+
+    procs = []
+    if args.ports:
+        ports = args.ports
+    else:
+        itemfile = items_file(args.window)
+        (ports, procs) = spawn(args.engine, args.spawn, itemfile,
+                               args.bidders + 10)
+
+    generator = LoadGenerator([('localhost', port) for port in ports],
+                              bidders=args.bidders, rate=args.rate,
+                              interest=args.interest, dist=args.dist,
+                              step=args.step, duration=args.duration,
+                              window=args.window)
+
+    try:
+        results = generator.run()
+    finally:
+        for proc in procs:
+            proc.terminate()
+        if procs:
+            os.unlink(itemfile)
+
+    for (key, value) in results.items():
+        print('{0:<12} {1}'.format(key, value))
+
+    if args.histogram:
+        print(generator.latency.render())
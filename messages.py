@@ -1,18 +1,26 @@
 #!/usr/bin/python
 
 import serializer as serial
-import json
 
 class Message(object):
 
     ''' Message is the base class that implements the 
         control message type.
+
+        Messages are encoded lazily: the wire bytes of each codec
+        are produced on the first send() and cached, so a message
+        that is broadcast to many connections is encoded once.
     '''
 
+    __slots__ = ('msg_type', 'msg', '_json', '_binary')
+
     def __init__(self, msg_type, msg_details):
         self.msg_type = msg_type
         self.msg = msg_details
-        self.msg_data = serial.encode_msg(msg_type, msg_details)
+
+        # cached wire bytes, per codec
+        self._json = None
+        self._binary = None
 
     def __str__(self):
         return self.msg_type
@@ -21,30 +29,76 @@ class Message(object):
         return self.msg_type
 
     def __eq__(self, other):
-        
-        return self.msg_data == other.msg_data
 
-    def send(self):
+        return (self.msg_type == other.msg_type and 
+                self.msg == other.msg)
+
+    def __getitem__(self, key):
+
+        ''' dict-like access to the message fields, as for
+            a decoded message (including its 'header') '''
+
+        if key == 'header':
+            return self.msg_type
+
+        return self.msg[key]
+
+    def get(self, key, default=None):
+
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    @property
+    def msg_data(self):
+
+        ''' the JSON encoding of the message, as a string '''
+
+        return str(self.send(), 'ascii')
+
+    def send(self, codec=serial.JSON):
 
         ''' Serializes JSON encoded data using ascii encoding
             in order for them to be sent via a TCP/IP connection.
+            With the binary codec, a length-prefixed binary frame
+            is produced instead.
         '''
-        return bytes(self.msg_data, 'ascii')
+        if codec == serial.BINARY:
+            if self._binary is None:
+                self._binary = serial.pack_binary(self.msg_type, self.msg)
+
+                # no fixed layout: wrap the JSON frame, which a
+                # broadcast to JSON bidders has often cached already
+                if self._binary is None:
+                    self._binary = serial.wrap_json(self.send())
+
+            return self._binary
+
+        if self._json is None:
+            self._json = serial.encode_msg(self.msg_type,
+                                           self.msg).encode('ascii')
+        return self._json
 
     def details(self):
 
         ''' Returns a structured (i.e. dict) representation of 
             the message data
         '''
-        return json.loads(self.msg_data)
+        data = dict(self.msg)
+        data['header'] = self.msg_type
+
+        return data
 
 class StartAuctionMsg(Message):
 
     ''' sent from one auctioneer to the other 
         when one of them has started auctioning '''
 
+    __slots__ = ()
+
     def __init__(self):
-        super().__init__(msg_type='start_auction', msg_details={})
+        Message.__init__(self, 'start_auction', {})
         
 
 class ConnectMsg(Message):
@@ -54,8 +108,10 @@ class ConnectMsg(Message):
         connection is established. Contains user data in JSON format.
     '''
 
+    __slots__ = ()
+
     def __init__(self, **user_data):
-        super().__init__(msg_type='connect', msg_details=user_data)
+        Message.__init__(self, 'connect', user_data)
 
 class AckConnectMsg(Message):
 
@@ -63,23 +119,29 @@ class AckConnectMsg(Message):
         to enforce a handshake-like protocol.
     '''
 
+    __slots__ = ()
+
     def __init__(self):
-        super().__init__(msg_type='ack', msg_details={})
+        Message.__init__(self, 'ack', {})
 
 class InterestedMsg(Message):
     ''' InterestedMsg is sent by a bidder to the auctioneer 
         to ask permission for bidding on an item '''
 
+    __slots__ = ()
+
     def __init__(self, **usr_data):
-        super().__init__(msg_type='i_am_interested', msg_details=usr_data)
+        Message.__init__(self, 'i_am_interested', usr_data)
         
 
 class AckInterestMsg(Message):
 
-    ''' Acknowledges interest from a bidder '''
+    ''' Acknowledges interest from a bidder for a lot '''
 
-    def __init__(self):
-        super().__init__(msg_type='ack_interest', msg_details={})
+    __slots__ = ()
+
+    def __init__(self, **ack_data):
+        Message.__init__(self, 'ack_interest', ack_data)
 
 
 class StartBidMsg(Message):
@@ -89,8 +151,10 @@ class StartBidMsg(Message):
         It contains data encoded in JSON format.
     '''
 
+    __slots__ = ()
+
     def __init__(self, **bid_data):
-        super().__init__(msg_type='start_bid', msg_details=bid_data)
+        Message.__init__(self, 'start_bid', bid_data)
 
 class StopBidMsg(Message):
 
@@ -103,8 +167,10 @@ class StopBidMsg(Message):
         Contains user and item data in JSON format.
     '''
 
+    __slots__ = ()
+
     def __init__(self, **bid_data):
-        super().__init__(msg_type='stop_bid', msg_details=bid_data)
+        Message.__init__(self, 'stop_bid', bid_data)
 
 class NewHighBidMsg(Message):
 
@@ -114,8 +180,10 @@ class NewHighBidMsg(Message):
         Contains data in JSON format.
     '''
 
+    __slots__ = ()
+
     def __init__(self, **bid_data):
-        super().__init__(msg_type='new_high_bid', msg_details=bid_data)
+        Message.__init__(self, 'new_high_bid', bid_data)
 
 class ErrorMsg(Message):
 
@@ -130,8 +198,10 @@ class ErrorMsg(Message):
     '''
 
 
+    __slots__ = ()
+
     def __init__(self, **error_data):
-        super().__init__(msg_type='error', msg_details=error_data)
+        Message.__init__(self, 'error', error_data)
 
 class BidMsg(Message):
     
@@ -141,8 +211,10 @@ class BidMsg(Message):
         as the msg_details field in the Message base class.
     '''
 
+    __slots__ = ()
+
     def __init__(self, **bid_data):
-        super().__init__(msg_type='bid', msg_details=bid_data)
+        Message.__init__(self, 'bid', bid_data)
 
 
 class SyncPriceMsg(Message):
@@ -150,11 +222,15 @@ class SyncPriceMsg(Message):
     ''' SyncPriceMsg is sent to another auctioneer to update price for
         a specific item. 
 
-        Contains price, item_id, and user with highest bid.
+        Contains price, item_id, user with highest bid and the version
+        of the price, used to order concurrent bids (see price_key()
+        in base.py).
     '''
 
+    __slots__ = ()
+
     def __init__(self, **bid_data):
-        super().__init__(msg_type ='sync_price', msg_details=bid_data)
+        Message.__init__(self, 'sync_price', bid_data)
 
 
     def __gt__(self, other):
@@ -169,8 +245,10 @@ class SyncInterestMsg(Message):
     ''' sent between auctioneers to update interest info
         for items '''
 
+    __slots__ = ()
+
     def __init__(self, **usr_data):
-        super().__init__(msg_type='sync_interest', msg_details=usr_data)
+        Message.__init__(self, 'sync_interest', usr_data)
 
 
 class QuitMsg(Message):
@@ -178,8 +256,10 @@ class QuitMsg(Message):
     ''' QuitMsg is sent from a bidder to the auctioneer when 
         he/she intends on leaving the auction. '''
 
+    __slots__ = ()
+
     def __init__(self, **usr_data):
-        super().__init__(msg_type = 'quit', msg_details=usr_data)
+        Message.__init__(self, 'quit', usr_data)
 
 class CompleteMsg(Message):
 
@@ -190,5 +270,98 @@ class CompleteMsg(Message):
         Route: Auctioneer -> Everyone
     '''
 
+    __slots__ = ()
+
     def __init__(self):
-        super().__init__(msg_type='complete', msg_details={})
+        Message.__init__(self, 'complete', {})
+
+
+class JoinMsg(Message):
+
+    ''' JoinMsg is sent by an auctioneer that restarts mid-auction to
+        every other auctioneer, which then links to it again at host
+        and port. The one asked for the transfer streams the state of
+        the auction to it (see transfer.py).
+
+        Route: Auctioneer -> Auctioneer
+    '''
+
+    __slots__ = ()
+
+    def __init__(self, **join_data):
+        Message.__init__(self, 'join', join_data)
+
+class StateChunkMsg(Message):
+
+    ''' StateChunkMsg carries the items with ids first to last of the
+        auction, to an auctioneer that rejoins it. Each of the items
+        still in the auction is a list:
+
+            [item_id, price, holder, version, interested]
+
+        the others have been awarded or discarded meanwhile.
+
+        Route: Auctioneer -> Auctioneer
+    '''
+
+    __slots__ = ()
+
+    def __init__(self, **chunk_data):
+        Message.__init__(self, 'state_chunk', chunk_data)
+
+class StateEndMsg(Message):
+
+    ''' StateEndMsg ends a state transfer with the open lots of the
+        auction, as lists of
+
+            [item_id, interest_phase, window left, timeouts,
+             price, holder, version, interested]
+
+        along with the cursor of the item store.
+
+        Route: Auctioneer -> Auctioneer
+    '''
+
+    __slots__ = ()
+
+    def __init__(self, **end_data):
+        Message.__init__(self, 'state_end', end_data)
+
+
+# message classes by header, for decoding
+MESSAGE_TYPES = {
+    'start_auction':    StartAuctionMsg,
+    'connect':          ConnectMsg,
+    'ack':              AckConnectMsg,
+    'i_am_interested':  InterestedMsg,
+    'ack_interest':     AckInterestMsg,
+    'start_bid':        StartBidMsg,
+    'stop_bid':         StopBidMsg,
+    'new_high_bid':     NewHighBidMsg,
+    'error':            ErrorMsg,
+    'bid':              BidMsg,
+    'sync_price':       SyncPriceMsg,
+    'sync_interest':    SyncInterestMsg,
+    'quit':             QuitMsg,
+    'complete':         CompleteMsg,
+    'join':             JoinMsg,
+    'state_chunk':      StateChunkMsg,
+    'state_end':        StateEndMsg,
+}
+
+def from_frame(data):
+
+    ''' builds a typed message object straight out of a decoded
+        frame, e.g. FrameDecoder(factory=messages.from_frame).
+        Unknown headers produce a plain Message.
+    '''
+
+    header = data.pop('header', None)
+    cls = MESSAGE_TYPES.get(header, Message)
+
+    # skip the constructors of the subclasses, which
+    # do not share the same signature
+    msg = cls.__new__(cls)
+    Message.__init__(msg, header, data)
+
+    return msg
@@ -3,6 +3,7 @@
 import sys, socket, select, signal, time
 from socket import error as SocketError
 from serializer import unpack_status
+import strategy
 
 class Messenger(object):
 
@@ -22,6 +23,9 @@ class Messenger(object):
         self.max_bid = max_bid
         self.offers = offers
 
+        # the same offers, made by the strategy of a bidder
+        self.strategy = strategy.OfferList(offers, freq)
+
         # status variable to be retrieved from bidder client
         self.status = None
 
@@ -30,34 +34,9 @@ class Messenger(object):
 
     def actions(self):
 
-        response = None
-
-        if not self.status: return response
-
-        status = self.status
-
-        # if my offers are over, I must quit
-        if not self.offers:
-            response = "quit"
-            return response 
-
-        if status['bidding'] and not status['acknowledged']:
-            response = "int"
-        
-        elif status['bidding'] and status['acknowledged']:
-
-            offer = self.offers.pop(0)
-
-            # if my offer is good, send it to the auctioneer
-            if offer > status['min_price']:
-                response = "bid " + str(offer)
-                                     
-            else:
-                # wait for next item
-                response = None
+        ''' my next to-do response, see strategy.OfferList '''
 
-        # return my next to-do response
-        return response
+        return self.strategy.actions(self.status)
 
     def simulate(self):
 
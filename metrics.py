@@ -0,0 +1,243 @@
+#!/usr/bin/python
+
+''' Runtime metrics of an auction server.
+
+    Servers count the messages they receive (by header), the bids
+    they accept or reject (by error code) and the bytes they send and
+    receive, and keep histograms of the broadcast fan-out, of the time
+    spent handling each loop iteration and of the time sync messages
+    wait before being written to the other servers. Gauges (bidders,
+    open lots, bytes queued for each peer) are read when asked for.
+
+    A server started with an admin socket (a UNIX socket, like the
+    frontend of the bidders) answers each request on it with its
+    metrics, as text or as JSON:
+
+    Usage: ./metrics.py <admin socket> [text|json]
+'''
+
+import sys, time, json, math, socket
+
+import errors
+
+# counters of the rejected bids, by error code
+REJECTED = {code: 'bids.rejected.' + name for (name, code)
+            in vars(errors).items() if isinstance(code, int)}
+
+class Histogram(object):
+
+    ''' Histogram counts values in logarithmic buckets: subbuckets
+        per power of two, from unit on, so any percentile is known
+        within a few percent, in constant memory. The default unit
+        suits latencies in seconds (1 microsecond).
+    '''
+
+    def __init__(self, subbuckets=16, unit=1e-6):
+
+        (self.subbuckets, self.unit) = (subbuckets, unit)
+        self.counts = {}
+        (self.count, self.total, self.max) = (0, 0.0, 0.0)
+
+    def bucket(self, value):
+
+        units = max(value / self.unit, 1.0)
+        return int(math.log2(units) * self.subbuckets)
+
+    def upper(self, bucket):
+
+        ''' the upper bound of a bucket '''
+
+        return 2 ** ((bucket + 1) / self.subbuckets) * self.unit
+
+    def record(self, value):
+
+        bucket = self.bucket(value)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, q):
+
+        ''' the value below which a fraction q of the samples
+            fall (upper bound of its bucket), 0 if empty '''
+
+        if not self.count: return 0.0
+
+        rank = q * self.count
+        seen = 0
+
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return min(self.upper(bucket), self.max)
+
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def summary(self, scale=1):
+
+        ''' count, mean, percentiles and maximum, multiplied by scale
+            (e.g. 1e3 for latencies in milliseconds) '''
+
+        return {
+            'count': self.count,
+            'mean':  round(scale * self.mean(), 3),
+            'p50':   round(scale * self.percentile(0.5), 3),
+            'p99':   round(scale * self.percentile(0.99), 3),
+            'p999':  round(scale * self.percentile(0.999), 3),
+            'max':   round(scale * self.max, 3),
+        }
+
+    def render(self, width=50, rows=16):
+
+        ''' a text rendering of latencies, with rows merged
+            buckets at most '''
+
+        if not self.count: return '(no samples)'
+
+        buckets = sorted(self.counts)
+        step = max(1, math.ceil((buckets[-1] - buckets[0] + 1) / rows))
+
+        lines = []
+        for first in range(buckets[0], buckets[-1] + 1, step):
+            count = sum(self.counts.get(b, 0)
+                        for b in range(first, first + step))
+            bar = '#' * math.ceil(width * count / self.count)
+            lines.append('{0:>10.3f} ms {1:>8} {2}'.format(
+                    1e3 * self.upper(first + step - 1), count, bar))
+
+        return '\n'.join(lines)
+
+class Metrics(object):
+
+    ''' Metrics holds the counters, histograms and gauges of a
+        server. Counters and histograms are created on first use.
+        Names are dotted, e.g. 'messages_in.bid'. '''
+
+    def __init__(self):
+
+        self.started = time.monotonic()
+
+        self.counters = {}
+
+        # (histogram, scale of its summary) by name: durations are
+        # recorded in seconds and summarized in milliseconds
+        self.histograms = {}
+
+        # callables returning a number, or a dict of numbers
+        self.gauges = {}
+
+    def incr(self, name, count=1):
+
+        self.counters[name] = self.counters.get(name, 0) + count
+
+    def observe(self, name, value):
+
+        ''' records a value (e.g. a number of recipients) '''
+
+        try:
+            self.histograms[name][0].record(value)
+        except KeyError:
+            self.histograms[name] = (Histogram(unit=1), 1)
+            self.histograms[name][0].record(value)
+
+    def timing(self, name, seconds):
+
+        ''' records a duration in seconds, summarized in milliseconds
+            (hence the _ms suffix of their names) '''
+
+        try:
+            self.histograms[name][0].record(seconds)
+        except KeyError:
+            self.histograms[name] = (Histogram(), 1e3)
+            self.histograms[name][0].record(seconds)
+
+    def gauge(self, name, func):
+
+        ''' registers a value read on every snapshot() '''
+
+        self.gauges[name] = func
+
+    def rejected(self, error):
+
+        ''' counts a rejected bid, by error code '''
+
+        self.incr(REJECTED.get(error) or 'bids.rejected.' + str(error))
+
+    def snapshot(self):
+
+        ''' all the metrics, as a JSON-friendly dict '''
+
+        return {
+            'uptime_s':   round(time.monotonic() - self.started, 3),
+            'counters':   dict(sorted(self.counters.items())),
+            'gauges':     {name: func() for (name, func)
+                           in sorted(self.gauges.items())},
+            'histograms': {name: hist.summary(scale) for
+                           (name, (hist, scale))
+                           in sorted(self.histograms.items())},
+        }
+
+    def render(self):
+
+        ''' all the metrics as text, one per line '''
+
+        snap = self.snapshot()
+        lines = ['uptime_s {0}'.format(snap['uptime_s'])]
+
+        for (name, value) in snap['counters'].items():
+            lines.append('{0} {1}'.format(name, value))
+
+        for (name, value) in snap['gauges'].items():
+            if isinstance(value, dict):
+                for (key, item) in sorted(value.items()):
+                    lines.append('{0}.{1} {2}'.format(name, key, item))
+            else:
+                lines.append('{0} {1}'.format(name, value))
+
+        for (name, summary) in snap['histograms'].items():
+            lines.append('{0} {1}'.format(name, ' '.join(
+                    '{0}={1}'.format(k, v) for (k, v) in summary.items())))
+
+        return '\n'.join(lines) + '\n'
+
+    def reply(self, request):
+
+        ''' the response to a request on the admin socket: the
+            metrics as JSON for 'json', as text otherwise '''
+
+        if request.strip() == 'json':
+            return bytes(json.dumps(self.snapshot()) + '\n', 'ascii')
+
+        return bytes(self.render(), 'ascii')
+
+
+def query(path, request='text'):
+
+    ''' asks the admin socket of a server for its metrics '''
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(path)
+
+    with sock:
+        sock.sendall(bytes(request, 'ascii'))
+
+        chunks = []
+        while True:
+            data = sock.recv(65536)
+            if not data: break
+            chunks.append(data)
+
+    return str(b''.join(chunks), 'ascii')
+
+if __name__ == '__main__':
+
+    if len(sys.argv) < 2:
+        print('Usage: ./metrics.py <admin socket> [text|json]')
+        exit(0)
+
+    sys.stdout.write(query(sys.argv[1], ' '.join(sys.argv[2:]) or 'text'))
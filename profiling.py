@@ -0,0 +1,282 @@
+#!/usr/bin/python
+
+''' Opt-in profiling of a running auction server.
+
+    Nothing is profiled until asked for, either with a signal or with
+    a command on the admin socket of the server (see metrics.py):
+
+        profile [seconds]   cProfile window of the server loop
+                            (SIGUSR1: a window of PROFILE_SECONDS)
+        heap                tracemalloc snapshot, compared with the
+                            previous one (SIGUSR2). The first one
+                            starts tracing the allocations.
+        heap stop           stops tracing the allocations
+        watchdog <seconds>  captures the stack of every loop iteration
+                            or sync flush that runs for longer
+        watchdog off
+
+    Results are written to files named after the server, in the
+    profile directory of the server, for offline analysis:
+
+        <name>_<time>.pstats    python -m pstats <file>
+        <name>_heap_<n>.snap    tracemalloc.Snapshot.load(<file>)
+        <name>_heap.txt         sizes and top growth of each snapshot
+        <name>_stalls.txt       stacks of the stalls
+'''
+
+import os, sys, time, threading, traceback
+import cProfile, tracemalloc, linecache
+
+def log(msg):
+
+    ''' logging function for standard error '''
+
+    sys.stderr.write(msg + '\n')
+
+# admin commands handled here, see Profiler.command()
+COMMANDS = ('profile', 'heap', 'watchdog')
+
+# length of a profile window started by a signal
+PROFILE_SECONDS = 10.0
+
+# shortest pause of the watchdog thread between two checks
+WATCH_INTERVAL_MIN = 0.001
+
+class Watchdog(object):
+
+    ''' Watchdog reports the stack of the server thread whenever it
+        has been busy with the same task for more than threshold
+        seconds, while the task is still running. The server marks
+        its tasks with enter(label) and leave(), and the loop calls
+        clear() before waiting for events. A thread checks them, so
+        a stall is caught however long it lasts.
+
+        Marking tasks costs next to nothing while the watchdog is off
+        (threshold None), so the engines always do it.
+    '''
+
+    def __init__(self, path, metrics):
+
+        (self.path, self.metrics) = (path, metrics)
+
+        self.threshold = None
+
+        # (label, start) of the tasks in progress, innermost last
+        self.stack = []
+
+        # the thread whose stack is captured
+        self.ident = threading.get_ident()
+        self.thread = None
+
+    def enter(self, label):
+
+        if self.threshold: self.stack.append((label, time.perf_counter()))
+
+    def leave(self):
+
+        if self.stack: self.stack.pop()
+
+    def clear(self):
+
+        if self.stack: del self.stack[:]
+
+    def start(self, threshold):
+
+        # NaN fails the test as well
+        if not threshold > 0:
+            raise ValueError('stall threshold must be positive')
+
+        self.threshold = threshold
+
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.watch, daemon=True,
+                                           name='watchdog')
+            self.thread.start()
+
+    def stop(self):
+
+        self.threshold = None
+        self.thread = None
+        self.clear()
+
+    def watch(self):
+
+        ''' watchdog thread: polls the tasks in progress '''
+
+        me = self.thread
+
+        # starts of the tasks reported, to report each stall once
+        reported = set()
+
+        while self.thread is me:
+
+            threshold = self.threshold
+            if threshold is None: break
+
+            time.sleep(max(min(threshold / 4, 0.05), WATCH_INTERVAL_MIN))
+
+            now = time.perf_counter()
+            stalled = [(label, start) for (label, start) in list(self.stack)
+                       if now - start > threshold]
+
+            # the tasks around the innermost one share its stack
+            if stalled and stalled[-1][1] not in reported:
+                (label, start) = stalled[-1]
+                self.capture(label, now - start)
+
+            reported = {start for (_, start) in stalled}
+
+    def capture(self, label, elapsed):
+
+        frame = sys._current_frames().get(self.ident)
+        if frame is None: return
+
+        stack = ''.join(traceback.format_stack(frame))
+
+        with open(self.path, 'a') as out:
+            out.write('{0} {1} running for {2:.1f} ms:\n{3}\n'.format(
+                    time.strftime('%Y-%m-%d %H:%M:%S'), label,
+                    1e3 * elapsed, stack))
+
+        self.metrics.incr('stalls.' + label)
+        log('stall: {0} running for {1:.1f} ms, stack in {2}'.format(
+                label, 1e3 * elapsed, self.path))
+
+class Profiler(object):
+
+    ''' Profiler runs the profiling commands of a server. Its files
+        are written in directory, named after the server (name). '''
+
+    def __init__(self, server, directory, name):
+
+        self.server = server
+        self.prefix = os.path.join(directory, name)
+
+        self.watchdog = Watchdog(self.prefix + '_stalls.txt',
+                                 server.metrics)
+
+        # the cProfile window in progress, if any
+        self.profile = None
+
+        # previous heap snapshot and number of snapshots taken
+        (self.heap, self.heaps) = (None, 0)
+
+    def command(self, words):
+
+        ''' runs an admin command (split in words), returns
+            the text of the reply '''
+
+        (name, args) = (words[0], words[1:])
+
+        try:
+            if name == 'profile':
+                seconds = float(args[0]) if args else PROFILE_SECONDS
+                if not 0 < seconds < float('inf'):
+                    raise ValueError(seconds)
+                return self.start_profile(seconds)
+
+            if name == 'heap':
+                if args == ['stop']:
+                    return self.stop_heap()
+                return self.snapshot_heap()
+
+            if name == 'watchdog':
+                if args == ['off']:
+                    self.watchdog.stop()
+                    return 'watchdog off'
+                self.watchdog.start(float(args[0]))
+                return 'watchdog on, threshold {0} s, stalls in {1}'.format(
+                        args[0], self.watchdog.path)
+
+        except (IndexError, ValueError):
+            pass
+
+        return 'usage: profile [seconds] | heap [stop] | ' \
+               'watchdog <seconds>|off'
+
+    def start_profile(self, seconds):
+
+        ''' profiles the server loop for the next seconds '''
+
+        if self.profile:
+            return 'already profiling, see {0}'.format(self.profile[1])
+
+        path = '{0}_{1}.pstats'.format(self.prefix,
+                                       time.strftime('%Y%m%d-%H%M%S'))
+
+        self.profile = (cProfile.Profile(), path)
+        self.profile[0].enable()
+
+        self.server.call_at(time.monotonic() + seconds, self.stop_profile)
+
+        return 'profiling for {0} s, results in {1}'.format(seconds, path)
+
+    def stop_profile(self):
+
+        ''' timer callback: ends the profile window '''
+
+        ((profile, path), self.profile) = (self.profile, None)
+
+        profile.disable()
+        profile.dump_stats(path)
+
+        log('profile written to {0}'.format(path))
+
+    def sizes(self):
+
+        ''' the sizes of the structures of the server that grow
+            with the auction and with its bidders '''
+
+        server = self.server
+
+        return {
+            'items':    len(server.items),
+            'lots':     len(server.lots),
+            'sessions': len(server.sessions),
+            'pending':  len(server.pending),
+            'outbox':   len(server.outbox),
+        }
+
+    def snapshot_heap(self, top=10):
+
+        ''' takes a heap snapshot, starting to trace allocations if
+            needed, and reports the growth since the previous one '''
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.heap = None
+
+        # leave out the allocations of the profiling itself
+        snap = tracemalloc.take_snapshot().filter_traces((
+                    tracemalloc.Filter(False, tracemalloc.__file__),
+                    tracemalloc.Filter(False, linecache.__file__)))
+
+        self.heaps += 1
+        path = '{0}_heap_{1}.snap'.format(self.prefix, self.heaps)
+        snap.dump(path)
+
+        lines = ['{0} snapshot {1}: {2}'.format(
+                    time.strftime('%Y-%m-%d %H:%M:%S'), path,
+                    ' '.join('{0}={1}'.format(k, v)
+                             for (k, v) in self.sizes().items()))]
+
+        if self.heap is None:
+            stats = snap.statistics('lineno')
+        else:
+            stats = snap.compare_to(self.heap, 'lineno')
+
+        lines.extend('    {0}'.format(stat) for stat in stats[:top])
+
+        with open(self.prefix + '_heap.txt', 'a') as out:
+            out.write('\n'.join(lines) + '\n\n')
+
+        self.heap = snap
+
+        return '\n'.join(lines)
+
+    def stop_heap(self):
+
+        tracemalloc.stop()
+        self.heap = None
+
+        return 'heap tracing off'
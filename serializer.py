@@ -1,4 +1,26 @@
-import json
+import json, struct
+from json import encoder as json_encoder
+
+# wire codecs, negotiated by bidders in their ConnectMsg
+JSON   = 'json'
+BINARY = 'binary'
+
+# json.dumps() builds a new encoder for every call, which costs more
+# than encoding a message. The encoder of the messages is built once,
+# with the same settings, from the C accelerator of the json module
+# when it is available (messages are never circular).
+if json_encoder.c_make_encoder is not None:
+
+    _encoder = json_encoder.c_make_encoder(
+                    None, json.JSONEncoder().default,
+                    json_encoder.encode_basestring_ascii, None,
+                    ': ', ', ', False, False, True)
+
+    def dumps(obj):
+        return ''.join(_encoder(obj, 0))
+
+else:
+    dumps = json.dumps
 
 def encode_msg(msg_type, msg_details):
 
@@ -24,7 +46,7 @@ def encode_msg(msg_type, msg_details):
     data['header'] = msg_type
 
     # '|' is the message delimiter
-    return (json.dumps(data) + '|')
+    return (dumps(data) + '|')
 
 def encode_status(bidder_status):
 
@@ -61,3 +83,299 @@ def decode_msg(msg_in_json):
 
     return data
 
+def decode_json(frame):
+
+    ''' decodes a JSON frame given as ascii bytes '''
+
+    return decode_msg(str(frame, 'ascii'))
+
+
+# Binary frames start with a zero byte, which never starts a JSON
+# frame, so that a single stream may carry frames of both codecs.
+# Header: zero byte, payload length, message type tag. The length
+# has 32 bits, as state chunks easily exceed 64KB.
+BINARY_HEADER = struct.Struct('!BIB')
+
+# tag of a JSON message wrapped in a binary frame, used
+# for messages that have no fixed layout
+TAG_JSON = 0
+
+# fixed layouts of the high-frequency messages:
+#   (type tag, struct of the fixed fields, fixed fields, string field)
+# the string field follows as a 16 bit length and ascii bytes
+BINARY_LAYOUTS = {
+    'bid':          (1, struct.Struct('!Id'), ('item_id', 'price'),
+                        'username'),
+    'new_high_bid': (2, struct.Struct('!IdI'),
+                        ('item_id', 'price', 'version'), 'bidder'),
+    'sync_price':   (3, struct.Struct('!IdI'),
+                        ('item_id', 'price', 'version'), 'username'),
+    'start_bid':    (4, struct.Struct('!Id'), ('item_id', 'price'),
+                        'description'),
+}
+
+# layouts by type tag, for decoding
+BINARY_TAGS = {
+    layout[0]: (msg_type,) + layout[1:]
+    for (msg_type, layout) in BINARY_LAYOUTS.items()
+}
+
+STRING_LEN  = struct.Struct('!H')
+STRING_NONE = 0xFFFF
+
+def _binary_frame(tag, payload):
+    return BINARY_HEADER.pack(0, len(payload), tag) + payload
+
+def pack_binary(msg_type, msg_details):
+
+    ''' pack_binary() packs a message with a fixed layout in a
+        length-prefixed binary frame. Returns None for any other
+        message, or one whose fields do not fit its layout.
+    '''
+
+    try:
+        (tag, fixed, fields, string) = BINARY_LAYOUTS[msg_type]
+
+        if len(msg_details) != len(fields) + 1:
+            return None
+
+        text = msg_details[string]
+        if text is None:
+            tail = STRING_LEN.pack(STRING_NONE)
+        else:
+            text = bytes(text, 'ascii')
+            tail = STRING_LEN.pack(len(text)) + text
+
+        return _binary_frame(tag,
+                fixed.pack(*(msg_details[i] for i in fields)) + tail)
+
+    except (KeyError, ValueError, TypeError, struct.error):
+        return None
+
+def wrap_json(frame):
+
+    ''' wraps the JSON frame of a message (with its delimiter)
+        in a binary frame '''
+
+    return _binary_frame(TAG_JSON, frame[:-1])
+
+def encode_binary(msg_type, msg_details):
+
+    ''' encode_binary() encodes a message in a length-prefixed binary
+        frame. Messages with a fixed layout are packed with struct,
+        any other message (or one whose fields do not fit its
+        layout) is wrapped as JSON.
+    '''
+
+    frame = pack_binary(msg_type, msg_details)
+
+    if frame is None:
+        frame = wrap_json(bytes(encode_msg(msg_type, msg_details), 'ascii'))
+
+    return frame
+
+def decode_binary(tag, payload):
+
+    ''' decode_binary(tag, payload) decodes the payload of a binary
+        frame into the same dict a JSON frame would produce '''
+
+    if tag == TAG_JSON:
+        return decode_msg(str(payload, 'ascii'))
+
+    (msg_type, fixed, fields, string) = BINARY_TAGS[tag]
+
+    data = dict(zip(fields, fixed.unpack_from(payload)))
+
+    # prices travel as doubles, restore integral ones
+    if data['price'].is_integer():
+        data['price'] = int(data['price'])
+
+    (length,) = STRING_LEN.unpack_from(payload, fixed.size)
+    if length == STRING_NONE:
+        data[string] = None
+    else:
+        start = fixed.size + STRING_LEN.size
+        data[string] = str(payload[start:start + length], 'ascii')
+
+    data['header'] = msg_type
+    return data
+
+class FrameDecoder(object):
+
+    ''' FrameDecoder incrementally decodes the '|' delimited stream
+        of a single connection. Data is received straight into a
+        reusable bytearray (recv_into) and frames cut across two
+        reads are kept until the rest of them arrives.
+
+        Typical use:
+
+            data = decoder.recv(sock)      # 0 on end of stream
+            for msg in decoder.messages():
+                ...
+
+        Frames that do not decode into a message (a dict) are
+        skipped: skipped counts those of the last messages() call,
+        malformed all of them.
+    '''
+
+    def __init__(self, size=4096, factory=None):
+
+        # optional callable turning each decoded dict into
+        # another object, e.g. messages.from_frame
+        self.factory = factory
+
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+
+        # [start, end) is the received but not yet decoded data
+        self.start = 0
+        self.end = 0
+
+        # frames skipped by the last messages() call, and in total
+        (self.skipped, self.malformed) = (0, 0)
+
+    def _reserve(self, size):
+
+        ''' makes room for at least size more bytes at the end
+            of the buffer, moving leftovers to its beginning or
+            growing it if a single frame does not fit '''
+
+        pending = self.end - self.start
+
+        if len(self.buffer) - pending < size:
+            buff = bytearray(max(2 * len(self.buffer), pending + size))
+            buff[:pending] = self.view[self.start:self.end]
+            self.view.release()
+            (self.buffer, self.view) = (buff, memoryview(buff))
+
+        elif self.start:
+            self.buffer[:pending] = self.view[self.start:self.end]
+
+        (self.start, self.end) = (0, pending)
+
+    def recv(self, sock, size=2048):
+
+        ''' receives up to size bytes from sock. Returns the number
+            of bytes received, i.e. 0 at the end of the stream. '''
+
+        if len(self.buffer) - self.end < size:
+            self._reserve(size)
+
+        count = sock.recv_into(self.view[self.end:self.end + size])
+        self.end += count
+
+        return count
+
+    def feed(self, data):
+
+        ''' appends bytes received by other means (e.g. asyncio) '''
+
+        if len(self.buffer) - self.end < len(data):
+            self._reserve(len(data))
+
+        self.buffer[self.end:self.end + len(data)] = data
+        self.end += len(data)
+
+    def messages(self):
+
+        ''' returns the list of complete messages received so
+            far, decoded. Incomplete frames are kept. '''
+
+        self.skipped = 0
+        msg_list = self._decode()
+        self.malformed += self.skipped
+
+        if self.factory:
+            return [self.factory(i) for i in msg_list]
+
+        return msg_list
+
+    def _decode(self):
+
+        # no binary frame: decode all complete JSON frames at once
+        if self.buffer.find(b'\x00', self.start, self.end) < 0:
+            return self._json_messages(self.end)
+
+        msg_list = []
+
+        while self.start < self.end:
+
+            if self.buffer[self.start]:
+                # JSON frames up to the next binary one
+                binary = self.buffer.find(b'\x00', self.start, self.end)
+                if binary < 0: binary = self.end
+
+                msg_list.extend(self._json_messages(binary))
+
+                # incomplete JSON frame
+                if self.start < binary: break
+                continue
+
+            # binary frame: header, then payload
+            if self.end - self.start < BINARY_HEADER.size: break
+
+            (_, length, tag) = BINARY_HEADER.unpack_from(self.buffer,
+                                                         self.start)
+            payload = self.start + BINARY_HEADER.size
+            if self.end - payload < length: break
+
+            msg = self._frame(decode_binary, tag,
+                              self.view[payload:payload + length])
+            if msg is not None: msg_list.append(msg)
+            self.start = payload + length
+
+        # everything consumed, rewind
+        if self.start == self.end:
+            (self.start, self.end) = (0, 0)
+
+        return msg_list
+
+    def _json_messages(self, end):
+
+        ''' decodes the complete JSON frames in [start, end) '''
+
+        # complete frames end at the last delimiter
+        last = self.buffer.rfind(b'|', self.start, end)
+        if last < 0: return []
+
+        chunk = self.view[self.start:last]
+        self.start = last + 1
+
+        # everything consumed, rewind
+        if self.start == self.end:
+            (self.start, self.end) = (0, 0)
+
+        # decode them at once, straight from the receive buffer
+        try:
+            msg_list = [decode_msg(i) for i in
+                        str(chunk, 'ascii').split('|') if i]
+            if all(type(i) is dict for i in msg_list):
+                return msg_list
+        except ValueError: # not ascii, or not JSON
+            pass
+
+        # one of them is malformed: decode them one by one
+        msg_list = []
+        for frame in bytes(chunk).split(b'|'):
+            if frame:
+                msg = self._frame(decode_json, frame)
+                if msg is not None: msg_list.append(msg)
+
+        return msg_list
+
+    def _frame(self, decode, *args):
+
+        ''' decodes a single frame, None (counted as skipped)
+            if it is not a valid message '''
+
+        try:
+            msg = decode(*args)
+        except (ValueError, KeyError, IndexError, TypeError,
+                AttributeError, struct.error):
+            msg = None
+
+        if type(msg) is not dict:
+            self.skipped += 1
+            return None
+
+        return msg
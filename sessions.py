@@ -0,0 +1,175 @@
+#!/usr/bin/python
+
+''' Per-connection state of the auction servers.
+
+    A Session holds everything a server knows about one connection:
+    its output queue, its stream decoder, the codec it negotiated and
+    the user it registered. SessionTable indexes the sessions both by
+    connection and by username, so every lookup is O(1), and keeps
+    them in order of last activity, so idle ones are found without
+    scanning the whole table.
+'''
+
+import time
+from collections import OrderedDict
+
+import serializer as serial
+
+class Session(object):
+
+    ''' state of a single bidder or peer connection '''
+
+    __slots__ = ('conn', 'output', 'decoder', 'codec',
+                 'username', 'peer', 'last_active')
+
+    def __init__(self, conn, output=None, decoder=None, peer=False):
+
+        # the socket (or StreamWriter) the session is indexed by
+        self.conn = conn
+
+        # output queue and stream decoder of the connection
+        (self.output, self.decoder) = (output, decoder)
+
+        # wire codec negotiated in the connect handshake
+        self.codec = serial.JSON
+
+        # registered username, None until the connect message
+        self.username = None
+
+        # links with the other servers are never reaped
+        self.peer = peer
+
+        self.last_active = 0.0
+
+
+class SessionTable(object):
+
+    ''' SessionTable keeps the sessions of a server. At most limit
+        bidder sessions may be open at once (None for no limit);
+        peer sessions are not counted.
+    '''
+
+    def __init__(self, limit=None, clock=time.monotonic):
+
+        (self.limit, self.clock) = (limit, clock)
+
+        # sessions by connection, least recently active first
+        self.by_conn = OrderedDict()
+
+        # registered sessions by username
+        self.by_user = {}
+
+        # number of bidder (non-peer) sessions
+        self.bidders = 0
+
+    def __len__(self):
+        return len(self.by_conn)
+
+    def __contains__(self, conn):
+        return conn in self.by_conn
+
+    def __iter__(self):
+        return iter(list(self.by_conn.values()))
+
+    def clients(self):
+
+        ''' the bidder sessions, i.e. recipients of broadcasts '''
+
+        return [s for s in self.by_conn.values() if not s.peer]
+
+    def full(self):
+
+        ''' True if no other bidder may connect '''
+
+        return self.limit is not None and self.bidders >= self.limit
+
+    def open(self, conn, output=None, decoder=None, peer=False):
+
+        ''' creates the session of a new connection '''
+
+        session = Session(conn, output, decoder, peer)
+        session.last_active = self.clock()
+
+        self.by_conn[conn] = session
+        if not peer: self.bidders += 1
+
+        return session
+
+    def get(self, conn):
+
+        ''' the session of a connection, None if unknown '''
+
+        return self.by_conn.get(conn)
+
+    def lookup(self, username):
+
+        ''' the session registered by a user, None if unknown '''
+
+        return self.by_user.get(username)
+
+    def register(self, session, username):
+
+        ''' binds a username to a session. Returns False if the
+            username is taken by another session. '''
+
+        if self.by_user.get(username, session) is not session:
+            return False
+
+        self.unregister(session)
+        self.by_user[username] = session
+        session.username = username
+
+        return True
+
+    def unregister(self, session):
+
+        ''' releases the username of a session, if any '''
+
+        if session.username is not None:
+            self.by_user.pop(session.username, None)
+            session.username = None
+
+    def close(self, conn):
+
+        ''' forgets the session of a closed connection and
+            returns it (None if unknown) '''
+
+        session = self.by_conn.pop(conn, None)
+
+        if session is not None:
+            self.unregister(session)
+            if not session.peer: self.bidders -= 1
+
+        return session
+
+    def make_peer(self, session):
+
+        ''' turns a bidder session into a peer session, e.g. the
+            link of a server that rejoins the auction '''
+
+        if not session.peer:
+            self.unregister(session)
+            session.peer = True
+            self.bidders -= 1
+
+    def touch(self, session):
+
+        ''' records activity on a session, O(1) '''
+
+        session.last_active = self.clock()
+        self.by_conn.move_to_end(session.conn)
+
+    def idle(self, timeout):
+
+        ''' the bidder sessions without any activity for more than
+            timeout seconds. Only those (and the peer sessions) are
+            visited, as the table is in order of activity. '''
+
+        limit = self.clock() - timeout
+        idle = []
+
+        for session in self.by_conn.values():
+            if session.last_active > limit: break
+            if not session.peer: idle.append(session)
+
+        return idle
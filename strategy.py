@@ -0,0 +1,104 @@
+#!/usr/bin/python
+
+''' Bidding strategies, run inside the Bidder process.
+
+    A strategy is given to a Bidder, which consults it on the events
+    of the lot it follows and, every frequency seconds, on its timer.
+    Each callback gets the bidder (its status and username) and the
+    message of the event, and returns an action, or None to do
+    nothing. Actions are the commands of the frontend of the bidder
+    (see Bidder.parse_client()):
+
+        'int'       declare interest in the current lot
+        'bid 100'   bid on the current lot
+        'quit'      leave the auction
+'''
+
+class Strategy(object):
+
+    ''' Strategy does nothing; subclasses override the callbacks
+        they act on. '''
+
+    # seconds between calls to on_timer(), None for no timer
+    frequency = None
+
+    def on_start_bid(self, bidder, msg):
+        return None
+
+    def on_new_high_bid(self, bidder, msg):
+        return None
+
+    def on_stop_bid(self, bidder, msg):
+        return None
+
+    def on_timer(self, bidder):
+        return None
+
+class OfferList(Strategy):
+
+    ''' OfferList makes a list of offers, one every frequency
+        seconds, on the lots it is acknowledged for. Offers that do
+        not beat the current price are skipped, and the bidder quits
+        once they are over.
+
+        Interest in a new lot is declared as soon as it starts. With
+        counter=True, an outbid bidder also answers right away with
+        its next offer, on top of the offers of its timer.
+    '''
+
+    def __init__(self, offers, frequency=1, counter=False):
+
+        self.offers = list(offers)
+        self.frequency = frequency
+        self.counter = counter
+
+    def actions(self, status):
+
+        ''' the next action, given the status of the bidder '''
+
+        response = None
+
+        if not status: return response
+
+        # if my offers are over, I must quit
+        if not self.offers:
+            response = "quit"
+            return response
+
+        if status['bidding'] and not status['acknowledged']:
+            response = "int"
+
+        elif status['bidding'] and status['acknowledged']:
+
+            offer = self.offers.pop(0)
+
+            # if my offer is good, send it to the auctioneer
+            if offer > status['min_price']:
+                response = "bid " + str(offer)
+
+            else:
+                # wait for next item
+                response = None
+
+        # return my next to-do response
+        return response
+
+    def on_start_bid(self, bidder, msg):
+
+        # declare interest, without spending an offer
+        if self.offers:
+            return "int"
+
+        return None
+
+    def on_new_high_bid(self, bidder, msg):
+
+        # outbid by someone else: make my next offer
+        if (self.counter and bidder.status['acknowledged'] and
+                msg['bidder'] != bidder.username):
+            return self.actions(bidder.status)
+
+        return None
+
+    def on_timer(self, bidder):
+        return self.actions(bidder.status)
@@ -0,0 +1,98 @@
+#!/usr/bin/python
+
+''' Monotonic-clock timers for the event loop.
+
+    Timers keeps one-shot timers in a binary heap ordered by their
+    deadline. The event loop asks for the time left until the first
+    deadline to bound its poll, and runs the timers that are due
+    once the poll returns. Nothing runs inside a signal handler.
+'''
+
+import time, heapq
+from itertools import count
+
+class Timer(object):
+
+    ''' a scheduled call, returned by Timers.call_at() '''
+
+    __slots__ = ('when', 'callback', 'args', 'cancelled')
+
+    def __init__(self, when, callback, args):
+
+        self.when = when
+        (self.callback, self.args) = (callback, args)
+        self.cancelled = False
+
+    def cancel(self):
+
+        ''' O(1): the heap entry is dropped once it reaches the top '''
+
+        self.cancelled = True
+
+
+class Timers(object):
+
+    ''' Timers is a heap of Timer objects. Cancelled timers are
+        removed lazily, so cancel() never has to search the heap.
+    '''
+
+    def __init__(self, clock=time.monotonic):
+
+        self.clock = clock
+
+        # (deadline, sequence number, timer) entries. The sequence
+        # number keeps timers with equal deadlines in FIFO order.
+        self.heap = []
+        self.sequence = count()
+
+    def __len__(self):
+        return sum(1 for entry in self.heap if not entry[2].cancelled)
+
+    def call_at(self, when, callback, *args):
+
+        ''' schedules callback(*args) at the (monotonic) time when '''
+
+        timer = Timer(when, callback, args)
+        heapq.heappush(self.heap, (when, next(self.sequence), timer))
+
+        return timer
+
+    def call_later(self, delay, callback, *args):
+
+        ''' schedules callback(*args) after delay seconds '''
+
+        return self.call_at(self.clock() + delay, callback, *args)
+
+    def timeout(self):
+
+        ''' seconds until the first deadline, None if no timer
+            is scheduled. Used as the timeout of the next poll. '''
+
+        heap = self.heap
+
+        # discard cancelled timers on top of the heap
+        while heap and heap[0][2].cancelled:
+            heapq.heappop(heap)
+
+        if not heap: return None
+
+        return max(0, heap[0][0] - self.clock())
+
+    def run_due(self):
+
+        ''' runs every timer whose deadline has passed, in order of
+            deadline. Returns the number of timers run. '''
+
+        (heap, now, ran) = (self.heap, self.clock(), 0)
+
+        while heap and heap[0][0] <= now:
+
+            timer = heapq.heappop(heap)[2]
+            if timer.cancelled: continue
+
+            # one-shot: cancelling a timer that ran is harmless
+            timer.cancelled = True
+            timer.callback(*timer.args)
+            ran += 1
+
+        return ran
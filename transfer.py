@@ -0,0 +1,103 @@
+#!/usr/bin/python
+
+''' Streaming state transfer to a server that rejoins the auction.
+
+    A server that restarts mid-auction sends a JoinMsg to each of its
+    peers, asking the first one (the donor) for the state of the
+    auction. The donor streams its items over its new link to the
+    rejoining server, one StateChunkMsg at a time, so that it keeps
+    serving its own bidders meanwhile. The open lots follow in a
+    StateEndMsg, then the sync messages the donor held back during
+    the transfer. From then on the link is an ordinary peer link.
+'''
+
+import time
+
+from base import log
+
+class StateTransfer(object):
+
+    ''' StateTransfer stands in for the link of the donor to a
+        rejoining server while the state of the auction is streamed
+        over it. Sync messages written to it meanwhile are deferred
+        until the end of the stream.
+
+        A chunk of chunk_items items is sent every pause seconds, as
+        long as less than max_backlog bytes are still queued on the
+        link (backlog() returns their number).
+    '''
+
+    def __init__(self, server, link, backlog, chunk_items=512,
+                 pause=0.001, max_backlog=256 * 1024):
+
+        (self.server, self.link, self.backlog) = (server, link, backlog)
+
+        (self.chunk_items, self.pause) = (chunk_items, pause)
+        self.max_backlog = max_backlog
+
+        # sync batches written during the transfer
+        self.deltas = []
+
+        # first item id of the next chunk
+        self.next_id = 1
+        self.done = False
+
+        # statistics
+        self.started = time.monotonic()
+        (self.chunks, self.sent) = (0, 0)
+
+    def write(self, data):
+
+        ''' sends a sync batch, once the state has been sent '''
+
+        if self.done:
+            self.link.write(data)
+        else:
+            self.deltas.append(data)
+
+    def close(self):
+        self.link.close()
+
+    def send(self, msg):
+
+        data = msg.send(self.server.peer_codec)
+        self.link.write(data)
+        self.sent += len(data)
+
+    def start(self):
+
+        log('streaming {0} items to a rejoining server'.format(
+                self.server.items.last_id()))
+
+        self.step()
+
+    def step(self):
+
+        ''' timer callback: sends the next chunk, unless the link is
+            still busy with the previous ones '''
+
+        if self.next_id > self.server.items.last_id():
+            self.finish()
+            return
+
+        if self.backlog() < self.max_backlog:
+            self.send(self.server.state_chunk(self.next_id,
+                                              self.chunk_items))
+            self.next_id += self.chunk_items
+            self.chunks += 1
+
+        self.server.call_at(time.monotonic() + self.pause, self.step)
+
+    def finish(self):
+
+        ''' sends the open lots, then the deferred sync messages '''
+
+        self.send(self.server.state_end())
+        self.done = True
+
+        (deltas, self.deltas) = (self.deltas, [])
+        if deltas:
+            self.link.write(b''.join(deltas))
+
+        log('state transfer done: {0} chunks, {1} bytes in {2:.3f}s'.format(
+                self.chunks, self.sent, time.monotonic() - self.started))
@@ -0,0 +1,134 @@
+#!/usr/bin/python
+
+''' An append-only log of the auction events of a server.
+
+    Every state change that matters for recovery (accepted prices,
+    lots opened and closed, registrations) is appended to the log as
+    a record, framed exactly like a JSON message, with the record
+    kind as its header. Records are only buffered by append(); the
+    server calls commit() once per event loop iteration, which writes
+    all the records of the iteration and syncs them to disk with a
+    single fdatasync() (group commit).
+'''
+
+import os
+
+import serializer as serial
+
+# fdatasync() skips the metadata that fsync() also flushes
+_datasync = getattr(os, 'fdatasync', os.fsync)
+
+class WriteAheadLog(object):
+
+    ''' WriteAheadLog appends records to the file at path. With
+        sync=False commits are left to the page cache, which is
+        only meant for comparisons.
+
+        A record cut short by a crash at the end of an existing log
+        is cut off first (see complete_length()), so that the new
+        records are not glued onto it.
+    '''
+
+    def __init__(self, path, sync=True):
+
+        self.path = path
+        self.sync = sync
+
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND,
+                          0o644)
+
+        # O_APPEND writes go to the end, wherever it is after this
+        end = complete_length(path)
+        if end < os.fstat(self.fd).st_size:
+            os.ftruncate(self.fd, end)
+            if self.sync:
+                _datasync(self.fd)
+
+        # encoded records of the current group
+        self.group = []
+
+        # statistics: records and groups committed
+        (self.records, self.commits) = (0, 0)
+
+    def append(self, kind, **fields):
+
+        ''' buffers a record until the next commit() '''
+
+        self.group.append(serial.encode_msg(kind, fields))
+
+    def commit(self):
+
+        ''' writes the buffered records and waits until they are
+            on disk. Returns the number of records committed. '''
+
+        if not self.group: return 0
+
+        (group, self.group) = (self.group, [])
+
+        data = memoryview(bytes(''.join(group), 'ascii'))
+        while data:
+            data = data[os.write(self.fd, data):]
+
+        if self.sync:
+            _datasync(self.fd)
+
+        self.records += len(group)
+        self.commits += 1
+
+        return len(group)
+
+    def truncate(self):
+
+        ''' empties the log, once a snapshot covers every record
+            in it. The records that are not committed yet are kept. '''
+
+        os.ftruncate(self.fd, 0)
+
+        if self.sync:
+            _datasync(self.fd)
+
+    def close(self):
+
+        self.commit()
+        os.close(self.fd)
+
+
+def complete_length(path, chunk=4096):
+
+    ''' the length of a log up to the end of its last complete
+        record, i.e. without a record cut short by a crash '''
+
+    with open(path, 'rb') as fd:
+
+        end = fd.seek(0, os.SEEK_END)
+
+        # every record ends with the delimiter: look for the
+        # last one, from the end of the file backwards
+        while end > 0:
+            start = max(0, end - chunk)
+            fd.seek(start)
+
+            last = fd.read(end - start).rfind(b'|')
+            if last >= 0:
+                return start + last + 1
+
+            end = start
+
+    return 0
+
+def read_log(path, chunk=65536):
+
+    ''' yields the records of a log in order, as dicts. A record cut
+        short by a crash (the last one, if any) is ignored, and so
+        are records that do not decode (see FrameDecoder). '''
+
+    decoder = serial.FrameDecoder()
+
+    with open(path, 'rb') as fd:
+        while True:
+            data = fd.read(chunk)
+            if not data: break
+
+            decoder.feed(data)
+            for record in decoder.messages():
+                yield record